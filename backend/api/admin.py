@@ -4,8 +4,53 @@ from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.forms import ReadOnlyPasswordHashField
 from django.contrib.auth.models import Group
 from django.core.exceptions import ValidationError
-
-from .models import Message, User, Favorite
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.utils.functional import cached_property
+
+from .models import Message, User, Favorite, Job
+from .moderation import delete_messages, purge_user_content
+
+
+def estimate_count(model, using: str) -> int:
+    """
+    Cheap estimate of the number of rows in the table of `model`: the planner statistics on PostgreSQL,
+    elsewhere the largest primary key, which overestimates by the number of deleted rows.
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        if row is not None and row[0] > 0:
+            return row[0]
+    return model.objects.using(using).aggregate(max=Max('pk'))['max'] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Changelist paginator that never counts more than `count_limit` rows. Larger results report the estimated size
+    of the whole table instead, an upper bound under which the last pages of a filtered changelist may be empty.
+    """
+    count_limit = 10000
+
+    @cached_property
+    def count(self) -> int:
+        queryset = self.object_list
+        count = queryset[:self.count_limit + 1].count()
+        if count <= self.count_limit:
+            return count
+        return max(estimate_count(queryset.model, queryset.db), count)
+
+
+class ScaleSafeAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for tables too large to count: an estimated count and no second count of the unfiltered
+    table next to filtered results.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 class UserChangeForm(forms.ModelForm):
@@ -42,7 +87,8 @@ class UserCreationForm(forms.ModelForm):
         return user
 
 
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(ScaleSafeAdmin, BaseUserAdmin):
+    actions = ['purge_content']
     form = UserChangeForm
     add_form = UserCreationForm
     list_display = ('username', 'email', 'is_superuser', 'is_staff')
@@ -61,16 +107,47 @@ class UserAdmin(BaseUserAdmin):
     ordering = ('username', 'email')
     filter_horizontal = ()
 
+    @admin.action(description='Delete messages and favorites of selected users', permissions=['delete'])
+    def purge_content(self, request, queryset):
+        messages, favorites = purge_user_content(list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, f'Deleted {messages} messages and {favorites} favorites.')
+
 
-class MessageAdmin(admin.ModelAdmin):
+class MessageAdmin(ScaleSafeAdmin):
     list_display = ('text', 'created', 'owner', 'parent')
+    list_select_related = ('owner', 'parent')
+    autocomplete_fields = ('owner',)
+    raw_id_fields = ('parent',)
+    date_hierarchy = 'created'
+    actions = ['delete_threads']
+
+    def get_actions(self, request):
+        # The stock action lists every reply it would cascade to on its confirmation page and deletes row by row.
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
 
+    @admin.action(description='Delete selected messages with all replies', permissions=['delete'])
+    def delete_threads(self, request, queryset):
+        deleted = delete_messages(queryset)
+        self.message_user(request, f'Deleted {deleted} messages.')
 
-class FavoriteAdmin(admin.ModelAdmin):
+
+class FavoriteAdmin(ScaleSafeAdmin):
     list_display = ('user', 'message', 'created')
+    list_select_related = ('user', 'message')
+    autocomplete_fields = ('user',)
+    raw_id_fields = ('message',)
+    date_hierarchy = 'created'
+
+
+class JobAdmin(ScaleSafeAdmin):
+    list_display = ('name', 'args', 'status', 'attempts', 'run_at', 'created')
+    list_filter = ('status', 'name')
 
 
 admin.site.register(User, UserAdmin)
 admin.site.register(Message, MessageAdmin)
 admin.site.register(Favorite, FavoriteAdmin)
+admin.site.register(Job, JobAdmin)
 admin.site.unregister(Group)
@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .database import configure_connection
+        from .search import install_search_index
+        from .tokens import install_token_indexes
+        post_migrate.connect(lambda using, **kwargs: install_search_index(using), sender=self, weak=False)
+        post_migrate.connect(lambda using, **kwargs: install_token_indexes(using), sender=self, weak=False)
+        connection_created.connect(configure_connection, weak=False)
@@ -0,0 +1,135 @@
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+
+
+class RepresentationCache:
+    """
+    Read-through cache of serialized message and user representations.
+
+    Representations contain absolute hyperlinks, so entries are keyed by the site base URL.
+    Every base URL that has been served is remembered, which lets invalidation drop an object
+    for all of them. Cached message representations never include the per-viewer `favorited` flag.
+    Message list pages only store ids and are keyed by a generation number, which is bumped whenever
+    the set of messages changes. Pages of the hot feed are also keyed by a ranking generation, which is bumped
+    whenever favorites move the hot score of a message.
+
+    The remembered base URLs and the generations live in the `meta_alias` cache, which must not cull or expire
+    them and should hold nothing else: otherwise invalidation could miss entries of forgotten bases, and a reset
+    generation would serve pages that were invalidated before.
+    """
+    bases_key = 'bases'
+    generation_key = 'messages:generation'
+    ranking_key = 'messages:ranking'
+    user_expand_variants = ('', 'favorites', 'messages', 'favorites,messages')
+
+    def __init__(self, alias: str, meta_alias: str):
+        self.alias = alias
+        self.meta_alias = meta_alias
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def meta(self):
+        return caches[self.meta_alias]
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def record(self, hits: int, misses: int):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def clear(self):
+        self.cache.clear()
+        self.meta.delete_many([self.bases_key, self.generation_key, self.ranking_key])
+        with self.lock:
+            self.hits = self.misses = 0
+
+    def get_base(self, request, format: str = None) -> str:
+        base = request.build_absolute_uri('/')
+        if format:
+            base = f'{base}.{format}'
+        bases = self.meta.get(self.bases_key, [])
+        if base not in bases:
+            self.meta.set(self.bases_key, bases + [base], None)
+        return base
+
+    @staticmethod
+    def message_key(base: str, pk) -> str:
+        return f'message:{pk}:{base}'
+
+    @staticmethod
+    def user_key(base: str, pk, expand: str = '') -> str:
+        return f'user:{pk}:{expand}:{base}'
+
+    def page_key(self, base: str, request, ranked: bool = False) -> str:
+        generation = self.meta.get(self.generation_key, 0)
+        if ranked:
+            generation = f'{generation}.{self.meta.get(self.ranking_key, 0)}'
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        return f'messages:{generation}:{path}:{base}'
+
+    def get(self, key: str):
+        value = self.cache.get(key)
+        if value is None:
+            self.record(0, 1)
+        else:
+            self.record(1, 0)
+        return value
+
+    def get_many(self, keys: list) -> dict:
+        found = self.cache.get_many(keys)
+        self.record(len(found), len(keys) - len(found))
+        return found
+
+    def set(self, key: str, value):
+        self.cache.set(key, value)
+
+    def set_many(self, mapping: dict):
+        self.cache.set_many(mapping)
+
+    def invalidate_messages(self, pks, changed: bool = False, reranked: bool = False):
+        self.after_write(self._invalidate_messages, [pk for pk in pks if pk is not None], changed, reranked)
+
+    def invalidate_users(self, pks):
+        self.after_write(self._invalidate_users, [pk for pk in pks if pk is not None])
+
+    def _invalidate_messages(self, pks: list, changed: bool, reranked: bool):
+        bases = self.meta.get(self.bases_key, [])
+        self.cache.delete_many([self.message_key(base, pk) for base in bases for pk in pks])
+        if changed:
+            self.bump(self.generation_key)
+        if reranked:
+            self.bump(self.ranking_key)
+
+    def bump(self, key: str):
+        try:
+            self.meta.incr(key)
+        except ValueError:
+            self.meta.set(key, 1, None)
+
+    def _invalidate_users(self, pks: list):
+        bases = self.meta.get(self.bases_key, [])
+        self.cache.delete_many([self.user_key(base, pk, expand)
+                                for base in bases for pk in pks for expand in self.user_expand_variants])
+
+    @staticmethod
+    def after_write(func, *args):
+        # Drop entries right away and once more after commit, so that a concurrent read
+        # between the two cannot leave the pre-commit state cached.
+        func(*args)
+        if connection.in_atomic_block:
+            transaction.on_commit(lambda: func(*args))
+
+
+representation_cache = RepresentationCache(settings.API_CACHE_ALIAS, settings.API_CACHE_META_ALIAS)
@@ -0,0 +1,61 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+
+class ConditionalGetMixin:
+    """
+    Weak `ETag` and `Last-Modified` validators for safe requests.
+
+    Views implement `get_validators()`, which returns a version string and a last modified datetime
+    taken from cheap queries on `created`/`modified` columns, or None when the resource cannot be validated.
+    Handlers call `check_not_modified()` first and return its 304 response, if any, before any heavy work.
+    Where validators cost about as much as the response, handlers only do so for conditional requests
+    and otherwise call `set_validators()` with validators derived from what they rendered.
+    """
+    conditional_vary_headers = ('Authorization',)
+
+    def get_validators(self):
+        raise NotImplementedError('`get_validators()` must be implemented.')
+
+    @staticmethod
+    def is_conditional(request) -> bool:
+        return 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+
+    def check_not_modified(self, request):
+        self.validators = None
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        self.set_validators(request, self.get_validators())
+        if self.validators is None:
+            return None
+        etag, last_modified = self.validators
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            self.set_validator_headers(response)
+        return response
+
+    def set_validators(self, request, validators):
+        if validators is None:
+            self.validators = None
+            return
+        version, last_modified = validators
+        renderer = getattr(request, 'accepted_renderer', None)
+        version = f'{version}:{request.get_full_path()}:{getattr(renderer, "format", "")}'
+        etag = f'W/"{hashlib.md5(version.encode()).hexdigest()}"'
+        last_modified = int(last_modified.timestamp()) if last_modified is not None else None
+        self.validators = (etag, last_modified)
+
+    def set_validator_headers(self, response):
+        etag, last_modified = self.validators
+        response.headers['ETag'] = etag
+        if last_modified is not None:
+            response.headers['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, self.conditional_vary_headers)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'validators', None) is not None and response.status_code == 200:
+            self.set_validator_headers(response)
+        return response
@@ -0,0 +1,111 @@
+import contextvars
+import random
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+read_alias = contextvars.ContextVar('read_alias', default=None)
+
+
+def apply_pragmas(cursor, pragmas: dict):
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def configure_connection(sender, connection, **kwargs):
+    """
+    `connection_created` receiver applying `API_DATABASE['PRAGMAS']` to new SQLite connections.
+    Connections to read aliases are made read-only and leave the journal mode to the primary,
+    since changing it needs a write.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = dict(settings.API_DATABASE['PRAGMAS'])
+    if connection.alias in settings.API_DATABASE['READ_ALIASES']:
+        pragmas.pop('journal_mode', None)
+        pragmas['query_only'] = 'on'
+    with connection.cursor() as cursor:
+        apply_pragmas(cursor, pragmas)
+
+
+def get_read_aliases() -> list:
+    return [alias for alias in settings.API_DATABASE['READ_ALIASES'] if alias in settings.DATABASES]
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends reads to a random read alias while a `ReplicaReadMixin` view handles a request, everything else to the
+    primary. Reads inside a transaction on the primary stay there, so they see its uncommitted writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = read_alias.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.API_DATABASE['READ_ALIASES']
+
+
+def get_client_key(request) -> str:
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'db:primary:user:{user.pk}'
+    return f'db:primary:ip:{request.META.get("REMOTE_ADDR")}'
+
+
+def pin_to_primary(request):
+    caches[settings.API_DATABASE['CACHE_ALIAS']].set(get_client_key(request), True,
+                                                     settings.API_DATABASE['STICKY_SECONDS'])
+
+
+def is_pinned_to_primary(request) -> bool:
+    return caches[settings.API_DATABASE['CACHE_ALIAS']].get(get_client_key(request), False)
+
+
+class ReplicaReadMixin:
+    """
+    Serve safe requests of a view from a read alias, unless the client wrote in the last
+    `API_DATABASE['STICKY_SECONDS']` and must read its own writes from the primary.
+
+    Authentication, permissions and throttles run on the primary before the alias is chosen.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        aliases = get_read_aliases()
+        if request.method in SAFE_METHODS and aliases and not is_pinned_to_primary(request):
+            self.read_alias_token = read_alias.set(random.choice(aliases))
+
+    def dispatch(self, request, *args, **kwargs):
+        self.read_alias_token = None
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self.read_alias_token is not None:
+                read_alias.reset(self.read_alias_token)
+
+
+class ReadYourWritesMiddleware:
+    """
+    Pins clients to the primary after every successful unsafe request, see `ReplicaReadMixin`.
+    Clients are told apart by user once a view authenticated them, or else by address.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400 and get_read_aliases():
+            pin_to_primary(request)
+        return response
@@ -0,0 +1,92 @@
+import csv
+import io
+import json
+import zlib
+
+from .models import Message, User, Favorite
+
+# Exported columns of every table, as (name, field lookup). Messages use the import_messages format.
+TABLES = {
+    'users': (User, [('id', 'id'), ('username', 'username'), ('email', 'email'), ('is_staff', 'is_staff'),
+                     ('is_active', 'is_active'), ('last_login', 'last_login'), ('message_count', 'message_count'),
+                     ('favorite_count', 'favorite_count')]),
+    'messages': (Message, [('id', 'id'), ('parent', 'parent_id'), ('owner', 'owner__username'), ('text', 'text'),
+                           ('created', 'created'), ('favorite_count', 'favorite_count'),
+                           ('reply_count', 'reply_count')]),
+    'favorites': (Favorite, [('id', 'id'), ('user', 'user_id'), ('message', 'message_id'), ('created', 'created')]),
+}
+FORMATS = ('ndjson', 'csv')
+
+
+def encode_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def get_tables(names: str) -> list[str]:
+    """
+    Parse a comma separated list of table names, raising ValueError for unknown ones.
+    """
+    tables = [name.strip() for name in names.split(',') if name.strip()]
+    unknown = [name for name in tables if name not in TABLES]
+    if unknown or not tables:
+        raise ValueError(f'Unknown tables {", ".join(unknown)}, expected some of {", ".join(TABLES)}.')
+    return tables
+
+
+def export_rows(table: str, after: int = None, chunk_size: int = 2000):
+    """
+    Iterate over the rows of `table` in id order, starting after the id `after`, without loading them all at once.
+    """
+    model, columns = TABLES[table]
+    queryset = model.objects.order_by('pk')
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    return queryset.values_list(*[lookup for _, lookup in columns]).iterator(chunk_size=chunk_size)
+
+
+def export_board(tables: list[str], format: str = 'ndjson', after: int = None, compress: bool = False,
+                 chunk_size: int = 2000):
+    """
+    Yield the export of `tables` as chunks of bytes, in constant memory.
+
+    NDJSON lines carry the `table` they come from, so several tables can share one file. CSV has a header row
+    and one table only. `after` resumes the first table after the last id already exported; later tables
+    start from the beginning. With `compress`, the output is a gzip stream.
+    """
+    if format not in FORMATS:
+        raise ValueError(f'Unknown format {format}, expected one of {", ".join(FORMATS)}.')
+    if format == 'csv' and len(tables) != 1:
+        raise ValueError('CSV exports contain exactly one table.')
+    chunks = (chunk.encode() for chunk in format_tables(tables, format, after, chunk_size))
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def format_tables(tables: list[str], format: str, after: int, chunk_size: int):
+    for index, table in enumerate(tables):
+        names = [name for name, _ in TABLES[table][1]]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if format == 'csv':
+            writer.writerow(names)
+        rows = export_rows(table, after if index == 0 else None, chunk_size)
+        for count, row in enumerate(rows, 1):
+            row = [encode_value(value) for value in row]
+            if format == 'csv':
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps({'table': table, **dict(zip(names, row))}, separators=(',', ':')) + '\n')
+            if count % chunk_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,249 @@
+import bisect
+import contextvars
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils import timezone
+
+from .cache import representation_cache
+from .pubsub import hub
+from .throttling import metrics as throttle_metrics
+
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+
+class Timings:
+    """
+    Time spent by one request in SQL queries and serializers.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.serializer_time = 0.0
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_time += time.perf_counter() - start
+
+    def server_timing(self, duration: float) -> str:
+        return ', '.join([
+            f'db;dur={self.query_time * 1000:.1f};desc="{self.queries} queries"',
+            f'serialize;dur={self.serializer_time * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ])
+
+
+@contextmanager
+def timing(name: str):
+    """
+    Add the time spent in the block to the `<name>_time` of the current request, if it is instrumented.
+    """
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(timings, f'{name}_time', getattr(timings, f'{name}_time') + time.perf_counter() - start)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip([*map(str, self.buckets), '+Inf'], self.counts):
+            total += count
+            yield bound, total
+
+
+class Registry:
+    """
+    Request metrics of the current process, rendered in the Prometheus text format.
+    """
+
+    def __init__(self, buckets):
+        self.lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.latency = defaultdict(lambda: Histogram(self.buckets))
+            self.requests = defaultdict(int)
+            self.queries = defaultdict(int)
+            self.query_time = defaultdict(float)
+            self.serializer_time = defaultdict(float)
+
+    def record(self, view: str, method: str, status: int, duration: float, timings: Timings):
+        with self.lock:
+            self.latency[view, method].observe(duration)
+            self.requests[view, method, str(status)] += 1
+            self.queries[view, method] += timings.queries
+            self.query_time[view, method] += timings.query_time
+            self.serializer_time[view, method] += timings.serializer_time
+
+    def render(self) -> str:
+        lines = []
+
+        def family(name: str, kind: str, description: str, samples):
+            lines.extend([f'# HELP {name} {description}', f'# TYPE {name} {kind}'])
+            for suffix, labels, value in samples:
+                label_text = ','.join(f'{key}="{escape(value)}"' for key, value in labels.items())
+                lines.append(f'{name}{suffix}{{{label_text}}} {value}' if labels else f'{name}{suffix} {value}')
+
+        with self.lock:
+            family('api_request_duration_seconds', 'histogram', 'Request latency by view.', [
+                sample
+                for (view, method), histogram in sorted(self.latency.items())
+                for sample in [
+                    *[('_bucket', {'view': view, 'method': method, 'le': bound}, count)
+                      for bound, count in histogram.cumulative()],
+                    ('_sum', {'view': view, 'method': method}, histogram.sum),
+                    ('_count', {'view': view, 'method': method}, sum(histogram.counts)),
+                ]
+            ])
+            family('api_requests_total', 'counter', 'Requests by view and status.', [
+                ('', {'view': view, 'method': method, 'status': status}, count)
+                for (view, method, status), count in sorted(self.requests.items())
+            ])
+            for name, values, description in [
+                ('api_db_queries_total', self.queries, 'SQL queries by view.'),
+                ('api_db_query_seconds_total', self.query_time, 'Time spent in SQL queries by view.'),
+                ('api_serializer_seconds_total', self.serializer_time, 'Time spent in serializers by view.'),
+            ]:
+                family(name, 'counter', description, [
+                    ('', {'view': view, 'method': method}, value) for (view, method), value in sorted(values.items())
+                ])
+        cache = representation_cache.stats()
+        family('api_cache_requests_total', 'counter', 'Representation cache lookups.', [
+            ('', {'result': 'hit'}, cache['hits']), ('', {'result': 'miss'}, cache['misses']),
+        ])
+        family('api_throttle_rejections_total', 'counter', 'Requests rejected by throttles.', [
+            ('', {'scope': scope}, count) for scope, count in sorted(throttle_metrics.stats().items())
+        ])
+        family('api_stream_subscribers', 'gauge', 'Open event stream connections.', [('', {}, hub.subscriber_count())])
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class InstrumentationMiddleware:
+    """
+    Records latency, SQL queries and serializer time of every request into `registry`,
+    reports them in a `Server-Timing` header and profiles a sample of staff requests.
+
+    The whole middleware is left out when `API_INSTRUMENTATION['ENABLED']` is false. For async views,
+    queries run in other threads and only latency is recorded; streamed bodies are not included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.API_INSTRUMENTATION['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = Timings()
+        token = current_timings.set(timings)
+        profiler = self.start_profiler()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings.record_query))
+                response = self.get_response(request)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            current_timings.reset(token)
+        return self.finish(request, response, timings, profiler)
+
+    async def __acall__(self, request):
+        timings = Timings()
+        token = current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings, None)
+
+    @staticmethod
+    def start_profiler():
+        if random.random() >= settings.API_INSTRUMENTATION['PROFILE_SAMPLE_RATE']:
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def finish(self, request, response, timings: Timings, profiler):
+        duration = time.perf_counter() - timings.start
+        match = request.resolver_match
+        view = (match.view_name or match.route) if match is not None else 'unmatched'
+        registry.record(view, request.method, response.status_code, duration, timings)
+        if settings.API_INSTRUMENTATION['SERVER_TIMING']:
+            response.headers['Server-Timing'] = timings.server_timing(duration)
+        # Whether a request is from staff is only known once the view authenticated it.
+        user = getattr(request, 'user', None)
+        if profiler is not None and user is not None and user.is_staff:
+            self.save_profile(request, duration, profiler)
+        return response
+
+    @staticmethod
+    def save_profile(request, duration: float, profiler):
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(settings.API_INSTRUMENTATION['PROFILE_LINES'])
+        profiles.append({
+            'method': request.method,
+            'path': request.get_full_path(),
+            'created': timezone.now(),
+            'duration': duration,
+            'stats': stream.getvalue(),
+        })
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, only served to the addresses in `API_INSTRUMENTATION['METRICS_IPS']`.
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.API_INSTRUMENTATION['METRICS_IPS']:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+registry = Registry(settings.API_INSTRUMENTATION['BUCKETS'])
+profiles = deque(maxlen=settings.API_INSTRUMENTATION['PROFILE_HISTORY'])
@@ -0,0 +1,127 @@
+import logging
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .cache import representation_cache
+from .models import Message, User, Favorite, Job, count_subquery
+
+logger = logging.getLogger(__name__)
+
+handlers = {}
+
+
+def job(name: str):
+    """
+    Register a function as the handler of jobs called `name`. Its arguments must be JSON serializable and
+    it must be idempotent, since jobs are retried after failures and after workers die.
+    """
+    def register(function):
+        handlers[name] = function
+        return function
+    return register
+
+
+def enqueue(name: str, *args, key: str = None, delay: float = 0):
+    """
+    Queue a job once the current transaction commits, so workers never see the rows of a rolled back write.
+    A job with the `key` of another one that has not started yet is dropped.
+
+    With `API_JOBS['EAGER']`, the job runs right away in the calling process instead, and its exceptions propagate.
+    """
+    if name not in handlers:
+        raise ValueError(f'Unknown job {name}.')
+    if settings.API_JOBS['EAGER']:
+        handlers[name](*args)
+        return
+    run_at = timezone.now() + timedelta(seconds=delay)
+    transaction.on_commit(
+        lambda: Job.objects.bulk_create([Job(name=name, args=list(args), key=key, run_at=run_at)],
+                                        ignore_conflicts=True)
+    )
+
+
+def claim(worker: str, limit: int) -> list:
+    """
+    Lock up to `limit` due jobs for `worker`. Jobs locked for longer than `API_JOBS['TIMEOUT']` belong to
+    a worker that died and are claimed again. The status is checked again by the update itself, so concurrent
+    workers never claim the same job.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.API_JOBS['TIMEOUT'])
+    due = Q(status=Job.PENDING, run_at__lte=now) | Q(status=Job.RUNNING, locked_at__lt=stale)
+    ids = list(Job.objects.filter(due).order_by('run_at', 'id').values_list('pk', flat=True)[:limit])
+    if not ids:
+        return []
+    Job.objects.filter(due, pk__in=ids).update(status=Job.RUNNING, locked_by=worker, locked_at=now,
+                                               attempts=F('attempts') + 1)
+    return list(Job.objects.filter(pk__in=ids, locked_by=worker, locked_at=now))
+
+
+def run(job: Job):
+    """
+    Run a claimed job. It is deleted when done, retried with exponential backoff when it fails,
+    and kept as failed after `API_JOBS['MAX_ATTEMPTS']` attempts.
+    """
+    options = settings.API_JOBS
+    try:
+        handler = handlers[job.name]
+        handler(*job.args)
+    except Exception:
+        logger.exception('Job %s %s failed on attempt %s.', job.pk, job.name, job.attempts)
+        job.error = traceback.format_exc()
+        job.locked_by, job.locked_at = '', None
+        if job.attempts >= options['MAX_ATTEMPTS']:
+            job.status = Job.FAILED
+        else:
+            job.status = Job.PENDING
+            backoff = min(options['BACKOFF'] * 2 ** (job.attempts - 1), options['MAX_BACKOFF'])
+            job.run_at = timezone.now() + timedelta(seconds=backoff)
+        try:
+            with transaction.atomic():
+                job.save()
+        except IntegrityError:
+            # The same work was queued again in the meantime, so that job runs it instead.
+            job.delete()
+        return False
+    job.delete()
+    return True
+
+
+def run_pending(worker: str = None, limit: int = None) -> tuple[int, int]:
+    """
+    Claim and run due jobs until none are left, returning the numbers of jobs done and failed.
+    """
+    worker = worker or uuid.uuid4().hex
+    batch_size = settings.API_JOBS['BATCH_SIZE']
+    done = failed = 0
+    while limit is None or done + failed < limit:
+        jobs = claim(worker, batch_size if limit is None else min(batch_size, limit - done - failed))
+        if not jobs:
+            break
+        for claimed in jobs:
+            if run(claimed):
+                done += 1
+            else:
+                failed += 1
+    return done, failed
+
+
+@job('refresh_user_counts')
+def refresh_user_counts(user_id: int):
+    """
+    Recount the messages and favorites of a user. Profile counters do not order any feed, so they are
+    kept off the request path of writes and are recounted instead of incremented, which never drifts.
+    """
+    User.objects.filter(pk=user_id).update(message_count=count_subquery(Message, 'owner'),
+                                           favorite_count=count_subquery(Favorite, 'user'), modified=timezone.now())
+    representation_cache.invalidate_users([user_id])
+
+
+def refresh_user_counts_later(user_id: int):
+    enqueue('refresh_user_counts', user_id, key=f'refresh_user_counts:{user_id}')
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from api.models import Message
+
+
+class Command(BaseCommand):
+    help = 'Fill in the root, depth and path columns of messages created before they existed, one level at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of messages updated per transaction.')
+
+    def handle(self, *args, batch_size: int, **options):
+        total = 0
+        while True:
+            # Posts first, then replies whose parent already has a path, so every batch only reads finished rows.
+            pending = Message.objects.filter(Q(parent=None) | Q(parent__path__gt=''), path='')
+            with transaction.atomic():
+                messages = list(pending.select_related('parent').order_by('pk')[:batch_size])
+                if not messages:
+                    break
+                for message in messages:
+                    parent = message.parent
+                    message.root_id = parent.root_id if parent is not None else message.pk
+                    message.depth = parent.depth + 1 if parent is not None else 0
+                    message.path = (parent.path if parent is not None else '') + Message.path_segment(message.pk)
+                Message.objects.bulk_update(messages, ['root', 'depth', 'path'])
+            total += len(messages)
+        self.stdout.write(self.style.SUCCESS(f'Backfilled thread positions of {total} messages.'))
@@ -0,0 +1,274 @@
+import json
+import math
+import platform
+import time
+import tracemalloc
+from collections import Counter
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.urls import URLPattern, get_resolver, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.cache import representation_cache
+from api.models import Message, User, Favorite
+from api.serializers import CustomTokenObtainPairSerializer
+from api import throttling
+from api.instrumentation import Timings
+
+PASSWORD = 'benchmark-password-1'
+
+# Endpoints that cannot be driven as single request and response round trips.
+SKIPPED = {
+    'stream': 'Server-Sent Events stream served over ASGI, which never completes a response.',
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Nearest-rank percentile of `values`.
+    """
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = ('Drive every API endpoint in-process against the current database and report latency percentiles, '
+            'SQL queries, response size and memory allocated per request. Fill the database with seed_board first. '
+            'Everything the benchmark writes is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Number of timed requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=5, help='Number of untimed requests per scenario.')
+        parser.add_argument('--cold', action='store_true',
+                            help='Clear the representation cache before every request.')
+        parser.add_argument('--only', nargs='+', default=[], help='Run only scenarios containing one of these.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare with.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Relative p50 latency increase reported as a regression.')
+
+    def handle(self, *args, requests: int, warmup: int, cold: bool, only: list, output: str, compare: str,
+               threshold: float, **options):
+        if requests < 1:
+            raise CommandError('--requests must be at least 1.')
+        baseline = self.load_results(compare) if compare else None
+        self.cold = cold
+        report = {
+            'created': timezone.now().isoformat(),
+            'environment': {'python': platform.python_version(), 'django': django.get_version(),
+                            'database': connection.vendor},
+            'options': {'requests': requests, 'warmup': warmup, 'cold': cold},
+            'data': {'users': User.objects.count(), 'messages': Message.objects.count(),
+                     'favorites': Favorite.objects.count()},
+            'results': {},
+            'skipped': SKIPPED,
+        }
+        try:
+            # Like the test runner, requests go to the `testserver` host.
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                scenarios = self.get_scenarios()
+                covered = {url_name for _, url_name, *_ in scenarios}
+                report['uncovered'] = sorted(self.get_url_names() - covered - set(SKIPPED))
+                scenarios = [scenario for scenario in scenarios
+                             if not only or any(name in scenario[0] for name in only)]
+                self.stdout.write(f'{"scenario":<48} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8} '
+                                  f'{"bytes":>9} {"alloc KiB":>10}')
+                for scenario in scenarios:
+                    result = self.run_scenario(scenario, requests, warmup)
+                    report['results'][scenario[0]] = result
+                    self.stdout.write(f'{scenario[0]:<48} {result["p50"]:>8.2f} {result["p95"]:>8.2f} '
+                                      f'{result["p99"]:>8.2f} {result["queries"]:>8} {result["bytes"]:>9} '
+                                      f'{result["allocated_kib"]:>10.1f}')
+                raise Rollback
+        except Rollback:
+            pass
+        for url_name, reason in SKIPPED.items():
+            self.stdout.write(f'Skipped {url_name}: {reason}')
+        if report['uncovered']:
+            self.stdout.write(self.style.WARNING(f'Endpoints without scenarios: {", ".join(report["uncovered"])}'))
+        failed = [name for name, result in report['results'].items()
+                  if any(not status.startswith('2') for status in result['statuses'])]
+        if failed:
+            self.stdout.write(self.style.WARNING(f'Scenarios with unsuccessful responses: {", ".join(failed)}'))
+        if output:
+            with open(output, 'w') as file:
+                json.dump(report, file, indent=2)
+        if baseline is not None:
+            self.compare(baseline, report, threshold)
+
+    @staticmethod
+    def load_results(path: str) -> dict:
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Cannot read results from {path}: {error}')
+
+    @staticmethod
+    def get_url_names() -> set:
+        return {pattern.name for pattern in get_resolver('api.urls').url_patterns
+                if isinstance(pattern, URLPattern) and pattern.name}
+
+    def get_scenarios(self) -> list:
+        """
+        Requests to time, as (name, URL name, method, path, data, user) tuples.
+        Members and staff are created for the run, every other object comes from the seeded board.
+        """
+        message = Message.objects.filter(depth__lt=Message.MAX_DEPTH - 1).order_by('-reply_count', '-id').first()
+        author = User.objects.order_by('-message_count', '-id').first()
+        if message is None or author is None:
+            raise CommandError('The database has no messages to benchmark, run seed_board first.')
+        member = User.objects.create_user('benchmark-member@example.com', 'benchmark-member', PASSWORD)
+        staff = User.objects.create_superuser('benchmark-staff@example.com', 'benchmark-staff', PASSWORD)
+        own = Message.objects.create(owner=member, parent=message, text='Benchmark reply.')
+        unfavorite = Message.objects.exclude(pk=message.pk).order_by('-favorite_count', '-id').first() or own
+        Favorite.objects.create(user=member, message=unfavorite)
+        batch = list(Message.objects.order_by('-id').values_list('pk', flat=True)[:20])
+        # The export scenario streams the newest thousand messages.
+        after = list(Message.objects.order_by('-id').values_list('pk', flat=True)[1000:1001]) or [0]
+        refresh = str(CustomTokenObtainPairSerializer.get_token(member))
+        word = message.text.split()[0] if message.text.split() else 'a'
+
+        def url(name: str, *args) -> str:
+            return reverse(name, args=args)
+
+        return [
+            ('GET api-root', 'api-root', 'get', url('api-root'), None, None),
+            ('GET message-list', 'message-list', 'get', url('message-list'), None, None),
+            ('GET message-list authenticated', 'message-list', 'get', url('message-list'), None, member),
+            ('GET message-list?format=compact', 'message-list', 'get', url('message-list') + '?format=compact',
+             None, member),
+            ('GET message-list?sort=hot', 'message-list', 'get', url('message-list') + '?sort=hot', None, None),
+            ('GET message-list?q=', 'message-list', 'get', url('message-list') + f'?q={word}', None, None),
+            ('POST message-list', 'message-list', 'post', url('message-list'),
+             {'text': 'Benchmark reply.', 'parent': url('message-detail', message.pk)}, member),
+            ('POST message-favorite-batch', 'message-favorite-batch', 'post', url('message-favorite-batch'),
+             {'messages': batch}, member),
+            ('DELETE message-favorite-batch', 'message-favorite-batch', 'delete', url('message-favorite-batch'),
+             {'messages': [unfavorite.pk]}, member),
+            ('GET message-detail', 'message-detail', 'get', url('message-detail', message.pk), None, None),
+            ('PUT message-detail', 'message-detail', 'put', url('message-detail', own.pk),
+             {'text': 'Edited benchmark reply.', 'parent': url('message-detail', message.pk)}, member),
+            ('DELETE message-detail', 'message-detail', 'delete', url('message-detail', own.pk), None, member),
+            ('GET message-children', 'message-children', 'get', url('message-children', message.pk), None, None),
+            ('GET message-thread', 'message-thread', 'get', url('message-thread', message.pk), None, None),
+            ('POST message-favorite-create-destroy', 'message-favorite-create-destroy', 'post',
+             url('message-favorite-create-destroy', message.pk), None, member),
+            ('DELETE message-favorite-create-destroy', 'message-favorite-create-destroy', 'delete',
+             url('message-favorite-create-destroy', unfavorite.pk), None, member),
+            ('GET user-list', 'user-list', 'get', url('user-list'), None, None),
+            ('GET user-list?expand=', 'user-list', 'get', url('user-list') + '?expand=messages,favorites', None,
+             None),
+            ('GET user-detail', 'user-detail', 'get', url('user-detail', author.pk), None, None),
+            ('GET user-message-list', 'user-message-list', 'get', url('user-message-list', author.pk), None, None),
+            ('GET user-message-list?format=compact', 'user-message-list', 'get',
+             url('user-message-list', author.pk) + '?format=compact', None, None),
+            ('GET user-favorite-list', 'user-favorite-list', 'get', url('user-favorite-list', author.pk), None,
+             None),
+            ('GET notification-list', 'notification-list', 'get', url('notification-list'), None, author),
+            ('POST notification-read', 'notification-read', 'post', url('notification-read'), {'all': True},
+             author),
+            ('GET export', 'export', 'get', url('export') + f'?tables=messages&after={after[0]}', None, staff),
+            ('GET metrics', 'metrics', 'get', url('metrics'), None, None),
+            ('GET metrics-profiles', 'metrics-profiles', 'get', url('metrics-profiles'), None, staff),
+            ('POST register', 'register', 'post', url('register'),
+             {'username': 'benchmark-registered', 'email': 'benchmark-registered@example.com',
+              'password': PASSWORD, 'password_repeat': PASSWORD}, None),
+            ('POST token_obtain_pair', 'token_obtain_pair', 'post', url('token_obtain_pair'),
+             {'username': member.username, 'password': PASSWORD}, None),
+            ('POST token_refresh', 'token_refresh', 'post', url('token_refresh'), {'refresh': refresh}, None),
+        ]
+
+    def run_scenario(self, scenario: tuple, requests: int, warmup: int) -> dict:
+        name, _, method, path, data, user = scenario
+        client = APIClient()
+        if user is not None:
+            token = CustomTokenObtainPairSerializer.get_token(user).access_token
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        statuses = Counter()
+        timings = Timings()
+        sizes = []
+
+        def send():
+            if self.cold:
+                representation_cache.clear()
+            # Throttles would reject most of a run, so every request starts with full token buckets.
+            throttling.store.clear()
+            with connection.execute_wrapper(timings.record_query):
+                if method == 'get':
+                    response = client.get(path)
+                else:
+                    response = getattr(client, method)(path, data, format='json')
+                if response.streaming:
+                    sizes.append(len(b''.join(response.streaming_content)))
+                else:
+                    sizes.append(len(response.content))
+            statuses[str(response.status_code)] += 1
+            return response
+
+        def request():
+            if method == 'get':
+                return send()
+            # Writes are undone after every request, so each one sees the same board.
+            try:
+                with transaction.atomic():
+                    send()
+                    raise Rollback
+            except Rollback:
+                pass
+
+        for _ in range(warmup):
+            request()
+        latencies = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            request()
+            latencies.append((time.perf_counter() - start) * 1000)
+        # Allocations are measured in a pass of their own, since tracing them slows every request down.
+        tracemalloc.start()
+        try:
+            request()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return {
+            'path': path,
+            'method': method.upper(),
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'mean': sum(latencies) / len(latencies),
+            # Queries are counted inside the transaction of writes, so they include the view's own savepoints.
+            'queries': round(timings.queries / (warmup + requests + 1), 1),
+            'bytes': round(sum(sizes) / len(sizes)),
+            'allocated_kib': peak / 1024,
+            'statuses': dict(statuses),
+        }
+
+    def compare(self, baseline: dict, report: dict, threshold: float):
+        regressions = []
+        self.stdout.write(f'{"scenario":<48} {"p50 ms":>15} {"change":>8} {"queries":>10}')
+        for name, result in report['results'].items():
+            previous = baseline.get('results', {}).get(name)
+            if previous is None:
+                continue
+            change = result['p50'] / previous['p50'] - 1 if previous['p50'] else 0
+            slower = change > threshold
+            more_queries = result['queries'] > previous['queries']
+            if slower or more_queries:
+                regressions.append(name)
+            line = (f'{name:<48} {previous["p50"]:>6.2f} → {result["p50"]:>6.2f} {change:>+8.0%} '
+                    f'{previous["queries"]:>4} → {result["queries"]:<4}')
+            self.stdout.write(self.style.ERROR(line) if slower or more_queries else line)
+        if regressions:
+            raise CommandError(f'{len(regressions)} scenarios regressed: {", ".join(regressions)}')
+        self.stdout.write(self.style.SUCCESS('No regressions.'))
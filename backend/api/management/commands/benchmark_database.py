@@ -0,0 +1,175 @@
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from array import array
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.database import apply_pragmas
+from api.models import Message
+
+from .benchmark_api import percentile
+
+# Connection settings compared by the benchmark. `stock` is what SQLite and Django use without any tuning.
+PROFILES = {
+    'stock': lambda: {'journal_mode': 'delete', 'synchronous': 'full'},
+    'tuned': lambda: settings.API_DATABASE['PRAGMAS'],
+}
+
+
+class Command(BaseCommand):
+    help = ('Measure read throughput of concurrent readers while a writer keeps favoriting messages, on a copy of '
+            'the current SQLite database, with stock and tuned connection settings. Readers and the writer are '
+            'processes, like the workers of an application server.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8],
+                            help='Numbers of concurrent readers to measure with.')
+        parser.add_argument('--duration', type=float, default=3.0, help='Seconds each measurement runs for.')
+        parser.add_argument('--write-rate', type=float, default=100.0,
+                            help='Write transactions per second attempted by the writer, 0 for none.')
+        parser.add_argument('--profiles', nargs='+', choices=list(PROFILES), default=list(PROFILES))
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, workers: list, duration: float, write_rate: float, profiles: list, output: str,
+               seed: int, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Only SQLite databases can be benchmarked.')
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'benchmark.sqlite3')
+            source = sqlite3.connect(str(connection.settings_dict['NAME']), uri=True)
+            target = sqlite3.connect(path)
+            try:
+                source.backup(target)
+                ids = [pk for pk, in target.execute(f'SELECT id FROM {Message._meta.db_table}')] or [0]
+            finally:
+                source.close()
+                target.close()
+            self.stdout.write(f'{"profile":<8} {"readers":>8} {"reads/s":>10} {"read p95 ms":>12} '
+                              f'{"writes/s":>9} {"errors":>7}')
+            for profile in profiles:
+                pragmas = dict(PROFILES[profile]())
+                setup = sqlite3.connect(path)
+                try:
+                    # The journal mode belongs to the file, so it is switched once before any reader connects.
+                    apply_pragmas(setup.cursor(), {'journal_mode': pragmas.pop('journal_mode', 'delete')})
+                finally:
+                    setup.close()
+                results[profile] = []
+                for count in workers:
+                    result = self.measure(path, pragmas, count, duration, write_rate, ids, seed)
+                    results[profile].append(result)
+                    self.stdout.write(f'{profile:<8} {count:>8} {result["reads_per_second"]:>10.0f} '
+                                      f'{result["read_p95"] or 0:>12.2f} {result["writes_per_second"]:>9.1f} '
+                                      f'{result["errors"]:>7}')
+        if output:
+            with open(output, 'w') as file:
+                json.dump({'duration': duration, 'write_rate': write_rate, 'messages': len(ids),
+                           'results': results}, file, indent=2)
+
+    @staticmethod
+    def measure(path: str, pragmas: dict, workers: int, duration: float, write_rate: float, ids: list,
+                seed: int) -> dict:
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+        start = context.Event()
+        results = context.Queue()
+        processes = [context.Process(target=read_worker, args=(path, pragmas, ids, duration, seed + index, start,
+                                                                results))
+                     for index in range(workers)]
+        if write_rate > 0:
+            processes.append(context.Process(target=write_worker, args=(path, pragmas, ids, duration, write_rate,
+                                                                       seed, start, results)))
+        for process in processes:
+            process.start()
+        start.set()
+        latencies = []
+        writes = errors = 0
+        for _ in processes:
+            kind, values, failed = results.get()
+            if kind == 'read':
+                latencies.extend(values)
+            else:
+                writes += values
+            errors += failed
+        for process in processes:
+            process.join()
+        return {
+            'workers': workers,
+            'reads': len(latencies),
+            'reads_per_second': len(latencies) / duration,
+            'read_p50': percentile(latencies, 0.5) if latencies else None,
+            'read_p95': percentile(latencies, 0.95) if latencies else None,
+            'writes_per_second': writes / duration,
+            'errors': errors,
+        }
+
+
+def connect(path: str, pragmas: dict):
+    database = sqlite3.connect(path, isolation_level=None)
+    apply_pragmas(database.cursor(), pragmas)
+    return database
+
+
+def read_worker(path: str, pragmas: dict, ids: list, duration: float, seed: int, start, results):
+    """
+    Run the queries of message list, detail and children pages until `duration` is over.
+    """
+    table = Message._meta.db_table
+    columns = 'id, text, created, owner_id, parent_id, favorite_count, reply_count'
+    queries = [
+        (f'SELECT {columns} FROM {table} ORDER BY created DESC, id DESC LIMIT 10 OFFSET ?',
+         lambda: [rng.randrange(100)]),
+        (f'SELECT {columns} FROM {table} WHERE id = ?', lambda: [rng.choice(ids)]),
+        (f'SELECT {columns} FROM {table} WHERE parent_id = ? ORDER BY created DESC, id DESC LIMIT 10',
+         lambda: [rng.choice(ids)]),
+    ]
+    rng = random.Random(seed)
+    database = connect(path, pragmas)
+    latencies = array('d')
+    errors = 0
+    start.wait()
+    end = time.perf_counter() + duration
+    while (now := time.perf_counter()) < end:
+        sql, params = rng.choice(queries)
+        try:
+            database.execute(sql, params()).fetchall()
+        except sqlite3.OperationalError:
+            errors += 1
+            continue
+        latencies.append((time.perf_counter() - now) * 1000)
+    database.close()
+    results.put(('read', latencies, errors))
+
+
+def write_worker(path: str, pragmas: dict, ids: list, duration: float, write_rate: float, seed: int, start,
+                 results):
+    """
+    Favorite random messages in transactions of their own, `write_rate` times a second, until `duration` is over.
+    """
+    table = Message._meta.db_table
+    rng = random.Random(seed)
+    database = connect(path, pragmas)
+    writes = errors = 0
+    start.wait()
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        try:
+            database.execute('BEGIN IMMEDIATE')
+            database.execute(f'UPDATE {table} SET favorite_count = favorite_count + 1 WHERE id = ?', [rng.choice(ids)])
+            database.execute('COMMIT')
+            writes += 1
+        except sqlite3.OperationalError:
+            if database.in_transaction:
+                database.execute('ROLLBACK')
+            errors += 1
+        time.sleep(1 / write_rate)
+    database.close()
+    results.put(('write', writes, errors))
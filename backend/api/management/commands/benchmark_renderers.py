@@ -0,0 +1,91 @@
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api import renderers
+from api.models import Message
+from api.serializers import COMPACT_MESSAGE_EXPRESSIONS, COMPACT_MESSAGE_FIELDS, MessageSerializer, compact_messages
+
+
+class Command(BaseCommand):
+    help = ('Compare building and rendering a page of messages in the full hyperlinked representation '
+            'and in the compact one, with DRF\'s renderer, orjson and the stdlib fallback. '
+            'Fill the database with seed_board first.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=100, help='Number of messages on the page.')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of timed runs per pipeline.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+
+    def handle(self, *args, messages: int, repeat: int, output: str, **options):
+        if repeat < 1:
+            raise CommandError('--repeat must be at least 1.')
+        queryset = Message.objects.order_by('-created', '-id')[:messages]
+        if not queryset.exists():
+            raise CommandError('The database has no messages to benchmark, run seed_board first.')
+        # Hyperlinks are built for the `testserver` host, like in the test runner.
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            request = Request(APIRequestFactory().get('/api/messages/'))
+
+            def full():
+                return MessageSerializer(list(queryset), many=True, context={'request': request}).data
+
+            def compact():
+                rows = queryset.values(*COMPACT_MESSAGE_FIELDS, **COMPACT_MESSAGE_EXPRESSIONS)
+                return compact_messages(list(rows), None)
+
+            pipelines = [
+                ('full, DRF JSONRenderer', full, JSONRenderer(), True),
+                ('full, FastJSONRenderer', full, renderers.FastJSONRenderer(), True),
+                ('compact, orjson', compact, renderers.CompactJSONRenderer(), True),
+                ('compact, stdlib', compact, renderers.CompactJSONRenderer(), False),
+            ]
+            if renderers.orjson is None:
+                self.stdout.write(self.style.WARNING('orjson is not installed, only the stdlib fallback is timed.'))
+            results = {}
+            self.stdout.write(f'{"pipeline":<28} {"build ms":>9} {"render ms":>10} {"bytes":>9}')
+            for name, build, renderer, use_orjson in pipelines:
+                results[name] = result = self.run_pipeline(build, renderer, use_orjson, repeat)
+                self.stdout.write(f'{name:<28} {result["build_ms"]:>9.2f} {result["render_ms"]:>10.2f} '
+                                  f'{result["bytes"]:>9}')
+        baseline = results['full, DRF JSONRenderer']
+        best = results['compact, orjson']
+        self.stdout.write(self.style.SUCCESS(
+            f'Compact with orjson: {baseline["bytes"] / best["bytes"]:.1f}x smaller, '
+            f'{baseline["render_ms"] / best["render_ms"]:.1f}x faster to render, '
+            f'{(baseline["build_ms"] + baseline["render_ms"]) / (best["build_ms"] + best["render_ms"]):.1f}x '
+            f'faster overall.'
+        ))
+        if output:
+            with open(output, 'w') as file:
+                json.dump({'messages': messages, 'repeat': repeat, 'results': results}, file, indent=2)
+
+    @staticmethod
+    def run_pipeline(build, renderer, use_orjson: bool, repeat: int) -> dict:
+        orjson = renderers.orjson
+        if not use_orjson:
+            renderers.orjson = None
+        try:
+            build_times, render_times = [], []
+            for _ in range(repeat + 1):
+                start = time.perf_counter()
+                data = build()
+                built = time.perf_counter()
+                content = renderer.render(data)
+                build_times.append((built - start) * 1000)
+                render_times.append((time.perf_counter() - built) * 1000)
+        finally:
+            renderers.orjson = orjson
+        # The first run is a warmup.
+        return {
+            'build_ms': statistics.median(build_times[1:]),
+            'render_ms': statistics.median(render_times[1:]),
+            'bytes': len(content),
+        }
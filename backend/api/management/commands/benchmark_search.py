@@ -0,0 +1,62 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Message, User
+from api.search import search_messages
+
+
+PAGE_SIZE = 10
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Measure full-text search latency against a substring scan on growing synthetic message tables. '
+            'All rows are created inside a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help='Numbers of messages to measure at.')
+        parser.add_argument('--queries', type=int, default=50, help='Number of queries per measurement.')
+        parser.add_argument('--vocabulary', type=int, default=100000, help='Number of distinct words in messages.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, sizes: list, queries: int, vocabulary: int, seed: int, **options):
+        random.seed(seed)
+        words = [f'w{i:06d}' for i in range(vocabulary)]
+        try:
+            with transaction.atomic():
+                owner = User.objects.create(username='benchmark-search', email='benchmark-search@example.com')
+                created = 0
+                self.stdout.write(f'{"messages":>10} {"search p50 ms":>14} {"scan p50 ms":>12}')
+                for size in sorted(sizes):
+                    Message.objects.bulk_create(
+                        (Message(text=' '.join(random.choices(words, k=12)), owner=owner)
+                         for _ in range(size - created)),
+                        batch_size=1000,
+                    )
+                    created = size
+                    terms = random.choices(words, k=queries)
+                    search = self.measure(
+                        lambda term: search_messages(Message.objects.all(), term).order_by('-rank', '-id'), terms
+                    )
+                    scan = self.measure(lambda term: Message.objects.filter(text__icontains=term).order_by('-id'), terms)
+                    self.stdout.write(f'{size:>10} {search:>14.3f} {scan:>12.3f}')
+                raise Rollback
+        except Rollback:
+            pass
+
+    @staticmethod
+    def measure(make_queryset, terms: list) -> float:
+        timings = []
+        for term in terms:
+            start = time.perf_counter()
+            list(make_queryset(term).values_list('id', flat=True)[:PAGE_SIZE])
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
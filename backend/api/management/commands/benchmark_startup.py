@@ -0,0 +1,99 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter per measurement, which boots the WSGI application like a server worker does
+# and then serves requests to it. Nothing but the standard library is imported before the clock starts.
+WORKER = '''
+import time
+start = time.perf_counter()
+import io, json, resource, sys
+from wsgiref.util import setup_testing_defaults
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+booted = time.perf_counter()
+from api import throttling
+
+path, _, query = sys.argv[1].partition('?')
+statuses, latencies = {}, []
+
+def start_response(status, headers, exc_info=None):
+    statuses[status[:3]] = statuses.get(status[:3], 0) + 1
+
+for _ in range(int(sys.argv[2]) + 1):
+    throttling.store.clear()
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'wsgi.input': io.BytesIO()}
+    setup_testing_defaults(environ)
+    request_start = time.perf_counter()
+    response = application(environ, start_response)
+    b''.join(response)
+    response.close()
+    latencies.append((time.perf_counter() - request_start) * 1000)
+
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    'boot_ms': (booted - start) * 1000,
+    'first_request_ms': latencies[0],
+    'request_ms': sorted(latencies[1:])[len(latencies[1:]) // 2] if len(latencies) > 1 else None,
+    'rss_mib': rss / 1024 / (1024 if sys.platform == 'darwin' else 1),
+    'modules': len(sys.modules),
+    'statuses': statuses,
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = ('Compare the cold start of settings profiles: time to boot the WSGI application, latency of the first '
+            'and of later requests and peak memory of a worker process, each measured in fresh processes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='+', default=['messageboard.settings', 'messageboard.settings_api'],
+                            help='Settings modules to compare.')
+        parser.add_argument('--runs', type=int, default=5, help='Number of worker processes started per profile.')
+        parser.add_argument('--requests', type=int, default=100,
+                            help='Number of requests timed per worker after the first one.')
+        parser.add_argument('--path', default='/api/', help='Path requested, which should not need a token.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+
+    def handle(self, *args, profiles: list, runs: int, requests: int, path: str, output: str, **options):
+        if runs < 1:
+            raise CommandError('--runs must be at least 1.')
+        results = {}
+        self.stdout.write(f'{"profile":<32} {"boot ms":>8} {"first ms":>9} {"request ms":>11} {"RSS MiB":>8} '
+                          f'{"modules":>8}')
+        # Runs of the profiles alternate, so that drift in the machine's load affects them alike.
+        measured = {profile: [] for profile in profiles}
+        for _ in range(runs):
+            for profile in profiles:
+                measured[profile].append(self.run_worker(profile, path, requests))
+        for profile, measurements in measured.items():
+            results[profile] = result = {
+                name: statistics.median(measurement[name] for measurement in measurements)
+                for name in ['boot_ms', 'first_request_ms', 'request_ms', 'rss_mib', 'modules']
+                if measurements[0][name] is not None
+            }
+            result['statuses'] = sorted({status for measurement in measurements for status in measurement['statuses']})
+            self.stdout.write(f'{profile:<32} {result["boot_ms"]:>8.1f} {result["first_request_ms"]:>9.2f} '
+                              f'{result.get("request_ms", 0):>11.3f} {result["rss_mib"]:>8.1f} '
+                              f'{result["modules"]:>8.0f}')
+        failed = [profile for profile, result in results.items()
+                  if any(not status.startswith('2') for status in result['statuses'])]
+        if failed:
+            self.stdout.write(self.style.WARNING(f'Profiles with unsuccessful responses: {", ".join(failed)}'))
+        if output:
+            with open(output, 'w') as file:
+                json.dump({'path': path, 'runs': runs, 'requests': requests, 'results': results}, file, indent=2)
+
+    @staticmethod
+    def run_worker(profile: str, path: str, requests: int) -> dict:
+        environment = dict(os.environ, DJANGO_SETTINGS_MODULE=profile)
+        completed = subprocess.run([sys.executable, '-c', WORKER, path, str(requests)], env=environment,
+                                   cwd=settings.BASE_DIR, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(f'Worker with {profile} failed:\n{completed.stderr[-2000:]}')
+        return json.loads(completed.stdout.splitlines()[-1])
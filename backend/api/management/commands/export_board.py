@@ -0,0 +1,29 @@
+import sys
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.export import FORMATS, TABLES, export_board, get_tables
+
+
+class Command(BaseCommand):
+    help = ('Export users, messages and favorites as NDJSON or CSV in id order. '
+            'An interrupted export resumes with --tables starting at the last table and --after its last id.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tables', default=','.join(TABLES), help='Comma separated tables to export, in order.')
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--after', type=int, help='Last id of the first table that was already exported.')
+        parser.add_argument('--output', default='-', help='File to write to, or - for standard output.')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Number of rows fetched per query.')
+
+    def handle(self, *args, tables: str, format: str, gzip: bool, after: int, output: str, chunk_size: int,
+               **options):
+        try:
+            chunks = export_board(get_tables(tables), format, after, gzip, chunk_size)
+        except ValueError as error:
+            raise CommandError(error)
+        with nullcontext(sys.stdout.buffer) if output == '-' else open(output, 'wb') as stream:
+            for chunk in chunks:
+                stream.write(chunk)
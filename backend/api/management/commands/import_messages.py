@@ -0,0 +1,66 @@
+import json
+import sys
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.imports import InvalidRecord, MessageImporter
+from api.models import Message
+
+
+class Command(BaseCommand):
+    help = ('Import messages from newline-delimited JSON objects with an `id`, `text`, the `owner` username and '
+            'optionally the `id` of a `parent` listed earlier and an ISO 8601 `created` time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to read, or - for standard input.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of messages written per transaction.')
+
+    def handle(self, *args, path: str, batch_size: int, **options):
+        importer = MessageImporter()
+        total = 0
+        with nullcontext(sys.stdin) if path == '-' else open(path, encoding='utf-8') as stream:
+            batch = []
+            for number, line in enumerate(stream, 1):
+                if line.strip():
+                    batch.append((number, self.parse(number, line)))
+                if len(batch) == batch_size:
+                    total += self.import_batch(importer, batch)
+                    batch = []
+            if batch:
+                total += self.import_batch(importer, batch)
+        self.stdout.write(self.style.SUCCESS(f'Imported {total} messages.'))
+
+    @staticmethod
+    def parse(number: int, line: str) -> dict:
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            raise CommandError(f'Line {number}: {error}')
+        if not isinstance(record, dict) or not isinstance(record.get('id'), (int, str)):
+            raise CommandError(f'Line {number}: expected an object with an id.')
+        if not isinstance(record.get('owner'), str):
+            raise CommandError(f'Line {number}: invalid owner.')
+        if not isinstance(record.get('parent'), (int, str, type(None))):
+            raise CommandError(f'Line {number}: invalid parent.')
+        text = record.get('text')
+        if not isinstance(text, str) or not 0 < len(text) <= Message._meta.get_field('text').max_length:
+            raise CommandError(f'Line {number}: invalid text.')
+        created = record.get('created')
+        if created is not None:
+            created = parse_datetime(created) if isinstance(created, str) else None
+            if created is None:
+                raise CommandError(f'Line {number}: invalid created time.')
+            if timezone.is_naive(created):
+                created = timezone.make_aware(created)
+        return {'id': record['id'], 'text': text, 'owner': record['owner'], 'parent': record.get('parent'),
+                'created': created}
+
+    @staticmethod
+    def import_batch(importer: MessageImporter, batch: list) -> int:
+        try:
+            return importer.import_batch(batch)
+        except InvalidRecord as error:
+            raise CommandError(error)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.tokens import purge_expired_tokens
+
+
+class Command(BaseCommand):
+    help = ('Delete expired refresh tokens and their blacklist entries in batches. '
+            'Meant to run periodically, as rotated refresh tokens add rows on every refresh.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of tokens deleted per transaction.')
+
+    def handle(self, *args, batch_size: int, **options):
+        total = purge_expired_tokens(batch_size)
+        self.stdout.write(self.style.SUCCESS(f'Purged {total} expired tokens.'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.cache import representation_cache
+from api.models import Message
+
+
+class Command(BaseCommand):
+    help = ('Recompute the hot score of every message from its counters, repairing rows written before the column '
+            'existed, counters fixed by reconcile_counters and rounding drift of the incremental updates.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of messages updated per transaction.')
+
+    def handle(self, *args, batch_size: int, **options):
+        total = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                rows = Message.objects.filter(pk__gt=last_id).order_by('pk')
+                rows = list(rows.values_list('pk', 'created', 'favorite_count', 'reply_count')[:batch_size])
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                messages = [Message(pk=pk, hot_score=Message.get_hot_score(created, favorite_count, reply_count))
+                            for pk, created, favorite_count, reply_count in rows]
+                Message.objects.bulk_update(messages, ['hot_score'])
+            total += len(rows)
+        representation_cache.invalidate_messages([], reranked=True)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the hot scores of {total} messages.'))
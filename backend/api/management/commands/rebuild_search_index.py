@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.search import install_search_index, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Create the full-text search index of messages if needed and rebuild it from the message table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database alias to rebuild the index of.')
+
+    def handle(self, *args, database: str, **options):
+        install_search_index(database)
+        rebuild_search_index(database)
+        self.stdout.write(self.style.SUCCESS('Rebuilt the message search index.'))
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from api.models import Message, User, Favorite, Notification, count_subquery
+
+# Denormalized counter columns and the (model, foreign key, filters) whose rows they count.
+COUNTERS = {
+    Message: {
+        'favorite_count': (Favorite, 'message', {}),
+        'reply_count': (Message, 'parent', {}),
+    },
+    User: {
+        'message_count': (Message, 'owner', {}),
+        'favorite_count': (Favorite, 'user', {}),
+        'unread_notification_count': (Notification, 'recipient', {'unread': True}),
+    },
+}
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized message and user counters that drifted from the actual rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows checked per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted rows without fixing them.')
+
+    def handle(self, *args, batch_size: int, dry_run: bool, **options):
+        for model, counters in COUNTERS.items():
+            checked, fixed = self.reconcile(model, counters, batch_size, dry_run)
+            verb = 'Found' if dry_run else 'Fixed'
+            self.stdout.write(self.style.SUCCESS(
+                f'Checked {checked} {model._meta.verbose_name_plural}. {verb} {fixed} with drifted counters.'
+            ))
+
+    @staticmethod
+    def reconcile(model, counters: dict, batch_size: int, dry_run: bool) -> tuple[int, int]:
+        annotations = {f'actual_{name}': count_subquery(counted, field, **filters)
+                       for name, (counted, field, filters) in counters.items()}
+        drift = Q()
+        for name in counters:
+            drift |= ~Q(**{name: F(f'actual_{name}')})
+        checked = fixed = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                ids = model.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)
+                ids = list(ids[:batch_size])
+                if not ids:
+                    break
+                last_id = ids[-1]
+                queryset = model.objects.filter(pk__in=ids).annotate(**annotations).filter(drift)
+                drifted = list(queryset.only('pk', *counters))
+                now = timezone.now()
+                for instance in drifted:
+                    for name in counters:
+                        setattr(instance, name, getattr(instance, f'actual_{name}'))
+                    instance.modified = now
+                if drifted and not dry_run:
+                    model.objects.bulk_update(drifted, [*counters, 'modified'])
+            checked += len(ids)
+            fixed += len(drifted)
+        return checked, fixed
@@ -0,0 +1,75 @@
+import multiprocessing
+import os
+import signal
+import socket
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api import jobs
+
+
+def work(stop, results, once: bool):
+    """
+    Worker process loop: run due jobs, then wait for more until `stop` is set.
+    """
+    if not apps.ready:
+        django.setup()
+    # Interrupts reach the whole process group, and the parent turns them into `stop`.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker = f'{socket.gethostname()[:40]}:{os.getpid()}'
+    done = failed = 0
+    try:
+        while not stop.is_set():
+            batch_done, batch_failed = jobs.run_pending(worker)
+            done, failed = done + batch_done, failed + batch_failed
+            if once:
+                break
+            if not batch_done and not batch_failed:
+                stop.wait(settings.API_JOBS['POLL_INTERVAL'])
+    finally:
+        connections.close_all()
+        results.put((done, failed))
+
+
+class Command(BaseCommand):
+    help = ('Run queued background jobs in a pool of worker processes until interrupted. '
+            'Jobs are only queued when API_JOBS["EAGER"] is false.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes, 0 to run jobs in this process.')
+        parser.add_argument('--once', action='store_true', help='Exit once no jobs are due.')
+
+    def handle(self, *args, processes: int, once: bool, **options):
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+        stop = context.Event()
+        results = context.Queue()
+        previous = signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        try:
+            if processes == 0:
+                work(stop, results, once)
+                workers = []
+            else:
+                # Children must open connections of their own instead of sharing the parent's.
+                connections.close_all()
+                workers = [context.Process(target=work, args=(stop, results, once)) for _ in range(processes)]
+                for worker in workers:
+                    worker.start()
+            try:
+                for worker in workers:
+                    worker.join()
+            except KeyboardInterrupt:
+                stop.set()
+                for worker in workers:
+                    worker.join()
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+        done = failed = 0
+        for _ in range(max(processes, 1)):
+            worker_done, worker_failed = results.get()
+            done, failed = done + worker_done, failed + worker_failed
+        self.stdout.write(self.style.SUCCESS(f'Ran {done} jobs. {failed} attempts failed.'))
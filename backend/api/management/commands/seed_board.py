@@ -0,0 +1,150 @@
+import itertools
+import math
+import random
+import time
+from array import array
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.cache import representation_cache
+from api.imports import MessageImporter, increment_counts
+from api.models import Message, User, Favorite
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'an', 'el', 'is', 'or', 'un', 'ba', 'de', 'fu', 'go', 'hi']
+
+
+def power_law_index(rng: random.Random, size: int) -> int:
+    """
+    Draw an index below `size` with a probability roughly inversely proportional to its rank, like Zipf's law.
+    """
+    return min(int(size ** rng.random()) - 1, size - 1)
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with synthetic users, reply trees and favorites for benchmarks. A few users write '
+            'most messages, replies form deep threads and favorites follow power laws over messages and users. '
+            'The same --seed produces the same board.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--messages', type=int, default=10000)
+        parser.add_argument('--favorites', type=int, default=50000)
+        parser.add_argument('--post-ratio', type=float, default=0.15, help='Fraction of messages that are posts.')
+        parser.add_argument('--chain-ratio', type=float, default=0.35,
+                            help='Fraction of replies to the previous message, which builds deep threads.')
+        parser.add_argument('--max-depth', type=int, default=50, help='Deepest reply level generated.')
+        parser.add_argument('--window', type=int, default=1000, help='Number of recent messages replies go to.')
+        parser.add_argument('--days', type=int, default=30, help='Days the creation times are spread over.')
+        parser.add_argument('--prefix', default='seed', help='Prefix of generated usernames.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of rows written per transaction.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, seed: int, batch_size: int, **options):
+        rng = random.Random(seed)
+        self.batch_size = batch_size
+        start = time.perf_counter()
+        users = self.create_users(options['prefix'], options['users'])
+        messages = self.create_messages(rng, users, options)
+        favorites = self.create_favorites(rng, users, messages, options['favorites'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(users)} users, {len(messages)} messages and {favorites} favorites '
+            f'in {time.perf_counter() - start:.1f} s.'
+        ))
+
+    def create_users(self, prefix: str, count: int) -> range:
+        """
+        Create `count` users and return the range of their ids, which bulk inserts assign contiguously.
+        Nothing is kept per user, so memory stays flat however many are created.
+        """
+        self.prefix = prefix
+        self.offset = User.objects.filter(username__startswith=f'{prefix}-').count()
+        password = make_password(None)
+        first = None
+        for start in range(0, count, self.batch_size):
+            batch = [User(username=self.username(index), email=f'{self.username(index)}@example.com',
+                          password=password) for index in range(start, min(start + self.batch_size, count))]
+            with transaction.atomic():
+                User.objects.bulk_create(batch)
+            if first is None:
+                first = batch[0].pk
+            if batch[-1].pk != first + start + len(batch) - 1:
+                raise CommandError('User ids were not assigned contiguously, were other users created meanwhile?')
+        return range(first, first + count) if first is not None else range(0)
+
+    def username(self, index: int) -> str:
+        return f'{self.prefix}-{self.offset + index}'
+
+    def create_messages(self, rng: random.Random, users: range, options: dict) -> array:
+        count, window = options['messages'], options['window']
+        words = [''.join(rng.choices(SYLLABLES, k=rng.randint(1, 4))) for _ in range(2000)]
+        first = timezone.now() - timedelta(days=options['days'])
+        step = timedelta(days=options['days']) / max(count, 1)
+        importer = MessageImporter()
+        depths = {}
+        pks = array('q')
+        batch = []
+        for index in range(count):
+            parent = None
+            if index > 0 and rng.random() >= options['post_ratio']:
+                if rng.random() < options['chain_ratio']:
+                    parent = index - 1
+                else:
+                    parent = max(index - 1 - power_law_index(rng, window), 0)
+                if depths.get(parent, options['max_depth']) >= options['max_depth']:
+                    parent = None
+            depths[index] = depths[parent] + 1 if parent is not None else 0
+            text = ' '.join(words[power_law_index(rng, len(words))] for _ in range(rng.randint(3, 40)))[:250]
+            owner = power_law_index(rng, len(users))
+            # Owners are known, so the importer does not have to look them up.
+            importer.owners[self.username(owner)] = users[owner]
+            batch.append((index, {'id': index, 'text': text, 'owner': self.username(owner), 'parent': parent,
+                                  'created': first + step * index}))
+            if len(batch) == self.batch_size or index == count - 1:
+                importer.import_batch(batch)
+                pks.extend(importer.ids[record_id] for record_id, _ in batch)
+                batch = []
+                importer.owners.clear()
+                # Replies only go to recent messages, so older ids are dropped to keep memory flat.
+                for old in range(max(index - window - self.batch_size, 0), max(index - window, 0)):
+                    importer.ids.pop(old, None)
+                    depths.pop(old, None)
+        return pks
+
+    def create_favorites(self, rng: random.Random, users: range, messages: array, count: int) -> int:
+        if not messages or not users:
+            return 0
+        # Popularity ranks map to messages through a fixed stride, so popular messages are spread over time.
+        stride = next(number for number in itertools.count(len(messages) // 2 + 1)
+                      if math.gcd(number, len(messages)) == 1)
+        # The activity of a user is inversely proportional to their rank.
+        scale = count / sum(1 / (rank + 1) for rank in range(len(users)))
+        limit = max(len(messages) // 10, 1)
+        total = 0
+        batch = []
+        for rank, user_id in enumerate(users):
+            favorited = set()
+            wanted = min(round(scale / (rank + 1)), limit)
+            while len(favorited) < wanted:
+                favorited.add(messages[power_law_index(rng, len(messages)) * stride % len(messages)])
+            batch.extend(Favorite(user_id=user_id, message_id=pk) for pk in favorited)
+            if len(batch) >= self.batch_size or rank == len(users) - 1:
+                total += self.write_favorites(batch)
+                batch = []
+        return total
+
+    @staticmethod
+    def write_favorites(favorites: list) -> int:
+        with transaction.atomic():
+            Favorite.objects.bulk_create(favorites)
+            messages = Counter(favorite.message_id for favorite in favorites)
+            users = Counter(favorite.user_id for favorite in favorites)
+            increment_counts(Message, 'favorite_count', messages)
+            increment_counts(User, 'favorite_count', users)
+            representation_cache.invalidate_messages(list(messages), reranked=True)
+            representation_cache.invalidate_users(list(users))
+        return len(favorites)
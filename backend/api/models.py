@@ -1,6 +1,42 @@
+import math
+
 from django.contrib.auth.models import BaseUserManager, AbstractBaseUser, PermissionsMixin
 from django.contrib.auth.validators import ASCIIUsernameValidator
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Concat, Log, Substr
+from django.utils import timezone
+
+
+def increment(model, pk, field: str, amount: int = 1):
+    """
+    Atomically add `amount` to a counter column, never letting it drop below zero.
+    The row's `modified` version is bumped along with it, and so is the hot score of messages.
+    """
+    increment_many(model, [pk], field, amount)
+
+
+def increment_many(model, pks, field: str, amount: int = 1):
+    """
+    `increment()` every row of `pks` by the same `amount` in a single update.
+    """
+    queryset = model.objects.filter(pk__in=pks)
+    if amount < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -amount})
+    updates = {field: models.F(field) + amount, 'modified': timezone.now()}
+    if model is Message and field in Message.HOT_WEIGHTS:
+        updates['hot_score'] = Message.hot_score_change(field, amount)
+    queryset.update(**updates)
+
+
+def count_subquery(model, field: str, **filters):
+    """
+    Number of `model` rows matching `filters` whose `field` points at the outer row, as an expression.
+    """
+    counts = model.objects.filter(**{field: models.OuterRef('pk')}, **filters).order_by().values(field).annotate(
+        count=models.Count('*')
+    )
+    return Coalesce(models.Subquery(counts.values('count'), output_field=models.IntegerField()), 0)
 
 
 class UserManager(BaseUserManager):
@@ -26,6 +62,10 @@ class User(AbstractBaseUser, PermissionsMixin):
     email = models.EmailField(max_length=255, unique=True)
     is_staff = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
+    message_count = models.PositiveIntegerField(default=0, editable=False)
+    favorite_count = models.PositiveIntegerField(default=0, editable=False)
+    unread_notification_count = models.PositiveIntegerField(default=0, editable=False)
+    modified = models.DateTimeField(auto_now=True)
     objects = UserManager()
 
     USERNAME_FIELD = 'username'
@@ -47,13 +87,162 @@ class User(AbstractBaseUser, PermissionsMixin):
 
 
 class Message(models.Model):
+    """
+    A post (no parent) or a reply. Every message also stores its position in the thread:
+    the `root` post (itself for posts), its `depth` below it and a materialized `path` made of
+    fixed-width, zero-padded ids of its ancestors and itself. Sorting a thread by `path` lists it
+    depth-first and the subtree of a message is the `[path, next_path(path))` range of its thread.
+
+    `hot_score` ranks the `?sort=hot` feed: the log of one plus a weighted activity count plus the creation time
+    divided by `HOT_DECAY`. Newer messages start higher instead of older ones decaying, so the order
+    only changes when a counter does and the score is updated along with it, see `increment()`.
+    """
+    PATH_SEGMENT_WIDTH = 10
+    MAX_DEPTH = 199
+    # Seconds of age worth a tenfold difference in activity
+    HOT_DECAY = 45000
+    HOT_WEIGHTS = {'favorite_count': 1, 'reply_count': 2}
+
     text = models.CharField(max_length=250)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, blank=True, null=True, related_name='children')
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='messages')
     favorited_by = models.ManyToManyField(User, through='Favorite', related_name='favorites')
     created = models.DateTimeField(auto_now_add=True)
+    favorite_count = models.PositiveIntegerField(default=0, editable=False)
+    reply_count = models.PositiveIntegerField(default=0, editable=False)
+    modified = models.DateTimeField(auto_now=True)
+    root = models.ForeignKey('self', on_delete=models.CASCADE, null=True, editable=False, related_name='+')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    path = models.CharField(max_length=(MAX_DEPTH + 1) * PATH_SEGMENT_WIDTH, default='', editable=False)
+    hot_score = models.FloatField(default=0, editable=False)
     objects = models.Manager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created', '-id'], name='message_created_idx'),
+            models.Index(fields=['owner', '-created', '-id'], name='message_owner_created_idx'),
+            models.Index(fields=['parent', '-created', '-id'], name='message_parent_created_idx'),
+            models.Index(fields=['root', 'path'], name='message_root_path_idx'),
+            models.Index(fields=['-hot_score', '-id'], name='message_hot_idx'),
+            models.Index(fields=['parent', '-hot_score', '-id'], name='message_parent_hot_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The parent as stored, which tells `save()` whether the message moved. Unknown while the field is deferred.
+        instance.saved_parent_id = instance.__dict__.get('parent_id', models.DEFERRED)
+        return instance
+
+    def clean(self):
+        super().clean()
+        if self.parent_id is None:
+            return
+        if self.parent.depth >= self.MAX_DEPTH:
+            raise ValidationError({'parent': 'Thread is too deep to reply to this message.'})
+        if self.path and self.parent.is_in_subtree_of(self):
+            raise ValidationError({'parent': 'A message cannot reply to itself or to one of its replies.'})
+
+    def save(self, *args, **kwargs):
+        """
+        Save the message and keep its thread position and the reply counts of parents in step with `parent`,
+        whichever code changed it. `previous_parent_id` is left set after a move.
+        """
+        adding = self._state.adding
+        update_fields = kwargs.get('update_fields')
+        saved_parent_id = getattr(self, 'saved_parent_id', models.DEFERRED)
+        moved = (not adding and saved_parent_id is not models.DEFERRED and self.parent_id != saved_parent_id
+                 and (update_fields is None or 'parent' in update_fields or 'parent_id' in update_fields))
+        self.previous_parent_id = saved_parent_id if moved else None
+        if adding:
+            self.hot_score = self.get_hot_score(timezone.now(), self.favorite_count, self.reply_count)
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            if adding or moved:
+                self.update_thread_position()
+            if moved:
+                if saved_parent_id is not None:
+                    increment(Message, saved_parent_id, 'reply_count', -1)
+                if self.parent_id is not None:
+                    increment(Message, self.parent_id, 'reply_count')
+        self.saved_parent_id = self.parent_id
+
+    @classmethod
+    def get_hot_score(cls, created, favorite_count: int, reply_count: int) -> float:
+        activity = favorite_count * cls.HOT_WEIGHTS['favorite_count'] + reply_count * cls.HOT_WEIGHTS['reply_count']
+        return math.log10(activity + 1) + created.timestamp() / cls.HOT_DECAY
+
+    @classmethod
+    def hot_score_change(cls, field: str, amount: int):
+        """
+        Expression moving `hot_score` along with `amount` added to the `field` counter in the same update.
+        """
+        activity = sum((models.F(name) * weight for name, weight in cls.HOT_WEIGHTS.items()), models.Value(0))
+        changed = activity + cls.HOT_WEIGHTS[field] * amount
+        return models.F('hot_score') - Log(10, activity + 1) + Log(10, changed + 1)
+
+    @classmethod
+    def path_segment(cls, pk) -> str:
+        return str(pk).zfill(cls.PATH_SEGMENT_WIDTH)
+
+    @staticmethod
+    def next_path(path: str) -> str:
+        # Paths only contain digits, so they collate the same way under every database collation.
+        return str(int(path) + 1).zfill(len(path))
+
+    def get_subtree(self):
+        """
+        The message and all of its replies, at any depth, as one range query on the thread's path index.
+        """
+        return Message.objects.filter(root_id=self.root_id, path__gte=self.path, path__lt=self.next_path(self.path))
+
+    def get_thread(self):
+        return Message.objects.filter(root_id=self.root_id)
+
+    def is_in_subtree_of(self, message) -> bool:
+        return self.root_id == message.root_id and self.path.startswith(message.path)
+
+    def update_thread_position(self):
+        """
+        Recompute `root`, `depth` and `path` from the current parent, moving any replies along in a single update.
+        """
+        parent = self.parent
+        root_id = parent.root_id if parent is not None else self.pk
+        depth = parent.depth + 1 if parent is not None else 0
+        path = (parent.path if parent is not None else '') + self.path_segment(self.pk)
+        if self.path:
+            self.get_subtree().update(
+                root_id=root_id,
+                depth=models.F('depth') + (depth - self.depth),
+                path=Concat(models.Value(path), Substr('path', len(self.path) + 1)),
+            )
+        else:
+            Message.objects.filter(pk=self.pk).update(root_id=root_id, depth=depth, path=path)
+        self.root_id, self.depth, self.path = root_id, depth, path
+
+    def delete_subtree(self):
+        """
+        Delete the message with all of its replies, collecting the whole subtree with one range query
+        instead of letting the `parent` cascade walk it one level at a time.
+        """
+        if not self.path:
+            return self.delete()
+        return self.get_subtree().delete()
+
+
+class MessageSearchIndex(models.Model):
+    """
+    SQLite FTS5 index over `Message.text`, kept in sync by triggers. See `api.search`.
+    """
+    message = models.OneToOneField(Message, primary_key=True, db_column='rowid', on_delete=models.DO_NOTHING,
+                                   related_name='search_index')
+    text = models.TextField()
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'api_message_fts'
+
 
 class Favorite(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -63,3 +252,70 @@ class Favorite(models.Model):
 
     class Meta:
         constraints = [models.UniqueConstraint(fields=['user', 'message'], name='favorite_once')]
+        indexes = [
+            models.Index(fields=['user', '-created', '-id'], name='favorite_user_created_idx'),
+            models.Index(fields=['-created', '-id'], name='favorite_created_idx'),
+        ]
+
+
+class Notification(models.Model):
+    """
+    Tells the owner of `message` that others replied to it or favorited it. While unread, further events
+    of the same kind on the same message are coalesced into the notification: `actor` becomes the latest one,
+    `actor_count` counts the distinct `actors` and `modified` moves it back to the top of the inbox.
+    See `api.notifications`.
+    """
+    REPLY = 'reply'
+    FAVORITE = 'favorite'
+    KINDS = [(REPLY, 'Reply'), (FAVORITE, 'Favorite')]
+
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    kind = models.CharField(max_length=10, choices=KINDS)
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='+')
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    actor_count = models.PositiveIntegerField(default=1)
+    actors = models.ManyToManyField(User, related_name='+')
+    unread = models.BooleanField(default=True)
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['message', 'kind'], condition=models.Q(unread=True),
+                                    name='notification_unread_once'),
+        ]
+        indexes = [
+            models.Index(fields=['recipient', '-modified', '-id'], name='notification_inbox_idx'),
+            models.Index(fields=['recipient', '-modified', '-id'], condition=models.Q(unread=True),
+                         name='notification_unread_idx'),
+        ]
+
+
+class Job(models.Model):
+    """
+    Background job in the queue table, run by `run_workers`. See `api.jobs`.
+
+    At most one pending job exists per `key`, so the same follow-up work enqueued many times before
+    a worker gets to it runs once. Finished jobs are deleted and failed ones are kept for inspection.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=100)
+    args = models.JSONField(default=list)
+    key = models.CharField(max_length=200, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key'], condition=models.Q(status='pending'), name='job_pending_key_once'),
+        ]
+        indexes = [models.Index(fields=['status', 'run_at', 'id'], name='job_status_run_at_idx')]
@@ -0,0 +1,92 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .cache import representation_cache
+from .jobs import refresh_user_counts_later
+from .models import Message, Favorite, Notification, increment_many
+from .notifications import add_unread
+
+
+def decrement_counts(model, field: str, counts: Counter):
+    """
+    Subtract per-row amounts from a counter column, one `increment_many()` per distinct amount.
+    """
+    by_amount = defaultdict(list)
+    for pk, amount in counts.items():
+        by_amount[amount].append(pk)
+    for amount, pks in by_amount.items():
+        increment_many(model, pks, field, -amount)
+
+
+def delete_messages(queryset, batch_size: int = 100) -> int:
+    """
+    Delete the messages of `queryset` with all of their replies and return how many were deleted.
+
+    Each batch of selected messages costs a fixed number of set-based queries, however large their threads are:
+    subtrees are range conditions on the thread path index, and the rows are deleted without the per-row
+    `post_delete` receivers of `api.signals`, whose counter and cache upkeep is done here for the whole batch.
+    """
+    selected = queryset.order_by('pk').values_list('pk', 'root_id', 'path')
+    deleted = last_id = 0
+    users = set()
+    while True:
+        batch = list(selected.filter(pk__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        condition = Q()
+        for pk, root_id, path in batch:
+            condition |= Q(root_id=root_id, path__gte=path, path__lt=Message.next_path(path)) if path else Q(pk=pk)
+        batch_deleted, batch_users = delete_subtrees(Message.objects.filter(condition))
+        deleted += batch_deleted
+        users |= batch_users
+    # Profile counters are recounted, so once for all batches is enough.
+    for user_id in users:
+        refresh_user_counts_later(user_id)
+    return deleted
+
+
+@transaction.atomic
+def delete_subtrees(subtree) -> tuple[int, set]:
+    """
+    Delete the given messages, which must include all of their replies, and return their number and the users
+    whose messages or favorites went with them.
+    """
+    rows = list(subtree.values_list('pk', 'parent_id', 'owner_id'))
+    if not rows:
+        return 0, set()
+    ids = {pk for pk, _, _ in rows}
+    lost_replies = Counter(parent_id for _, parent_id, _ in rows if parent_id is not None and parent_id not in ids)
+    favorites = Favorite.objects.filter(message__in=subtree.values('pk'))
+    notifications = Notification.objects.filter(message__in=subtree.values('pk'))
+    actors = Notification.actors.through.objects.filter(notification__message__in=subtree.values('pk'))
+    unread = notifications.filter(unread=True).values('recipient').annotate(count=Count('pk'))
+    users = {owner_id for _, _, owner_id in rows} | set(favorites.values_list('user_id', flat=True).distinct())
+    add_unread(Counter({recipient_id: -count for recipient_id, count in unread.values_list('recipient', 'count')}))
+    actors._raw_delete(actors.db)
+    notifications._raw_delete(notifications.db)
+    favorites._raw_delete(favorites.db)
+    subtree._raw_delete(subtree.db)
+    decrement_counts(Message, 'reply_count', lost_replies)
+    representation_cache.invalidate_messages([*ids, *lost_replies], changed=True)
+    representation_cache.invalidate_users(users)
+    return len(ids), users
+
+
+def purge_user_content(user_ids: list) -> tuple[int, int]:
+    """
+    Delete every message of the given users, with the replies of others to them, and every favorite they added.
+    Return the numbers of messages and favorites deleted.
+    """
+    with transaction.atomic():
+        favorites = Favorite.objects.filter(user__in=user_ids)
+        counts = Counter(dict(favorites.values('message').annotate(count=Count('pk')).values_list('message', 'count')))
+        favorites._raw_delete(favorites.db)
+        decrement_counts(Message, 'favorite_count', counts)
+        for user_id in user_ids:
+            refresh_user_counts_later(user_id)
+        representation_cache.invalidate_messages(list(counts), reranked=True)
+        representation_cache.invalidate_users(user_ids)
+    return delete_messages(Message.objects.filter(owner__in=user_ids)), sum(counts.values())
@@ -0,0 +1,90 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+
+from .jobs import enqueue, job
+from .models import Message, User, Notification, count_subquery
+
+
+def add_unread(counts: Counter):
+    """
+    Add to the unread notification counters of users, one update per distinct amount.
+    Unlike `increment()`, the users' `modified` version is left alone, since the counter is not part of
+    any public representation.
+    """
+    by_amount = defaultdict(list)
+    for pk, amount in counts.items():
+        by_amount[amount].append(pk)
+    for amount, pks in by_amount.items():
+        queryset = User.objects.filter(pk__in=pks)
+        if amount < 0:
+            queryset = queryset.filter(unread_notification_count__gte=-amount)
+        queryset.update(unread_notification_count=F('unread_notification_count') + amount)
+
+
+@job('notify')
+def notify(kind: str, actor_id: int, message_ids: list):
+    """
+    Fan a reply to or favorites of `message_ids` by `actor_id` out to the owners of the messages.
+    However many messages a write touched, this costs a fixed number of queries: events on messages
+    with an unread notification of the same kind are coalesced into it, the others create one each.
+    Repeated events of an actor already counted by a notification only move it back to the top.
+    """
+    unread = Notification.objects.filter(message=OuterRef('pk'), kind=kind, unread=True)
+    targets = (Message.objects.filter(pk__in=message_ids).exclude(owner=actor_id)
+               .annotate(notification_id=Subquery(unread.values('pk')[:1]))
+               .values_list('pk', 'owner_id', 'notification_id'))
+    now = timezone.now()
+    actors = Notification.actors.through
+    with transaction.atomic():
+        coalesced, created = [], []
+        for message_id, owner_id, notification_id in targets:
+            if notification_id is not None:
+                coalesced.append(notification_id)
+            else:
+                created.append(Notification(recipient_id=owner_id, kind=kind, message_id=message_id,
+                                            actor_id=actor_id, modified=now))
+        notification_ids = list(coalesced)
+        if created:
+            # A notification created concurrently for the same message wins and this event is dropped.
+            # The unread counter then counts it anyway, which `reconcile_counters` repairs.
+            created = Notification.objects.bulk_create(created, ignore_conflicts=True)
+            add_unread(Counter(notification.recipient_id for notification in created))
+            # Primary keys are not returned when conflicts are ignored.
+            notification_ids += Notification.objects.filter(
+                message__in=[notification.message_id for notification in created], kind=kind, unread=True
+            ).values_list('pk', flat=True)
+        # An actor is counted once per notification, however many of their events it coalesces.
+        actors.objects.bulk_create([actors(notification_id=notification_id, user_id=actor_id)
+                                    for notification_id in notification_ids], ignore_conflicts=True)
+        if coalesced:
+            Notification.objects.filter(pk__in=coalesced).update(
+                actor=actor_id, actor_count=count_subquery(actors, 'notification'), modified=now
+            )
+
+
+def forget_actor(user_id: int):
+    """
+    Stop counting a user who is being deleted among the actors of notifications, before their actor rows go.
+    """
+    Notification.objects.filter(actors=user_id).update(actor_count=F('actor_count') - 1)
+
+
+def notify_later(kind: str, actor_id: int, message_ids: list):
+    enqueue('notify', kind, actor_id, list(message_ids))
+
+
+def mark_read(user_id: int, ids: list = None) -> int:
+    """
+    Mark the given unread notifications of a user, or all of them, as read and return how many changed.
+    """
+    with transaction.atomic():
+        queryset = Notification.objects.filter(recipient=user_id, unread=True)
+        if ids is not None:
+            queryset = queryset.filter(pk__in=ids)
+        read = queryset.update(unread=False)
+        if read:
+            add_unread(Counter({user_id: -read}))
+    return read
@@ -0,0 +1,174 @@
+import copy
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Keyset pagination over a unique ordering of model fields or annotations, `(created, id)` newest first by default.
+
+    Pages are located with a `WHERE (created, id) < (...)` condition instead of an OFFSET,
+    so every page costs the same index range scan and no COUNT query is issued.
+    Rows inserted while a client is paging never shift or duplicate the following pages.
+    Pages of `values()` querysets work too, as long as the rows include the ordering fields.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('-created', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset, position, reverse = self.get_page_queryset(queryset, request)
+        results = list(queryset)
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        return self.page
+
+    def get_page_queryset(self, queryset, request):
+        """
+        Return the sliced queryset of the requested page, plus one extra row telling whether more pages follow,
+        together with the decoded cursor position and direction.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.fields = [self.get_field(queryset, field) for field in self.ordering]
+        position, reverse = self.decode_cursor(request)
+
+        ordering = self.ordering if not reverse else [self.invert(field) for field in self.ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position, reverse))
+        return queryset[:self.page_size + 1], position, reverse
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_position_filter(self, position, reverse: bool) -> Q:
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            lookup = f'{name}__lt' if descending else f'{name}__gt'
+            condition |= Q(**equal, **{lookup: value})
+            equal[name] = value
+        return condition
+
+    def encode_cursor(self, instance, reverse: bool) -> str:
+        if isinstance(instance, dict):
+            position = [instance[field.attname] for field in self.fields]
+        else:
+            position = [getattr(instance, field.attname) for field in self.fields]
+        payload = json.dumps({'p': position, 'r': int(reverse)}, default=self.encode_value, separators=(',', ':'))
+        cursor = urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(cursor.encode('ascii')).decode('ascii'))
+            position = [field.to_python(value) for field, value in zip(self.fields, payload['p'], strict=True)]
+            reverse = bool(payload['r'])
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    @staticmethod
+    def encode_value(value) -> str:
+        # Full precision on purpose: DjangoJSONEncoder truncates datetimes to milliseconds.
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return str(value)
+
+    @staticmethod
+    def get_field(queryset, field: str):
+        name = field.lstrip('-')
+        annotation = queryset.query.annotations.get(name)
+        if annotation is None:
+            return queryset.model._meta.get_field(name)
+        # Annotations carry an unbound output field, which is enough to encode and parse cursor values.
+        output_field = copy.copy(annotation.output_field)
+        output_field.name = output_field.attname = name
+        return output_field
+
+    @staticmethod
+    def invert(field: str) -> str:
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+
+class SearchPagination(KeysetPagination):
+    """
+    Keyset pagination of search results, best `rank` first.
+    """
+    ordering = ('-rank', '-id')
+
+
+class HotPagination(KeysetPagination):
+    """
+    Keyset pagination of the `?sort=hot` feed, highest `hot_score` first.
+    """
+    ordering = ('-hot_score', '-id')
+
+
+class NotificationPagination(KeysetPagination):
+    """
+    Keyset pagination of the inbox, most recently active first. Coalescing an event into a notification moves
+    it back to the first page, so a client paging through the inbox meanwhile skips it.
+    """
+    ordering = ('-modified', '-id')
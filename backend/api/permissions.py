@@ -7,7 +7,7 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
     """
 
     def has_object_permission(self, request, view, obj) -> bool:
-        return request.method in permissions.SAFE_METHODS or obj.owner == request.user
+        return request.method in permissions.SAFE_METHODS or obj.owner_id == request.user.pk
 
 
 class MessagePermission(permissions.BasePermission):
@@ -16,17 +16,17 @@ class MessagePermission(permissions.BasePermission):
     """
 
     def has_permission(self, request, view) -> bool:
-        if view.action in ['retrieve', 'list']:
+        if view.action in ['retrieve', 'list', 'children', 'thread']:
             return True
         elif view.action in ['create', 'update', 'partial_update', 'destroy', 'favorite', 'unfavorite']:
             return request.user.is_authenticated
         return False
 
     def has_object_permission(self, request, view, obj) -> bool:
-        if view.action in ['retrieve', 'list']:
+        if view.action in ['retrieve', 'list', 'children', 'thread']:
             return True
         elif view.action in ['create', 'favorite', 'unfavorite']:
             return request.user.is_authenticated
         elif view.action in ['update', 'partial_update', 'destroy']:
-            return request.user.is_authenticated and obj.owner == request.user
+            return request.user.is_authenticated and obj.owner_id == request.user.pk
         return False
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class Subscription:
+    """
+    Bounded per-connection event queue, consumed by one streaming response.
+
+    When a slow client lets the queue fill up, new events are dropped and counted instead of
+    buffering without limit; the consumer is told how many it missed so it can refetch.
+    """
+
+    def __init__(self, channels, queue_size: int):
+        self.channels = frozenset(channels)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def deliver(self, event):
+        # Publishers usually run in sync request threads, outside of the subscriber's event loop.
+        try:
+            self.loop.call_soon_threadsafe(self.put, event)
+        except RuntimeError:
+            pass
+
+    async def get(self, timeout: float = None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def take_dropped(self) -> int:
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class BaseBackend:
+    """
+    Transport between publishers and the hubs of every worker process.
+    """
+
+    def __init__(self, hub: 'Hub'):
+        self.hub = hub
+
+    def publish(self, channel: str, event: dict):
+        raise NotImplementedError('`publish()` must be implemented.')
+
+
+class InMemoryBackend(BaseBackend):
+    """
+    Delivers events to subscribers of the current process only. Enough for a single worker and for tests.
+    """
+
+    def publish(self, channel: str, event: dict):
+        self.hub.deliver(channel, event)
+
+
+class Hub:
+    """
+    In-process fan-out of published events to the subscriptions of their channel.
+    """
+
+    def __init__(self, backend: str, queue_size: int):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+        self.queue_size = queue_size
+        self.backend = import_string(backend)(self)
+
+    def subscribe(self, channels) -> Subscription:
+        subscription = Subscription(channels, self.queue_size)
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscriptions[channel].discard(subscription)
+                if not self.subscriptions[channel]:
+                    del self.subscriptions[channel]
+
+    def subscriber_count(self) -> int:
+        with self.lock:
+            return len(set().union(*self.subscriptions.values()))
+
+    def publish(self, channel: str, event: dict):
+        self.backend.publish(channel, event)
+
+    def deliver(self, channel: str, event: dict):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.deliver(event)
+
+
+hub = Hub(settings.API_STREAM['BACKEND'], settings.API_STREAM['QUEUE_SIZE'])
@@ -0,0 +1,70 @@
+import datetime
+import json
+import math
+
+from rest_framework import renderers
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode_default(value):
+    """
+    Encode values JSON has no type for. Datetimes keep full precision and use `Z` for UTC,
+    like DRF's `DateTimeField` and orjson with `OPT_UTC_Z`.
+    """
+    if isinstance(value, datetime.datetime):
+        representation = value.isoformat()
+        if representation.endswith('+00:00'):
+            representation = f'{representation[:-6]}Z'
+        return representation
+    return JSONEncoder().default(value)
+
+
+def has_non_finite_float(data) -> bool:
+    """
+    Whether NaN or an infinity is among the values of `data`.
+    """
+    if isinstance(data, float):
+        return not math.isfinite(data)
+    if isinstance(data, dict):
+        return any(has_non_finite_float(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return any(has_non_finite_float(value) for value in data)
+    return False
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    `JSONRenderer` that encodes with orjson when it is installed, falling back to the stdlib encoder.
+    Indented output, requested with an `indent` media type parameter, always takes DRF's own path.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        if orjson is not None:
+            ret = orjson.dumps(data, default=encode_default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+            # orjson encodes NaN and infinities as null, where the strict stdlib encoder fails like DRF's does.
+            # They can only hide behind a null, so other responses skip the walk over the data.
+            if self.strict and b'null' in ret and has_non_finite_float(data):
+                raise ValueError('Out of range float values are not JSON compliant')
+        else:
+            ret = json.dumps(data, default=encode_default, ensure_ascii=self.ensure_ascii,
+                             allow_nan=not self.strict, separators=(',', ':')).encode()
+        # Same as DRF: U+2028 and U+2029 are valid JSON but not valid JavaScript.
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class CompactJSONRenderer(FastJSONRenderer):
+    """
+    Compact message representation with integer ids instead of hyperlinks, selected with `?format=compact`
+    or `Accept: application/json; profile=compact`. Only views that build the compact rows list it.
+    """
+    media_type = 'application/json; profile=compact'
+    format = 'compact'
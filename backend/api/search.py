@@ -0,0 +1,111 @@
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, ExpressionWrapper, F, FloatField, Lookup, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Message, MessageSearchIndex
+
+# PostgreSQL text search configuration used for both the GIN index and the queries
+POSTGRESQL_CONFIG = 'english'
+
+SQLITE_SCHEMA = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5(
+        text, content={table}, content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS {trigger}_insert AFTER INSERT ON {table} BEGIN
+        INSERT INTO {index}(rowid, text) VALUES (new.id, new.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS {trigger}_delete AFTER DELETE ON {table} BEGIN
+        INSERT INTO {index}({index}, rowid, text) VALUES ('delete', old.id, old.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS {trigger}_update AFTER UPDATE OF text ON {table} BEGIN
+        INSERT INTO {index}({index}, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO {index}(rowid, text) VALUES (new.id, new.text);
+    END
+    ''',
+]
+
+POSTGRESQL_SCHEMA = [
+    "CREATE INDEX IF NOT EXISTS {table}_text_search_idx ON {table} USING GIN (to_tsvector('{config}', text))",
+]
+
+
+class Match(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+MessageSearchIndex._meta.get_field('text').register_lookup(Match)
+
+
+def get_terms(query: str) -> list[str]:
+    return re.findall(r'\w+', query)
+
+
+def install_search_index(using: str = 'default'):
+    """
+    Create the full-text index of the database behind `using`, if it does not exist yet.
+    """
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        names = {
+            'table': connection.ops.quote_name(Message._meta.db_table),
+            'index': connection.ops.quote_name(MessageSearchIndex._meta.db_table),
+            'trigger': MessageSearchIndex._meta.db_table,
+        }
+        with connection.cursor() as cursor:
+            for statement in SQLITE_SCHEMA:
+                cursor.execute(statement.format(**names))
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            for statement in POSTGRESQL_SCHEMA:
+                cursor.execute(statement.format(table=Message._meta.db_table, config=POSTGRESQL_CONFIG))
+
+
+def rebuild_search_index(using: str = 'default'):
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        index = connection.ops.quote_name(MessageSearchIndex._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {index}({index}) VALUES ('rebuild')")
+
+
+def search_messages(queryset, query: str):
+    """
+    Filter messages to those matching every term of `query` and annotate them with a `rank`, higher is better.
+    Uses FTS5 on SQLite and a `tsvector` GIN index on PostgreSQL; other databases fall back to a table scan.
+    """
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        vector = f"to_tsvector(%s, {connections[queryset.db].ops.quote_name(Message._meta.db_table)}.text)"
+        tsquery = 'websearch_to_tsquery(%s, %s)'
+        params = [POSTGRESQL_CONFIG, POSTGRESQL_CONFIG, query]
+        return queryset.filter(RawSQL(f'{vector} @@ {tsquery}', params, output_field=BooleanField())).annotate(
+            rank=RawSQL(f'ts_rank({vector}, {tsquery})', params, output_field=FloatField())
+        )
+
+    terms = get_terms(query)
+    if not terms:
+        return queryset.none().annotate(rank=Value(0.0, output_field=FloatField()))
+    if vendor == 'sqlite':
+        # Quoting every term keeps FTS5 operators in user input from being interpreted.
+        expression = ' '.join('"{}"'.format(term) for term in terms)
+        return queryset.filter(search_index__text__match=expression).annotate(
+            rank=ExpressionWrapper(F('search_index__rank') * -1, output_field=FloatField())
+        )
+    condition = Q()
+    for term in terms:
+        condition &= Q(text__icontains=term)
+    return queryset.filter(condition).annotate(rank=Value(0.0, output_field=FloatField()))
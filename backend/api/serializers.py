@@ -1,8 +1,14 @@
+from collections import defaultdict
+
 from django.contrib.auth.password_validation import validate_password
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
-from .models import Message, User, Favorite
+from .instrumentation import timing
+from .models import Message, User, Favorite, Notification
 
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -33,39 +39,238 @@ class RegistrationSerializer(serializers.ModelSerializer):
                                         password=validated_data['password'])
 
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
+def prefetch_ids(instances, to_attr: str, queryset, key: str, value: str = 'pk', limit: int = None) -> None:
+    """
+    Attach ordered lists of related ids to instances, using a single `values_list` query for all of them.
+    With `limit`, only the first `limit` ids of each instance are loaded.
+    """
+    pending = {instance.pk: instance for instance in instances if not hasattr(instance, to_attr)}
+    if not pending:
+        return
+    queryset = queryset.filter(**{f'{key}__in': list(pending)})
+    if limit is not None:
+        queryset = queryset.annotate(
+            row_number=Window(RowNumber(), partition_by=[F(key)], order_by=queryset.query.order_by)
+        ).filter(row_number__lte=limit)
+    related_ids = defaultdict(list)
+    for key_id, related_id in queryset.values_list(key, value):
+        related_ids[key_id].append(related_id)
+    for pk, instance in pending.items():
+        setattr(instance, to_attr, related_ids[pk])
+
+
+def get_favorited_ids(user, message_ids) -> set:
+    """
+    Ids of the given messages favorited by `user`, in one query. Anonymous users never hit the database.
+    """
+    if user is None or not user.is_authenticated or not message_ids:
+        return set()
+    return set(Favorite.objects.filter(user=user, message_id__in=message_ids).values_list('message_id', flat=True))
+
+
+# Columns of the compact message representation, as `values()` arguments.
+COMPACT_MESSAGE_FIELDS = ('id', 'text', 'created', 'owner', 'parent', 'favorite_count', 'reply_count')
+COMPACT_MESSAGE_EXPRESSIONS = {'username': F('owner__username')}
+
+
+def compact_messages(rows, user) -> list:
+    """
+    Compact representation of messages from `values(*COMPACT_MESSAGE_FIELDS, **COMPACT_MESSAGE_EXPRESSIONS)`
+    rows: integer ids instead of hyperlinks and the owner's username, built without model instances or `reverse()`.
+    """
+    with timing('serializer'):
+        ids = [row['id'] for row in rows]
+        children = defaultdict(list)
+        if ids:
+            queryset = Message.objects.filter(parent__in=ids).order_by('-created', '-id')
+            for parent_id, child_id in queryset.values_list('parent', 'id'):
+                children[parent_id].append(child_id)
+        favorited = get_favorited_ids(user, ids)
+        return [{
+            'id': row['id'],
+            'text': row['text'],
+            'created': row['created'],
+            'owner': row['owner'],
+            'username': row['username'],
+            'parent': row['parent'],
+            'children': children[row['id']],
+            'favorite_count': row['favorite_count'],
+            'reply_count': row['reply_count'],
+            'favorited': row['id'] in favorited,
+        } for row in rows]
+
+
+class HyperlinkedIdListField(serializers.ReadOnlyField):
+    """
+    Read-only list of hyperlinks built straight from raw primary keys, without loading the related objects.
+    """
+
+    def __init__(self, view_name: str, **kwargs):
+        self.view_name = view_name
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        format = self.context.get('format')
+        return [reverse(self.view_name, kwargs={'pk': pk}, request=request, format=format) for pk in value]
+
+
+class TimedSerializerMixin:
+    """
+    Counts the time spent producing `data` as serializer time of the request, see `api.instrumentation`.
+    """
+
+    @property
+    def data(self):
+        with timing('serializer'):
+            return super().data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
+
+
+class PrefetchIdsListSerializer(TimedListSerializer):
+    def to_representation(self, data):
+        instances = list(data.all() if hasattr(data, 'all') else data)
+        self.child.prefetch(instances)
+        return super().to_representation(instances)
+
+
+class UserSerializer(TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
+    """
+    User with counts and links to the paginated `messages` and `favorites` sub-collections.
+    `?expand=messages,favorites` additionally inlines links to the `expand_limit` most recent items.
+    """
+    message_count = serializers.IntegerField(read_only=True)
+    messages = serializers.HyperlinkedIdentityField(view_name='user-message-list')
+    favorite_count = serializers.IntegerField(read_only=True)
+    favorites = serializers.HyperlinkedIdentityField(view_name='user-favorite-list')
+    recent_messages = HyperlinkedIdListField(source='recent_message_ids', view_name='message-detail')
+    recent_favorites = HyperlinkedIdListField(source='recent_favorite_ids', view_name='message-detail')
+    expand_limit = 10
+
     class Meta:
         model = User
-        fields = ['url', 'id', 'username', 'messages', 'favorites']
+        fields = ['url', 'id', 'username', 'message_count', 'messages', 'favorite_count', 'favorites',
+                  'recent_messages', 'recent_favorites']
+        list_serializer_class = PrefetchIdsListSerializer
+
+    def get_expand(self) -> set:
+        request = self.context.get('request')
+        if request is None:
+            return set()
+        return set(request.query_params.get('expand', '').split(','))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        expand = self.get_expand()
+        for name in ['messages', 'favorites']:
+            if name not in expand:
+                del fields[f'recent_{name}']
+        return fields
+
+    def prefetch(self, instances):
+        expand = self.get_expand()
+        if 'messages' in expand:
+            prefetch_ids(instances, 'recent_message_ids', Message.objects.order_by('-created', '-id'), 'owner',
+                         limit=self.expand_limit)
+        if 'favorites' in expand:
+            prefetch_ids(instances, 'recent_favorite_ids', Favorite.objects.order_by('-created', '-id'), 'user',
+                         'message', limit=self.expand_limit)
 
     def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        ordered_messages = instance.messages.order_by('-created')
-        ordered_messages = MessageSerializer(ordered_messages, many=True, context=self.context).data
-        representation['messages'] = [message['url'] for message in ordered_messages]
-        ordered_favorite_set = instance.favorite_set.order_by('-created')
-        ordered_favorite_set = [favorite.message for favorite in ordered_favorite_set]
-        ordered_favorite_set = MessageSerializer(ordered_favorite_set, many=True, context=self.context).data
-        representation['favorites'] = [favorite['url'] for favorite in ordered_favorite_set]
-        return representation
-
-
-class MessageSerializer(serializers.HyperlinkedModelSerializer):
-    children = serializers.HyperlinkedRelatedField(many=True, read_only=True, view_name='message-detail')
+        self.prefetch([instance])
+        return super().to_representation(instance)
+
+
+class MessageSerializer(TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
+    children = HyperlinkedIdListField(source='child_ids', view_name='message-detail')
     parent = serializers.HyperlinkedRelatedField(queryset=Message.objects.all(), view_name='message-detail')
     owner = serializers.HyperlinkedRelatedField(read_only=True, view_name='user-detail')
     favorite_count = serializers.IntegerField(read_only=True)
+    reply_count = serializers.IntegerField(read_only=True)
     favorited = serializers.BooleanField(read_only=True)
 
     class Meta:
         model = Message
-        fields = ['url', 'id', 'text', 'created', 'owner', 'parent', 'children', 'favorite_count', 'favorited']
+        fields = ['url', 'id', 'text', 'created', 'owner', 'parent', 'children', 'favorite_count', 'reply_count',
+                  'favorited']
+        list_serializer_class = PrefetchIdsListSerializer
+
+    def validate_parent(self, parent):
+        if parent is None:
+            return parent
+        if parent.depth >= Message.MAX_DEPTH:
+            raise serializers.ValidationError('Thread is too deep to reply to this message.')
+        if self.instance is not None and parent.is_in_subtree_of(self.instance):
+            raise serializers.ValidationError('A message cannot reply to itself or to one of its replies.')
+        return parent
 
+    def prefetch(self, instances):
+        prefetch_ids(instances, 'child_ids', Message.objects.order_by('-created', '-id'), 'parent')
+        pending = [instance for instance in instances if not hasattr(instance, 'favorited')]
+        if pending:
+            request = self.context.get('request')
+            favorited = get_favorited_ids(getattr(request, 'user', None), [instance.pk for instance in pending])
+            for instance in pending:
+                instance.favorited = instance.pk in favorited
 
-class FavoriteSerializer(serializers.HyperlinkedModelSerializer):
+    def to_representation(self, instance):
+        self.prefetch([instance])
+        return super().to_representation(instance)
+
+
+class FavoriteSerializer(TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
     message = serializers.HyperlinkedRelatedField(read_only=True, view_name='message-detail')
     user = serializers.HyperlinkedRelatedField(read_only=True, view_name='user-detail')
 
     class Meta:
         model = Favorite
         fields = ['message', 'user', 'created']
+        list_serializer_class = TimedListSerializer
+
+
+class FavoriteBatchSerializer(serializers.Serializer):
+    max_messages = 1000
+    messages = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False,
+                                     max_length=max_messages)
+
+    def validate_messages(self, value: list) -> list:
+        ids = list(dict.fromkeys(value))
+        existing = set(Message.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        missing = [pk for pk in ids if pk not in existing]
+        if missing:
+            raise serializers.ValidationError(f'Messages {", ".join(map(str, missing))} do not exist.')
+        return ids
+
+
+class NotificationSerializer(TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
+    message = serializers.HyperlinkedRelatedField(read_only=True, view_name='message-detail')
+    actor = serializers.HyperlinkedRelatedField(read_only=True, view_name='user-detail')
+    summary = serializers.SerializerMethodField()
+    verbs = {Notification.REPLY: 'replied to', Notification.FAVORITE: 'favorited'}
+
+    class Meta:
+        model = Notification
+        fields = ['id', 'kind', 'message', 'actor', 'actor_count', 'summary', 'unread', 'created', 'modified']
+        list_serializer_class = TimedListSerializer
+
+    def get_summary(self, notification) -> str:
+        actor = notification.actor.username if notification.actor is not None else 'Someone'
+        others = notification.actor_count - 1
+        if others > 0:
+            actor = f'{actor} and {others} other{"s" if others > 1 else ""}'
+        return f'{actor} {self.verbs[notification.kind]} your message.'
+
+
+class NotificationReadSerializer(serializers.Serializer):
+    max_notifications = 1000
+    notifications = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False,
+                                          max_length=max_notifications, required=False)
+    all = serializers.BooleanField(default=False)
+
+    def validate(self, attrs: dict) -> dict:
+        if attrs['all'] == ('notifications' in attrs):
+            raise serializers.ValidationError('Give either `notifications` or `all`.')
+        return attrs
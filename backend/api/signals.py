@@ -0,0 +1,100 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import representation_cache
+from .jobs import refresh_user_counts_later
+from .models import Message, User, Favorite, Notification, increment
+from .notifications import add_unread, forget_actor, notify_later
+from .streaming import publish_message, publish_favorite
+
+
+@receiver(post_save, sender=Favorite)
+def increment_favorite_counts(sender, instance: Favorite, created: bool, **kwargs):
+    if created:
+        increment(Message, instance.message_id, 'favorite_count')
+        refresh_user_counts_later(instance.user_id)
+
+
+@receiver(post_delete, sender=Favorite)
+def decrement_favorite_counts(sender, instance: Favorite, **kwargs):
+    increment(Message, instance.message_id, 'favorite_count', -1)
+    refresh_user_counts_later(instance.user_id)
+
+
+@receiver(post_save, sender=Message)
+def increment_message_counts(sender, instance: Message, created: bool, **kwargs):
+    if created:
+        refresh_user_counts_later(instance.owner_id)
+        if instance.parent_id is not None:
+            increment(Message, instance.parent_id, 'reply_count')
+
+
+@receiver(post_delete, sender=Message)
+def decrement_message_counts(sender, instance: Message, **kwargs):
+    refresh_user_counts_later(instance.owner_id)
+    if instance.parent_id is not None:
+        increment(Message, instance.parent_id, 'reply_count', -1)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def invalidate_message(sender, instance: Message, **kwargs):
+    previous_parent_id = getattr(instance, 'previous_parent_id', None)
+    representation_cache.invalidate_messages([instance.pk, instance.parent_id, previous_parent_id], changed=True)
+    representation_cache.invalidate_users([instance.owner_id])
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def invalidate_favorite(sender, instance: Favorite, **kwargs):
+    representation_cache.invalidate_messages([instance.message_id], reranked=True)
+    representation_cache.invalidate_users([instance.user_id])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance: User, **kwargs):
+    representation_cache.invalidate_users([instance.pk])
+
+
+@receiver(post_save, sender=Message)
+def stream_message(sender, instance: Message, created: bool, **kwargs):
+    if created:
+        transaction.on_commit(lambda: publish_message(instance))
+
+
+@receiver(post_save, sender=Favorite)
+def stream_favorite(sender, instance: Favorite, created: bool, **kwargs):
+    if created:
+        transaction.on_commit(lambda: publish_favorite(instance, 1))
+
+
+@receiver(post_delete, sender=Favorite)
+def stream_unfavorite(sender, instance: Favorite, **kwargs):
+    transaction.on_commit(lambda: publish_favorite(instance, -1))
+
+
+@receiver(post_save, sender=Message)
+def notify_reply(sender, instance: Message, created: bool, **kwargs):
+    if created and instance.parent_id is not None:
+        notify_later(Notification.REPLY, instance.owner_id, [instance.parent_id])
+
+
+@receiver(post_save, sender=Favorite)
+def notify_favorite(sender, instance: Favorite, created: bool, **kwargs):
+    if created:
+        notify_later(Notification.FAVORITE, instance.user_id, [instance.message_id])
+
+
+@receiver(post_delete, sender=Notification)
+def decrement_unread_count(sender, instance: Notification, **kwargs):
+    if instance.unread:
+        add_unread(Counter({instance.recipient_id: -1}))
+
+
+@receiver(pre_delete, sender=User)
+def forget_notification_actor(sender, instance: User, **kwargs):
+    forget_actor(instance.pk)
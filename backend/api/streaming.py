@@ -0,0 +1,75 @@
+import asyncio
+import json
+import time
+
+from django.conf import settings
+from django.http import HttpResponseBadRequest, HttpResponseNotAllowed, StreamingHttpResponse
+
+from .pubsub import hub
+
+MESSAGES_CHANNEL = 'messages'
+FAVORITES_CHANNEL = 'favorites'
+
+
+def replies_channel(parent_id) -> str:
+    return f'replies:{parent_id}'
+
+
+def publish_message(message):
+    event = {'event': 'message', 'data': {
+        'id': message.pk,
+        'parent': message.parent_id,
+        'owner': message.owner_id,
+        'created': message.created.isoformat(),
+    }}
+    hub.publish(MESSAGES_CHANNEL, event)
+    if message.parent_id is not None:
+        hub.publish(replies_channel(message.parent_id), event)
+
+
+def publish_favorite(favorite, delta: int):
+    hub.publish(FAVORITES_CHANNEL, {'event': 'favorite', 'data': {'message': favorite.message_id, 'delta': delta}})
+
+
+def format_event(event: str, data) -> str:
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+async def stream_events(subscription):
+    options = settings.API_STREAM
+    deadline = time.monotonic() + options['MAX_AGE']
+    try:
+        yield f'retry: {options["RETRY"] * 1000}\n\n'
+        while time.monotonic() < deadline:
+            try:
+                event = await subscription.get(timeout=options['KEEPALIVE'])
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            dropped = subscription.take_dropped()
+            if dropped:
+                yield format_event('overflow', {'dropped': dropped})
+            yield format_event(event['event'], event['data'])
+    finally:
+        hub.unsubscribe(subscription)
+
+
+async def message_stream(request):
+    """
+    Server-Sent Events stream of new messages and favorite count deltas.
+
+    `?parent=<id>` narrows message events to replies of that message. Connections are closed after
+    `API_STREAM['MAX_AGE']` seconds and EventSource clients reconnect on their own, which bounds the
+    lifetime of connections whose client went away without the server noticing.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    parent = request.GET.get('parent')
+    if parent is not None and not parent.isdigit():
+        return HttpResponseBadRequest('Invalid parent')
+    channels = [FAVORITES_CHANNEL, MESSAGES_CHANNEL if parent is None else replies_channel(parent)]
+    subscription = hub.subscribe(channels)
+    response = StreamingHttpResponse(stream_events(subscription), content_type='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,3 +1,1439 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import gzip
+import json
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Max
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import test
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from messageboard import settings_api
+
+from .admin import EstimatedCountPaginator
+from .cache import representation_cache
+from .models import Message, User, Favorite, Job, Notification
+from .pubsub import hub
+from .serializers import UserSerializer
+from . import instrumentation, jobs, renderers, throttling
+
+
+# Jobs run inline in tests, so that their effects can be asserted right after the request that enqueued them.
+eager_jobs = override_settings(API_JOBS=dict(settings.API_JOBS, EAGER=True))
+
+
+@eager_jobs
+class APITestCase(test.APITestCase):
+    def setUp(self):
+        representation_cache.clear()
+        throttling.store.clear()
+
+    def assertCountersConsistent(self):
+        out = StringIO()
+        call_command('reconcile_counters', dry_run=True, stdout=out)
+        self.assertNotIn('Found 1', out.getvalue())
+        self.assertEqual(out.getvalue().count('Found 0'), 2)
+        for message in Message.objects.all():
+            expected = Message.get_hot_score(message.created, message.favorite_count, message.reply_count)
+            self.assertAlmostEqual(message.hot_score, expected, places=4)
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.bob = User.objects.create_user('bob@example.com', 'bob', 'password')
+        self.post = Message.objects.create(text='post', owner=self.alice)
+        for i in range(24):
+            Message.objects.create(text=f'message {i}', owner=self.alice if i % 2 else self.bob,
+                                   parent=self.post if i % 3 == 0 else None)
+
+    def collect(self, url):
+        ids = []
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(message['id'] for message in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_pages_cover_feed_in_order(self):
+        expected = list(Message.objects.order_by('-created', '-id').values_list('id', flat=True))
+        self.assertEqual(self.collect(reverse('message-list')), expected)
+
+    def test_no_count_query(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('message-list'))
+        self.assertNotIn('count', response.data)
+        self.assertFalse(any('COUNT(' in query['sql'] and 'GROUP BY' not in query['sql']
+                             for query in context.captured_queries))
+
+    def test_new_messages_do_not_shift_pages(self):
+        first = self.client.get(reverse('message-list'))
+        Message.objects.create(text='late', owner=self.bob)
+        second = self.client.get(first.data['next'])
+        first_ids = {message['id'] for message in first.data['results']}
+        second_ids = {message['id'] for message in second.data['results']}
+        self.assertFalse(first_ids & second_ids)
+        self.assertEqual(len(second_ids), 10)
+
+    def test_previous_link_returns_prior_page(self):
+        first = self.client.get(reverse('message-list'))
+        second = self.client.get(first.data['next'])
+        previous = self.client.get(second.data['previous'])
+        self.assertEqual(previous.data['results'], first.data['results'])
+        self.assertIsNone(first.data['previous'])
+
+    def test_filters(self):
+        url = reverse('message-list')
+        self.assertEqual(self.collect(f'{url}?user=bob'),
+                         list(self.bob.messages.order_by('-created', '-id').values_list('id', flat=True)))
+        self.assertEqual(self.collect(f'{url}?parent={self.post.id}'),
+                         list(self.post.children.order_by('-created', '-id').values_list('id', flat=True)))
+        self.assertEqual(len(self.collect(f'{url}?posts=true')), Message.objects.filter(parent=None).count())
+
+    def test_children(self):
+        ids = self.collect(reverse('message-children', args=[self.post.id]))
+        self.assertEqual(ids, list(self.post.children.order_by('-created', '-id').values_list('id', flat=True)))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('message-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+class CounterTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.bob = User.objects.create_user('bob@example.com', 'bob', 'password')
+        self.post = Message.objects.create(text='post', owner=self.alice)
+
+    def test_favorite_and_unfavorite(self):
+        url = reverse('message-favorite-create-destroy', args=[self.post.id])
+        self.client.force_authenticate(self.bob)
+        self.client.post(url)
+        self.client.post(url)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.favorite_count, 1)
+        self.client.delete(url)
+        self.client.delete(url)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.favorite_count, 0)
+
+    def test_reply_count_on_create_and_cascade(self):
+        self.client.force_authenticate(self.bob)
+        parent_url = reverse('message-detail', args=[self.post.id])
+        response = self.client.post(reverse('message-list'), {'text': 'reply', 'parent': parent_url})
+        self.assertEqual(response.status_code, 201)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.reply_count, 1)
+        reply = Message.objects.get(pk=response.data['id'])
+        Favorite.objects.create(user=self.alice, message=reply)
+        self.bob.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.reply_count, 0)
+
+    def test_reconcile_counters(self):
+        Favorite.objects.create(user=self.bob, message=self.post)
+        Message.objects.filter(pk=self.post.pk).update(favorite_count=7, reply_count=3)
+        User.objects.filter(pk=self.alice.pk).update(message_count=0, favorite_count=5)
+        call_command('reconcile_counters', batch_size=1, stdout=StringIO())
+        self.post.refresh_from_db()
+        self.alice.refresh_from_db()
+        self.assertEqual((self.post.favorite_count, self.post.reply_count), (1, 0))
+        self.assertEqual((self.alice.message_count, self.alice.favorite_count), (1, 0))
+
+
+class QueryCountTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.post = Message.objects.create(text='post', owner=self.alice)
+
+    def populate(self, count: int):
+        start = User.objects.count()
+        for i in range(start, start + count):
+            user = User.objects.create(username=f'user{i}', email=f'user{i}@example.com')
+            message = Message.objects.create(text=f'message {i}', owner=user, parent=self.post)
+            Message.objects.create(text=f'reply {i}', owner=self.alice, parent=message)
+            Favorite.objects.create(user=user, message=message)
+            Favorite.objects.create(user=self.alice, message=message)
+
+    def count_queries(self, url: str) -> int:
+        representation_cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def assertConstantQueries(self, *urls: str):
+        self.populate(2)
+        small = [self.count_queries(url) for url in urls]
+        self.populate(8)
+        large = [self.count_queries(url) for url in urls]
+        self.assertEqual(small, large)
+
+    def test_message_endpoints(self):
+        self.assertConstantQueries(reverse('message-list'), reverse('message-detail', args=[self.post.id]),
+                                   reverse('message-children', args=[self.post.id]))
+
+    def test_user_endpoints(self):
+        self.assertConstantQueries(reverse('user-list'), reverse('user-detail', args=[self.alice.id]),
+                                   reverse('user-list') + '?expand=messages,favorites',
+                                   reverse('user-message-list', args=[self.alice.id]),
+                                   reverse('user-favorite-list', args=[self.alice.id]))
+
+    def test_authenticated_message_list(self):
+        self.client.force_authenticate(self.alice)
+        self.assertConstantQueries(reverse('message-list'))
+
+    def test_favorited_lookup(self):
+        url = reverse('message-list')
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        self.assertFalse(any('api_favorite' in query['sql'] for query in context.captured_queries))
+        representation_cache.clear()
+        Favorite.objects.create(user=self.alice, message=self.post)
+        self.client.force_authenticate(self.alice)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(sum('api_favorite' in query['sql'] for query in context.captured_queries), 1)
+        self.assertEqual([message['favorited'] for message in response.data['results']], [True])
+
+
+class UserResourceTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.bob = User.objects.create_user('bob@example.com', 'bob', 'password')
+        self.messages = [Message.objects.create(text=f'message {i}', owner=self.alice) for i in range(15)]
+        for message in self.messages:
+            Favorite.objects.create(user=self.bob, message=message)
+
+    def test_counts_and_links(self):
+        response = self.client.get(reverse('user-detail', args=[self.bob.id]))
+        self.assertEqual(response.data['message_count'], 0)
+        self.assertEqual(response.data['favorite_count'], 15)
+        self.assertTrue(response.data['favorites'].endswith(reverse('user-favorite-list', args=[self.bob.id])))
+        self.assertNotIn('recent_favorites', response.data)
+
+    def test_expand(self):
+        response = self.client.get(reverse('user-list'), {'expand': 'messages,favorites'})
+        users = {user['id']: user for user in response.data['results']}
+        self.assertEqual(len(users[self.alice.id]['recent_messages']), UserSerializer.expand_limit)
+        self.assertEqual(users[self.alice.id]['recent_favorites'], [])
+        latest = reverse('message-detail', args=[self.messages[-1].id])
+        self.assertTrue(users[self.bob.id]['recent_favorites'][0].endswith(latest))
+
+    def test_sub_collections(self):
+        response = self.client.get(reverse('user-favorite-list', args=[self.bob.id]))
+        self.assertEqual(len(response.data['results']), 10)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 5)
+        response = self.client.get(reverse('user-message-list', args=[self.alice.id]))
+        self.assertEqual(response.data['results'][0]['id'], self.messages[-1].id)
+        self.assertEqual(self.client.get(reverse('user-message-list', args=[999])).status_code, 404)
+
+
+class RepresentationCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.bob = User.objects.create_user('bob@example.com', 'bob', 'password')
+        self.post = Message.objects.create(text='post', owner=self.alice)
+
+    def get(self, url: str, queries: int):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def check_read_through(self):
+        # Every request runs one cheap validator query; cache hits add nothing to it.
+        list_url = reverse('message-list')
+        detail_url = reverse('message-detail', args=[self.post.id])
+        user_url = reverse('user-detail', args=[self.bob.id])
+        first = self.get(list_url, 3)
+        self.assertEqual(self.get(list_url, 1), first)
+        self.assertEqual(self.get(detail_url, 1)['text'], 'post')
+        self.get(user_url, 2)
+        self.get(user_url, 1)
+
+        Favorite.objects.create(user=self.bob, message=self.post)
+        self.assertEqual(self.get(detail_url, 3)['favorite_count'], 1)
+        self.assertEqual(self.get(user_url, 2)['favorite_count'], 1)
+
+        Message.objects.create(text='reply', owner=self.bob, parent=self.post)
+        self.assertEqual(len(self.get(list_url, 3)['results']), 2)
+        self.assertEqual(self.get(detail_url, 1)['reply_count'], 1)
+        self.assertGreater(representation_cache.stats()['hits'], 0)
+
+    def test_local_memory_backend(self):
+        self.check_read_through()
+
+    def test_file_based_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            caches_setting = {
+                **settings.CACHES,
+                settings.API_CACHE_ALIAS: {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': directory,
+                },
+            }
+            with self.settings(CACHES=caches_setting):
+                representation_cache.clear()
+                self.check_read_through()
+
+    def test_culling_other_caches(self):
+        list_url = reverse('message-list')
+        representation_cache.clear()
+        self.client.get(list_url)
+        Message.objects.create(text='new', owner=self.bob)
+        # Like the read-your-writes keys of many writing clients.
+        for index in range(1000):
+            caches['default'].set(f'db:primary:user:{index}', True)
+        self.assertEqual(self.client.get(list_url).data['results'][0]['text'], 'new')
+
+    def test_favorited_is_per_viewer(self):
+        Favorite.objects.create(user=self.bob, message=self.post)
+        detail_url = reverse('message-detail', args=[self.post.id])
+        self.assertFalse(self.client.get(detail_url).data['favorited'])
+        self.client.force_authenticate(self.bob)
+        self.assertTrue(self.client.get(detail_url).data['favorited'])
+        self.client.force_authenticate(self.alice)
+        self.assertFalse(self.client.get(detail_url).data['favorited'])
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.post = Message.objects.create(text='post', owner=self.alice)
+
+    def assertRevalidates(self, url: str, change):
+        response = self.client.get(url)
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        self.assertIn('Last-Modified', response.headers)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_message_list(self):
+        self.assertRevalidates(reverse('message-list'),
+                               lambda: Message.objects.create(text='new', owner=self.alice))
+
+    def test_message_detail(self):
+        self.assertRevalidates(reverse('message-detail', args=[self.post.id]),
+                               lambda: Favorite.objects.create(user=self.alice, message=self.post))
+
+    def test_user_list(self):
+        self.assertRevalidates(reverse('user-list'),
+                               lambda: User.objects.create(username='bob', email='bob@example.com'))
+
+    def test_user_detail(self):
+        self.assertRevalidates(reverse('user-detail', args=[self.alice.id]),
+                               lambda: Message.objects.create(text='new', owner=self.alice))
+
+    def test_page_query_runs_once(self):
+        url = reverse('message-list') + '?q=post'
+        # Only requests with validators to check run the search once for them and once for the page.
+        for headers, searches in [({}, 1), ({'HTTP_IF_NONE_MATCH': 'W/"stale"'}, 2)]:
+            representation_cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, **headers)
+            self.assertEqual(sum(' MATCH ' in query['sql'] for query in queries), searches)
+        self.assertEqual(response.data['results'][0]['id'], self.post.id)
+        etag = self.client.get(url).headers['ETag']
+        self.assertEqual(len(etag), len('W/""') + 32)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_viewer_specific_etag(self):
+        url = reverse('message-detail', args=[self.post.id])
+        etag = self.client.get(url).headers['ETag']
+        self.client.force_authenticate(self.alice)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class StreamTests(APITestCase):
+    async def read_events(self, response, count: int) -> list:
+        events = []
+        async for chunk in response.streaming_content:
+            chunk = chunk.decode()
+            if chunk.startswith('event:'):
+                events.append(chunk)
+                if len(events) == count:
+                    break
+        return events
+
+    async def test_hub_fan_out_and_overflow(self):
+        subscribers = hub.subscriber_count()
+        first = hub.subscribe(['messages'])
+        second = hub.subscribe(['replies:1'])
+        try:
+            for i in range(settings.API_STREAM['QUEUE_SIZE'] + 5):
+                hub.publish('messages', {'event': 'message', 'data': i})
+            await asyncio.sleep(0)
+            self.assertEqual(first.queue.qsize(), settings.API_STREAM['QUEUE_SIZE'])
+            self.assertEqual(first.take_dropped(), 5)
+            self.assertTrue(second.queue.empty())
+        finally:
+            hub.unsubscribe(first)
+            hub.unsubscribe(second)
+        self.assertEqual(hub.subscriber_count(), subscribers)
+
+    async def test_stream_replies_and_favorites(self):
+        response = await self.async_client.get(reverse('stream'), {'parent': '7'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        reader = asyncio.ensure_future(self.read_events(response, 2))
+        await asyncio.sleep(0.05)
+        hub.publish('messages', {'event': 'message', 'data': {'id': 1}})
+        hub.publish('replies:7', {'event': 'message', 'data': {'id': 2, 'parent': 7}})
+        hub.publish('favorites', {'event': 'favorite', 'data': {'message': 7, 'delta': 1}})
+        events = await asyncio.wait_for(reader, 5)
+        self.assertEqual(events, ['event: message\ndata: {"id":2,"parent":7}\n\n',
+                                  'event: favorite\ndata: {"message":7,"delta":1}\n\n'])
+
+    async def test_invalid_parent(self):
+        response = await self.async_client.get(reverse('stream'), {'parent': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ThreadTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.root = Message.objects.create(text='root', owner=self.alice)
+        self.first = Message.objects.create(text='first', owner=self.alice, parent=self.root)
+        self.second = Message.objects.create(text='second', owner=self.alice, parent=self.root)
+        self.nested = Message.objects.create(text='nested', owner=self.alice, parent=self.first)
+        self.deep = Message.objects.create(text='deep', owner=self.alice, parent=self.nested)
+        Message.objects.create(text='other', owner=self.alice)
+
+    def test_nested(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('message-thread', args=[self.root.id]))
+        root = response.data
+        self.assertEqual(root['id'], self.root.id)
+        self.assertEqual([reply['id'] for reply in root['replies']], [self.second.id, self.first.id])
+        first = root['replies'][1]
+        self.assertEqual(first['replies'][0]['replies'][0]['id'], self.deep.id)
+        self.assertEqual(first['replies'][0]['replies'][0]['depth'], 3)
+        self.assertEqual(root['subtree_count'], 5)
+
+    def test_flat_with_limits(self):
+        response = self.client.get(reverse('message-thread', args=[self.root.id]), {'flat': 'true', 'max_depth': 1})
+        results = response.data['results']
+        self.assertEqual([(message['id'], message['depth']) for message in results],
+                         [(self.root.id, 0), (self.second.id, 1), (self.first.id, 1)])
+        self.assertIsNone(results[0]['more_replies'])
+        self.assertTrue(results[2]['more_replies'].endswith(reverse('message-children', args=[self.first.id])))
+        response = self.client.get(reverse('message-thread', args=[self.root.id]), {'flat': 'true', 'limit': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['results'][0]['more_replies'])
+
+    def test_missing(self):
+        self.assertEqual(self.client.get(reverse('message-thread', args=[999])).status_code, 404)
+
+    def test_thread_columns(self):
+        self.deep.refresh_from_db()
+        self.assertEqual((self.deep.root_id, self.deep.depth), (self.root.id, 3))
+        self.assertEqual(self.deep.path, ''.join(Message.path_segment(message.pk)
+                                                 for message in [self.root, self.first, self.nested, self.deep]))
+        self.first.refresh_from_db()
+        self.assertEqual(set(self.first.get_subtree()), {self.first, self.nested, self.deep})
+
+    def test_delete_subtree(self):
+        self.client.force_authenticate(self.alice)
+        self.client.delete(reverse('message-detail', args=[self.nested.id]))
+        self.assertFalse(Message.objects.filter(pk__in=[self.nested.id, self.deep.id]).exists())
+        self.root.refresh_from_db()
+        self.assertEqual(self.root.reply_count, 2)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.reply_count, 0)
+
+    def test_move_subtree(self):
+        self.client.force_authenticate(self.alice)
+        url = reverse('message-detail', args=[self.first.id])
+        response = self.client.put(url, {'text': 'first', 'parent': reverse('message-detail', args=[self.second.id])})
+        self.assertEqual(response.status_code, 200)
+        self.deep.refresh_from_db()
+        self.assertEqual(self.deep.depth, 4)
+        self.assertTrue(self.deep.path.startswith(Message.path_segment(self.root.id) +
+                                                  Message.path_segment(self.second.id)))
+        response = self.client.put(url, {'text': 'first', 'parent': reverse('message-detail', args=[self.deep.id])})
+        self.assertEqual(response.status_code, 400)
+
+    def test_move_with_save(self):
+        first = Message.objects.get(pk=self.first.id)
+        first.parent = self.second
+        first.save()
+        self.deep.refresh_from_db()
+        self.assertEqual((self.deep.root_id, self.deep.depth), (self.root.id, 4))
+        self.assertTrue(self.deep.path.startswith(first.path))
+        self.root.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.root.reply_count, self.second.reply_count), (1, 1))
+        nested = Message.objects.get(pk=self.nested.id)
+        nested.parent = None
+        nested.save()
+        self.deep.refresh_from_db()
+        self.assertEqual((self.deep.root_id, self.deep.depth), (self.nested.id, 1))
+        first.refresh_from_db()
+        self.assertEqual(first.reply_count, 0)
+        first.delete_subtree()
+        self.assertEqual(Message.objects.filter(pk__in=[self.nested.id, self.deep.id]).count(), 2)
+
+    def test_move_in_admin(self):
+        staff = User.objects.create_superuser('staff@example.com', 'staff', 'password')
+        self.client.force_login(staff)
+        response = self.client.post(reverse('admin:api_message_change', args=[self.nested.id]), {
+            'text': 'nested', 'owner': self.alice.id, 'parent': self.second.id,
+            'favorite_count': 0, 'reply_count': 1,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.deep.refresh_from_db()
+        self.assertTrue(self.deep.path.startswith(Message.path_segment(self.root.id) +
+                                                  Message.path_segment(self.second.id)))
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.reply_count, self.second.reply_count), (0, 1))
+        self.first.delete_subtree()
+        self.assertTrue(Message.objects.filter(pk=self.deep.id).exists())
+
+    def test_backfill(self):
+        Message.objects.update(root=None, depth=0, path='')
+        call_command('backfill_thread_paths', batch_size=2, stdout=StringIO())
+        self.deep.refresh_from_db()
+        self.assertEqual((self.deep.root_id, self.deep.depth), (self.root.id, 3))
+        self.assertEqual(len(self.deep.path), 4 * Message.PATH_SEGMENT_WIDTH)
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.bob = User.objects.create_user('bob@example.com', 'bob', 'password')
+        self.post = Message.objects.create(text='Django keyset pagination', owner=self.alice)
+        self.reply = Message.objects.create(text='pagination pagination everywhere', owner=self.bob, parent=self.post)
+        Message.objects.create(text='nothing to see here', owner=self.bob)
+
+    def search(self, **params):
+        response = self.client.get(reverse('message-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return [message['id'] for message in response.data['results']]
+
+    def test_ranked_results(self):
+        self.assertEqual(self.search(q='pagination'), [self.reply.id, self.post.id])
+        self.assertEqual(self.search(q='django pagination'), [self.post.id])
+        self.assertEqual(self.search(q='"OR" NEAR('), [])
+
+    def test_combined_with_filters(self):
+        self.assertEqual(self.search(q='pagination', user='alice'), [self.post.id])
+        self.assertEqual(self.search(q='pagination', posts='false'), [self.reply.id])
+
+    def test_index_follows_writes(self):
+        self.post.text = 'renamed'
+        self.post.save()
+        self.assertEqual(self.search(q='django'), [])
+        self.reply.delete()
+        self.assertEqual(self.search(q='pagination'), [])
+
+    def test_keyset_pages(self):
+        for i in range(12):
+            Message.objects.create(text=f'pagination {i}', owner=self.alice)
+        ids = []
+        url = reverse('message-list') + '?q=pagination'
+        while url:
+            response = self.client.get(url)
+            ids.extend(message['id'] for message in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len(ids), 14)
+        self.assertEqual(len(set(ids)), 14)
+
+
+class HotFeedTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.bob = User.objects.create_user('bob@example.com', 'bob', 'password')
+        self.old = Message.objects.create(text='old', owner=self.alice)
+        self.new = Message.objects.create(text='new', owner=self.alice)
+
+    def hot(self, **params):
+        response = self.client.get(reverse('message-list'), {'sort': 'hot', **params})
+        self.assertEqual(response.status_code, 200)
+        return [message['id'] for message in response.data['results']]
+
+    def expected_score(self, message) -> float:
+        message.refresh_from_db()
+        return Message.get_hot_score(message.created, message.favorite_count, message.reply_count)
+
+    def test_activity_and_age(self):
+        self.assertEqual(self.hot(posts='true'), [self.new.id, self.old.id])
+        Favorite.objects.create(user=self.bob, message=self.old)
+        self.assertEqual(self.hot(posts='true'), [self.old.id, self.new.id])
+        # A day of age is worth about a hundredfold activity, more than one favorite makes up for
+        aged = self.expected_score(self.old) - 86400 / Message.HOT_DECAY
+        Message.objects.filter(pk=self.old.pk).update(hot_score=aged)
+        representation_cache.clear()
+        self.assertEqual(self.hot(posts='true'), [self.new.id, self.old.id])
+
+    def test_incremental_updates(self):
+        Favorite.objects.create(user=self.bob, message=self.old)
+        reply = Message.objects.create(text='reply', owner=self.bob, parent=self.old)
+        self.assertAlmostEqual(Message.objects.get(pk=self.old.pk).hot_score, self.expected_score(self.old))
+        self.assertEqual(self.hot(posts='true'), [self.old.id, self.new.id])
+        reply.delete()
+        Favorite.objects.filter(message=self.old).delete()
+        self.assertAlmostEqual(Message.objects.get(pk=self.old.pk).hot_score, self.expected_score(self.old))
+
+    def test_rebuild(self):
+        Message.objects.update(hot_score=0)
+        Message.objects.filter(pk=self.old.pk).update(favorite_count=3)
+        call_command('rebuild_hot_scores', batch_size=1, stdout=StringIO())
+        for message in Message.objects.all():
+            self.assertAlmostEqual(message.hot_score, self.expected_score(message))
+
+    def test_cached_pages_follow_favorites(self):
+        Favorite.objects.create(user=self.bob, message=self.old)
+        self.assertEqual(self.hot(), [self.old.id, self.new.id])
+        Favorite.objects.filter(message=self.old).delete()
+        Favorite.objects.create(user=self.bob, message=self.new)
+        self.assertEqual(self.hot(), [self.new.id, self.old.id])
+
+    def test_keyset_pages(self):
+        for i in range(12):
+            message = Message.objects.create(text=f'message {i}', owner=self.alice)
+            if i % 3 == 0:
+                Favorite.objects.create(user=self.bob, message=message)
+        ids = []
+        url = reverse('message-list') + '?sort=hot'
+        while url:
+            response = self.client.get(url)
+            ids.extend(message['id'] for message in response.data['results'])
+            url = response.data['next']
+        expected = Message.objects.order_by('-hot_score', '-id').values_list('id', flat=True)
+        self.assertEqual(ids, list(expected))
+
+
+class BulkWriteTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.bob = User.objects.create_user('bob@example.com', 'bob', 'password')
+        self.messages = [Message.objects.create(text=f'message {i}', owner=self.alice) for i in range(3)]
+        self.client.force_authenticate(self.bob)
+
+    def test_batch_favorite(self):
+        url = reverse('message-favorite-batch')
+        ids = [message.id for message in self.messages]
+        Favorite.objects.create(user=self.bob, message=self.messages[0])
+        self.client.get(reverse('message-detail', args=[ids[1]]))
+        # Seven queries for the favorites and seven for notifying alice, which jobs run inline in tests.
+        with self.assertNumQueries(14):
+            response = self.client.post(url, {'messages': ids + ids[:1]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(Favorite.objects.filter(user=self.bob).count(), 3)
+        self.assertEqual(self.client.get(reverse('message-detail', args=[ids[1]])).data['favorite_count'], 1)
+        self.assertCountersConsistent()
+
+        # A savepoint and its release, one query validating the ids, two for the favorites and two for the counters.
+        with self.assertNumQueries(7), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(url, {'messages': ids[:2]}, format='json')
+        self.assertEqual(response.data['deleted'], 2)
+        self.assertEqual(self.client.get(reverse('user-detail', args=[self.bob.id])).data['favorite_count'], 1)
+        self.assertCountersConsistent()
+
+    def test_batch_favorite_validation(self):
+        url = reverse('message-favorite-batch')
+        response = self.client.post(url, {'messages': [self.messages[0].id, 999]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.post(url, {'messages': []}, format='json').status_code, 400)
+        self.assertFalse(Favorite.objects.exists())
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.post(url, {'messages': [self.messages[0].id]}, format='json').status_code, 401)
+
+    def test_import(self):
+        lines = [
+            {'id': 'a', 'text': 'imported post', 'owner': 'bob', 'created': '2020-01-01T00:00:00Z'},
+            {'id': 'b', 'text': 'reply', 'owner': 'alice', 'parent': 'a'},
+            {'id': 'c', 'text': 'nested reply', 'owner': 'bob', 'parent': 'b'},
+            {'id': 'd', 'text': 'another reply', 'owner': 'bob', 'parent': 'a'},
+            {'id': 'e', 'text': 'another post', 'owner': 'alice'},
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as file:
+            file.write('\n'.join(json.dumps(line) for line in lines) + '\n')
+            file.flush()
+            call_command('import_messages', file.name, batch_size=2, stdout=StringIO())
+        post = Message.objects.get(text='imported post')
+        self.assertEqual(post.created.year, 2020)
+        self.assertEqual(post.reply_count, 2)
+        self.assertEqual(post.get_subtree().count(), 4)
+        nested = Message.objects.get(text='nested reply')
+        self.assertEqual((nested.root_id, nested.depth), (post.id, 2))
+        self.assertTrue(nested.is_in_subtree_of(Message.objects.get(text='reply')))
+        self.assertEqual(self.client.get(reverse('message-list'), {'q': 'nested'}).data['results'][0]['id'], nested.id)
+        self.assertCountersConsistent()
+
+    def test_import_errors(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as file:
+            file.write(json.dumps({'id': 1, 'text': 'orphan', 'owner': 'bob', 'parent': 2}) + '\n')
+            file.flush()
+            with self.assertRaisesMessage(CommandError, 'Line 1'):
+                call_command('import_messages', file.name, stdout=StringIO())
+        self.assertEqual(Message.objects.count(), 3)
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.bob = User.objects.create_user('bob@example.com', 'bob', 'password')
+        self.post = Message.objects.create(text='post, with "quotes"', owner=self.alice)
+        self.reply = Message.objects.create(text='reply', owner=self.bob, parent=self.post)
+        Favorite.objects.create(user=self.bob, message=self.post)
+
+    def export(self, *args) -> bytes:
+        with tempfile.NamedTemporaryFile() as file:
+            call_command('export_board', *args, '--output', file.name, '--chunk-size', '1')
+            return file.read()
+
+    def test_ndjson(self):
+        lines = [json.loads(line) for line in self.export().decode().splitlines()]
+        self.assertEqual([line['table'] for line in lines], ['users', 'users', 'messages', 'messages', 'favorites'])
+        self.assertEqual(lines[3], {
+            'table': 'messages', 'id': self.reply.id, 'parent': self.post.id, 'owner': 'bob', 'text': 'reply',
+            'created': self.reply.created.isoformat(), 'favorite_count': 0, 'reply_count': 0,
+        })
+        self.assertNotIn('password', lines[0])
+
+    def test_csv_gzip_and_resume(self):
+        data = gzip.decompress(self.export('--tables', 'messages', '--format', 'csv', '--gzip'))
+        rows = list(csv.reader(StringIO(data.decode())))
+        self.assertEqual(rows[0], ['id', 'parent', 'owner', 'text', 'created', 'favorite_count', 'reply_count'])
+        self.assertEqual(rows[1][3], 'post, with "quotes"')
+        resumed = self.export('--tables', 'messages,favorites', '--after', str(self.post.id)).decode().splitlines()
+        self.assertEqual([json.loads(line)['table'] for line in resumed], ['messages', 'favorites'])
+        with self.assertRaises(CommandError):
+            self.export('--tables', 'messages,users', '--format', 'csv')
+
+    def test_round_trip(self):
+        exported = self.export('--tables', 'messages').decode().splitlines()
+        Message.objects.all().delete()
+        with tempfile.NamedTemporaryFile('w') as file:
+            file.write('\n'.join(exported))
+            file.flush()
+            call_command('import_messages', file.name, stdout=StringIO())
+        self.assertEqual(Message.objects.get(text='reply').parent.text, self.post.text)
+
+    def test_endpoint(self):
+        url = reverse('export')
+        self.client.force_authenticate(self.alice)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.alice.is_staff = True
+        self.alice.save()
+        response = self.client.get(url, {'tables': 'favorites', 'output': 'csv', 'gzip': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        data = gzip.decompress(b''.join(response.streaming_content)).decode()
+        self.assertEqual(len(data.splitlines()), 2)
+        self.assertEqual(self.client.get(url, {'tables': 'passwords'}).status_code, 400)
+
+
+class ThrottleTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        throttling.metrics.clear()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        rates = mock.patch.dict(throttling.TokenBucketThrottle.THROTTLE_RATES, {'register': '2/min', 'write': '3/min'})
+        rates.start()
+        self.addCleanup(rates.stop)
+
+    def register(self, username: str):
+        return self.client.post(reverse('register'), {
+            'username': username, 'email': f'{username}@example.com',
+            'password': 'correct horse battery', 'password_repeat': 'correct horse battery',
+        })
+
+    def test_rejected_before_any_work(self):
+        self.assertEqual(self.register('bob').status_code, 201)
+        self.assertEqual(self.register('carol').status_code, 201)
+        # Credentials other than bearer tokens are not even looked at.
+        self.client.credentials(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(b'alice:password').decode())
+        with self.assertNumQueries(0), mock.patch('django.contrib.auth.hashers.make_password') as make_password, \
+                mock.patch.object(User, 'check_password') as check_password:
+            response = self.register('dave')
+        self.assertEqual(response.status_code, 429)
+        make_password.assert_not_called()
+        check_password.assert_not_called()
+        self.assertEqual(int(response['Retry-After']), 30)
+        self.assertEqual(throttling.metrics.stats(), {'register': 1})
+
+    def test_writes_per_user(self):
+        url = reverse('message-list')
+        parent = reverse('message-detail', args=[Message.objects.create(text='post', owner=self.alice).id])
+        self.client.force_authenticate(self.alice)
+        statuses = [self.client.post(url, {'text': f'reply {i}', 'parent': parent}).status_code for i in range(4)]
+        self.assertEqual(statuses, [201, 201, 201, 429])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(Message.objects.count(), 4)
+
+    def test_forwarded_for_is_not_trusted(self):
+        url = reverse('message-list')
+        with mock.patch.dict(throttling.TokenBucketThrottle.THROTTLE_RATES, {'ip': '2/min'}):
+            statuses = [self.client.get(url, HTTP_X_FORWARDED_FOR=f'10.0.0.{i}').status_code for i in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_refill(self):
+        state = None
+        allowed = []
+        for now in [0, 0, 0, 0, 20, 20]:
+            state, ok, wait = throttling.refill(state, now, 3, 60, 1)
+            allowed.append(ok)
+        self.assertEqual(allowed, [True, True, True, False, True, False])
+        self.assertEqual(wait, 20)
+
+    def test_stores(self):
+        for store in [throttling.InMemoryStore(), throttling.CacheStore()]:
+            store.clear()
+            self.assertEqual([store.consume('key', 2, 60)[0] for _ in range(3)], [True, True, False])
+            self.assertTrue(store.consume('other', 2, 60)[0])
+
+
+class TokenTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.post = Message.objects.create(text='post', owner=self.alice)
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'alice', 'password': 'password'})
+        self.tokens = response.data
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.tokens["access"]}')
+
+    def test_user_from_claims(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('message-detail', args=[self.post.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('FROM "api_user"' in query['sql'] for query in context.captured_queries))
+        reply = Message.objects.create(text='reply', owner=self.alice, parent=self.post)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.put(reverse('message-detail', args=[reply.id]), {
+                'text': 'edited', 'parent': reverse('message-detail', args=[self.post.id]),
+            })
+        self.assertEqual(response.status_code, 200)
+        # Writes only check that the user is still active.
+        self.assertEqual(sum('FROM "api_user"' in query['sql'] for query in context.captured_queries), 1)
+        response = self.client.post(reverse('message-list'), {
+            'text': 'reply', 'parent': reverse('message-detail', args=[self.post.id]),
+        })
+        self.assertEqual(Message.objects.get(pk=response.data['id']).owner, self.alice)
+
+    def test_deleted_or_inactive_user(self):
+        url = reverse('message-list')
+        User.objects.filter(pk=self.alice.id).update(is_active=False)
+        self.assertEqual(self.client.post(url, {'text': 'post'}).status_code, 401)
+        self.alice.delete()
+        self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.post(url, {'text': 'post'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'user_not_found')
+        response = self.client.post(reverse('message-favorite-batch'), {'messages': [self.post.id]}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_deferred_fields_load_on_access(self):
+        self.assertEqual(self.client.get(reverse('export')).status_code, 403)
+        self.alice.is_staff = True
+        self.alice.save()
+        self.assertEqual(self.client.get(reverse('export')).status_code, 200)
+
+    def test_purge_expired_tokens(self):
+        self.client.post(reverse('token_refresh'), {'refresh': self.tokens['refresh']})
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+        OutstandingToken.objects.update(expires_at=timezone.now())
+        OutstandingToken.objects.create(jti='live', token='live', expires_at=timezone.now() + timedelta(days=1))
+        call_command('purge_expired_tokens', batch_size=1, stdout=StringIO())
+        self.assertEqual(BlacklistedToken.objects.count(), 0)
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, OutstandingToken._meta.db_table)
+        self.assertIn('outstanding_token_expires_idx', constraints)
+
+
+class InstrumentationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        instrumentation.registry.clear()
+        instrumentation.profiles.clear()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.post = Message.objects.create(text='post', owner=self.alice)
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('message-list'))
+        timings = dict(entry.split(';', 1) for entry in response['Server-Timing'].split(', '))
+        self.assertIn(f'desc="{len(context.captured_queries)} queries"', timings['db'])
+        self.assertGreater(float(timings['serialize'].split('=')[1]), 0)
+
+    def test_metrics(self):
+        self.client.get(reverse('message-list'))
+        self.client.get(reverse('message-detail', args=[self.post.id]))
+        self.client.get(reverse('message-detail', args=[self.post.id]))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertIn('api_request_duration_seconds_count{view="message-detail",method="GET"} 2', metrics)
+        self.assertIn('api_request_duration_seconds_bucket{view="message-list",method="GET",le="+Inf"} 1', metrics)
+        self.assertIn('api_requests_total{view="message-detail",method="GET",status="200"} 2', metrics)
+        self.assertIn('api_db_queries_total{view="message-list",method="GET"}', metrics)
+        self.assertIn('api_cache_requests_total{result="hit"} 2', metrics)
+        self.assertIn('api_stream_subscribers 0', metrics)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+    def test_staff_profiles(self):
+        instrumentation_settings = dict(settings.API_INSTRUMENTATION, PROFILE_SAMPLE_RATE=1.0)
+        with self.settings(API_INSTRUMENTATION=instrumentation_settings):
+            self.client.force_authenticate(self.alice)
+            self.client.get(reverse('message-list'))
+            self.assertEqual(len(instrumentation.profiles), 0)
+            self.alice.is_staff = True
+            self.alice.save()
+            self.client.get(reverse('message-list'))
+        self.assertEqual(len(instrumentation.profiles), 1)
+        response = self.client.get(reverse('metrics-profiles'))
+        self.assertEqual(response.data[0]['path'], reverse('message-list'))
+        self.assertIn('cumulative', response.data[0]['stats'])
+
+    def test_disabled(self):
+        with self.settings(API_INSTRUMENTATION=dict(settings.API_INSTRUMENTATION, ENABLED=False)):
+            response = test.APIClient().get(reverse('message-list'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(instrumentation.registry.latency, {})
+
+
+class BenchmarkTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        call_command('seed_board', users=20, messages=300, favorites=400, window=50, max_depth=5, batch_size=64,
+                     stdout=StringIO())
+
+    def test_seed_board(self):
+        self.assertEqual(User.objects.filter(username__startswith='seed-').count(), 20)
+        self.assertEqual(Message.objects.count(), 300)
+        self.assertLessEqual(max(Message.objects.values_list('depth', flat=True)), 5)
+        self.assertTrue(Message.objects.filter(parent=None).exists())
+        self.assertGreater(Favorite.objects.count(), 200)
+        out = StringIO()
+        call_command('reconcile_counters', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue().count('Found 0'), 2)
+        counts = sorted(User.objects.values_list('favorite_count', flat=True), reverse=True)
+        self.assertGreater(counts[0], 3 * counts[-1])
+        call_command('seed_board', users=2, messages=0, favorites=0, stdout=StringIO())
+        self.assertTrue(User.objects.filter(username='seed-21').exists())
+
+    def test_benchmark_api(self):
+        counts = list(Message.objects.order_by('pk').values_list('pk', 'favorite_count', 'reply_count'))
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as file:
+            call_command('benchmark_api', requests=2, warmup=0, output=file.name, stdout=StringIO())
+            report = json.load(file)
+        self.assertEqual(report['uncovered'], [])
+        self.assertIn('stream', report['skipped'])
+        self.assertEqual(report['data']['messages'], 300)
+        for name, result in report['results'].items():
+            self.assertTrue(all(status.startswith('2') for status in result['statuses']), name)
+            self.assertLessEqual(result['p50'], result['p99'])
+        self.assertGreater(report['results']['GET message-thread']['queries'], 0)
+        self.assertEqual(list(Message.objects.order_by('pk').values_list('pk', 'favorite_count', 'reply_count')),
+                         counts)
+        self.assertFalse(User.objects.filter(username__startswith='benchmark').exists())
+
+    def test_benchmark_renderers(self):
+        out = StringIO()
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as file:
+            call_command('benchmark_renderers', messages=20, repeat=1, output=file.name, stdout=out)
+            results = json.load(file)['results']
+        self.assertLess(results['compact, orjson']['bytes'], results['full, DRF JSONRenderer']['bytes'])
+        self.assertEqual(results['compact, orjson']['bytes'], results['compact, stdlib']['bytes'])
+        self.assertIn('smaller', out.getvalue())
+
+    def test_benchmark_compare(self):
+        with tempfile.NamedTemporaryFile('w+', suffix='.json') as file:
+            call_command('benchmark_api', requests=1, warmup=0, only=['user-detail'], output=file.name,
+                         stdout=StringIO())
+            report = json.load(file)
+            report['results']['GET user-detail']['queries'] = 0
+            file.seek(0)
+            file.truncate()
+            json.dump(report, file)
+            file.flush()
+            with self.assertRaisesMessage(CommandError, 'GET user-detail'):
+                call_command('benchmark_api', requests=1, warmup=0, only=['user-detail'], compare=file.name,
+                             stdout=StringIO())
+
+
+@eager_jobs
+class ReplicaRoutingTests(test.APITransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        caches['default'].clear()
+        representation_cache.clear()
+        throttling.store.clear()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.post = Message.objects.create(text='post', owner=self.alice)
+
+    def get_queries(self, method: str, url: str, data=None) -> tuple:
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = getattr(self.client, method)(url, data, format='json')
+        return response, len(primary), len(replica)
+
+    def test_reads_go_to_replica(self):
+        response, primary, replica = self.get_queries('get', reverse('message-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+        _, primary, replica = self.get_queries('get', reverse('user-detail', args=[self.alice.id]))
+        self.assertEqual((primary, replica), (0, 2))
+
+    def test_read_your_writes(self):
+        self.client.force_authenticate(self.alice)
+        url = reverse('message-list')
+        data = {'text': 'reply', 'parent': reverse('message-detail', args=[self.post.id])}
+        response, _, replica = self.get_queries('post', url, data)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(replica, 0)
+        response, primary, replica = self.get_queries('get', url)
+        self.assertEqual(response.data['results'][0]['text'], 'reply')
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+        # Other clients and the writer itself once the pin expires read from the replica again.
+        self.client.force_authenticate(None)
+        self.assertEqual(self.get_queries('get', url)[1], 0)
+        caches['default'].clear()
+        self.client.force_authenticate(self.alice)
+        self.assertEqual(self.get_queries('get', url)[1], 0)
+
+    def test_replica_is_read_only(self):
+        with self.assertRaisesMessage(OperationalError, 'readonly'):
+            Message.objects.using('replica').filter(pk=self.post.pk).update(text='changed')
+        with connections['default'].cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.API_DATABASE['PRAGMAS']['busy_timeout'])
+
+    def test_benchmark_database(self):
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as file:
+            call_command('benchmark_database', workers=[1, 2], duration=0.1, write_rate=50, output=file.name,
+                         stdout=StringIO())
+            report = json.load(file)
+        self.assertEqual(report['messages'], 1)
+        for profile in ['stock', 'tuned']:
+            self.assertEqual([result['workers'] for result in report['results'][profile]], [1, 2])
+            self.assertTrue(all(result['reads'] > 0 for result in report['results'][profile]))
+        self.assertEqual(Message.objects.get().favorite_count, 0)
+
+
+class JobTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.post = Message.objects.create(text='post', owner=self.alice)
+        self.reply = Message.objects.create(text='reply', owner=self.alice, parent=self.post)
+        self.queued = self.settings(API_JOBS=dict(settings.API_JOBS, EAGER=False, BACKOFF=60))
+        self.queued.enable()
+        self.addCleanup(self.queued.disable)
+
+    def run_workers(self) -> str:
+        out = StringIO()
+        call_command('run_workers', processes=0, once=True, stdout=out)
+        return out.getvalue()
+
+    def test_queued_after_commit(self):
+        self.client.force_authenticate(self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            for message in [self.post, self.reply]:
+                response = self.client.post(reverse('message-favorite-create-destroy', args=[message.id]))
+                self.assertEqual(response.status_code, 201)
+        job = Job.objects.get(name='refresh_user_counts')
+        self.assertEqual((job.name, job.args, job.key), ('refresh_user_counts', [self.alice.id],
+                                                         f'refresh_user_counts:{self.alice.id}'))
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.favorite_count, 0)
+        self.assertEqual(Message.objects.get(pk=self.post.id).favorite_count, 1)
+
+        # Notifying alice of her own favorites is queued as well, and does nothing.
+        self.assertIn('Ran 3 jobs. 0 attempts failed.', self.run_workers())
+        self.assertFalse(Notification.objects.exists())
+        self.assertFalse(Job.objects.exists())
+        response = self.client.get(reverse('user-detail', args=[self.alice.id]))
+        self.assertEqual((response.data['favorite_count'], response.data['message_count']), (2, 2))
+
+    def test_rolled_back_write_queues_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Favorite.objects.create(user=self.alice, message=self.post)
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertFalse(Job.objects.exists())
+
+    def test_retries(self):
+        calls = []
+
+        def flaky(value):
+            calls.append(value)
+            if len(calls) < 3:
+                raise RuntimeError('flaky')
+
+        with mock.patch.dict(jobs.handlers, {'flaky': flaky}), self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('flaky', 1)
+        with mock.patch.dict(jobs.handlers, {'flaky': flaky}), self.assertLogs('api.jobs', 'ERROR') as logs:
+            self.assertEqual(jobs.run_pending(), (0, 1))
+            job = Job.objects.get()
+            self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+            self.assertIn('RuntimeError: flaky', job.error)
+            self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=59))
+            self.assertEqual(jobs.run_pending(), (0, 0))
+
+            Job.objects.update(run_at=timezone.now())
+            self.assertEqual(jobs.run_pending(), (0, 1))
+            self.assertGreater(Job.objects.get().run_at, timezone.now() + timedelta(seconds=119))
+            Job.objects.update(run_at=timezone.now())
+            self.assertEqual(jobs.run_pending(), (1, 0))
+        self.assertEqual(calls, [1, 1, 1])
+        self.assertEqual(len(logs.records), 2)
+        self.assertFalse(Job.objects.exists())
+
+    def test_failed_and_abandoned_jobs(self):
+        Job.objects.create(name='unknown', attempts=settings.API_JOBS['MAX_ATTEMPTS'] - 1)
+        Job.objects.create(name='refresh_user_counts', args=[self.alice.id], status=Job.RUNNING,
+                           locked_at=timezone.now() - timedelta(seconds=settings.API_JOBS['TIMEOUT'] + 1))
+        Job.objects.create(name='refresh_user_counts', args=[self.alice.id], status=Job.RUNNING,
+                           locked_at=timezone.now())
+        with self.assertLogs('api.jobs', 'ERROR'):
+            self.assertEqual(jobs.run_pending(), (1, 1))
+        self.assertEqual(list(Job.objects.values_list('status', flat=True).order_by('id')),
+                         [Job.FAILED, Job.RUNNING])
+
+    def test_eager(self):
+        self.queued.disable()
+        with self.assertRaisesMessage(ValueError, 'Unknown job'):
+            jobs.enqueue('unknown')
+        User.objects.filter(pk=self.alice.id).update(message_count=0)
+        jobs.enqueue('refresh_user_counts', self.alice.id)
+        self.assertEqual(User.objects.get(pk=self.alice.id).message_count, 2)
+        self.assertFalse(Job.objects.exists())
+        self.queued.enable()
+
+
+class NotificationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.bob, self.carol = [User.objects.create_user(f'{name}@example.com', name, 'password')
+                                            for name in ['alice', 'bob', 'carol']]
+        self.post = Message.objects.create(text='post', owner=self.alice)
+        self.other = Message.objects.create(text='other', owner=self.alice)
+        self.url = reverse('notification-list')
+
+    def inbox(self, query: str = '') -> dict:
+        self.client.force_authenticate(self.alice)
+        return self.client.get(self.url + query).data
+
+    def test_fan_out_and_coalescing(self):
+        Favorite.objects.create(user=self.bob, message=self.post)
+        Message.objects.create(text='reply', owner=self.carol, parent=self.post)
+        Favorite.objects.create(user=self.carol, message=self.post)
+        Favorite.objects.create(user=self.alice, message=self.other)
+        Message.objects.create(text='own reply', owner=self.alice, parent=self.other)
+        data = self.inbox()
+        self.assertEqual(data['unread_count'], 2)
+        self.assertEqual([(item['kind'], item['actor_count'], item['summary']) for item in data['results']], [
+            ('favorite', 2, 'carol and 1 other favorited your message.'),
+            ('reply', 1, 'carol replied to your message.'),
+        ])
+        self.assertTrue(data['results'][0]['message'].endswith(reverse('message-detail', args=[self.post.id])))
+        self.assertTrue(data['results'][0]['actor'].endswith(reverse('user-detail', args=[self.carol.id])))
+
+    def test_repeated_actor(self):
+        for text in ['reply', 'another reply']:
+            Message.objects.create(text=text, owner=self.bob, parent=self.post)
+        Message.objects.create(text='reply', owner=self.carol, parent=self.post)
+        Message.objects.create(text='one more', owner=self.bob, parent=self.post)
+        data = self.inbox()
+        self.assertEqual(data['unread_count'], 1)
+        self.assertEqual([(item['actor_count'], item['summary']) for item in data['results']],
+                         [(2, 'bob and 1 other replied to your message.')])
+        self.post.delete_subtree()
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(self.inbox()['unread_count'], 0)
+
+    def test_deleted_actors(self):
+        Favorite.objects.create(user=self.bob, message=self.post)
+        Favorite.objects.create(user=self.carol, message=self.post)
+        self.bob.delete()
+        self.assertEqual([(item['actor_count'], item['summary']) for item in self.inbox()['results']],
+                         [(1, 'carol favorited your message.')])
+        self.carol.delete()
+        self.assertEqual([(item['actor_count'], item['summary']) for item in self.inbox()['results']],
+                         [(0, 'Someone favorited your message.')])
+
+    def test_batch_fan_out(self):
+        self.client.force_authenticate(self.bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('message-favorite-batch'), {'messages': [self.post.id, self.other.id]},
+                             format='json')
+        self.assertEqual(self.inbox()['unread_count'], 2)
+        self.assertEqual(Notification.objects.filter(recipient=self.alice, kind='favorite').count(), 2)
+
+    def test_inbox_queries(self):
+        for index in range(5):
+            Message.objects.create(text='reply', owner=self.bob, parent=self.post)
+            Favorite.objects.create(user=self.bob, message=Message.objects.create(text='post', owner=self.alice))
+        self.client.force_authenticate(self.alice)
+        with self.assertNumQueries(2):
+            data = self.client.get(self.url).data
+        self.assertEqual(data['unread_count'], 6)
+        self.assertEqual(len(data['results']), 6)
+        response = self.client.get(self.url + '?page_size=4')
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertEqual(len(self.client.get(response.data['next']).data['results']), 2)
+
+    def test_mark_read(self):
+        Favorite.objects.create(user=self.bob, message=self.post)
+        Favorite.objects.create(user=self.bob, message=self.other)
+        first, second = [item['id'] for item in self.inbox()['results']]
+        read_url = reverse('notification-read')
+        response = self.client.post(read_url, {'notifications': [first, 999]}, format='json')
+        self.assertEqual(response.data, {'read': 1, 'unread_count': 1})
+        self.assertEqual([item['id'] for item in self.inbox('?unread=true')['results']], [second])
+        self.assertEqual(self.client.post(read_url, {'notifications': [first]}, format='json').data['read'], 0)
+
+        # Events after a notification was read start a new one.
+        Favorite.objects.create(user=self.carol, message=self.other)
+        data = self.inbox()
+        self.assertEqual((data['unread_count'], len(data['results'])), (2, 3))
+        self.assertEqual(self.client.post(read_url, {'all': True}, format='json').data,
+                         {'read': 2, 'unread_count': 0})
+
+        self.assertEqual(self.client.post(read_url, {}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(read_url, {'all': True, 'notifications': [1]}, format='json').status_code,
+                         400)
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(self.client.post(read_url, {'all': True}, format='json').data['read'], 0)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_deleted_message(self):
+        Favorite.objects.create(user=self.bob, message=self.post)
+        Favorite.objects.create(user=self.bob, message=self.other)
+        self.post.delete_subtree()
+        self.assertEqual(self.inbox()['unread_count'], 1)
+        out = StringIO()
+        call_command('reconcile_counters', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue().count('Found 0'), 2)
+
+
+class CompactRepresentationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.bob = User.objects.create_user('bob@example.com', 'bob', 'password')
+        self.post = Message.objects.create(text='post', owner=self.alice)
+        for i in range(14):
+            Message.objects.create(text=f'reply {i}', owner=self.bob, parent=self.post if i % 2 else None)
+        Favorite.objects.create(user=self.bob, message=self.post)
+
+    def collect(self, url):
+        ids = []
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/json; profile=compact')
+            ids.extend(message['id'] for message in response.json()['results'])
+            url = response.json()['next']
+        return ids
+
+    def test_list(self):
+        url = reverse('message-list')
+        self.assertEqual(self.collect(f'{url}?format=compact'),
+                         list(Message.objects.order_by('-created', '-id').values_list('id', flat=True)))
+        self.assertEqual(self.collect(f'{url}?format=compact&sort=hot'),
+                         list(Message.objects.order_by('-hot_score', '-id').values_list('id', flat=True)))
+        self.assertEqual(len(self.collect(f'{url}?format=compact&q=reply')), 14)
+        self.assertEqual(self.collect(f'{reverse("user-message-list", args=[self.alice.id])}?format=compact'),
+                         [self.post.id])
+        self.assertEqual(self.collect(f'{reverse("message-children", args=[self.post.id])}?format=compact'),
+                         list(self.post.children.order_by('-created', '-id').values_list('id', flat=True)))
+
+    def test_representation(self):
+        self.client.force_authenticate(self.bob)
+        response = self.client.get(reverse('message-detail', args=[self.post.id]), {'format': 'compact'})
+        children = list(self.post.children.order_by('-created', '-id').values_list('id', flat=True))
+        self.post.refresh_from_db()
+        self.assertEqual(response.json(), {
+            'id': self.post.id, 'text': 'post', 'created': self.post.created.isoformat().replace('+00:00', 'Z'),
+            'owner': self.alice.id, 'username': 'alice', 'parent': None, 'children': children,
+            'favorite_count': 1, 'reply_count': 7, 'favorited': True,
+        })
+        self.assertIn('Accept', response['Vary'])
+        full = self.client.get(reverse('message-detail', args=[self.post.id])).json()
+        self.assertEqual(full['created'], response.json()['created'])
+        self.assertEqual(self.client.get(reverse('message-detail', args=[999]), {'format': 'compact'}).status_code,
+                         404)
+
+    def test_negotiation(self):
+        url = reverse('message-list')
+        compact = self.client.get(url, HTTP_ACCEPT='application/json; profile=compact')
+        self.assertEqual(compact['Content-Type'], 'application/json; profile=compact')
+        self.assertNotIn('url', compact.json()['results'][0])
+        for accept in ['*/*', 'application/json']:
+            response = self.client.get(url, HTTP_ACCEPT=accept)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertIn('url', response.json()['results'][0])
+        self.assertEqual(self.client.get(reverse('user-list'), {'format': 'compact'}).status_code, 404)
+
+    def test_stdlib_fallback(self):
+        data = {'created': self.post.created, 'text': 'line\u2028separator', 'ids': [1, 2]}
+        rendered = renderers.FastJSONRenderer().render(data)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderers.FastJSONRenderer().render(data), rendered)
+        self.assertIn(b'\\u2028', rendered)
+        self.assertEqual(json.loads(rendered)['created'], self.post.created.isoformat().replace('+00:00', 'Z'))
+
+    def test_errors_of_list_items(self):
+        # DRF keys the errors of list items by their integer index.
+        self.client.force_authenticate(self.bob)
+        for url, data in [(reverse('message-favorite-batch'), {'messages': ['abc']}),
+                          (reverse('message-favorite-batch'), {'messages': [0]}),
+                          (reverse('notification-read'), {'notifications': ['x']})]:
+            response = self.client.post(url, data, format='json')
+            self.assertEqual(response.status_code, 400, url)
+            self.assertIn('0', next(iter(response.json().values())))
+        data = {1: ['error']}
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderers.FastJSONRenderer().render(data), b'{"1":["error"]}')
+        self.assertEqual(renderers.FastJSONRenderer().render(data), b'{"1":["error"]}')
+
+    def test_non_finite_floats(self):
+        for value in [float('nan'), float('inf')]:
+            data = {'results': [{'hot_score': value, 'parent': None}]}
+            with self.assertRaisesMessage(ValueError, 'Out of range float values'):
+                renderers.FastJSONRenderer().render(data)
+            with mock.patch.object(renderers, 'orjson', None), \
+                    self.assertRaisesMessage(ValueError, 'Out of range float values'):
+                renderers.FastJSONRenderer().render(data)
+        self.assertEqual(renderers.FastJSONRenderer().render({'score': 1.5, 'parent': None}),
+                         b'{"score":1.5,"parent":null}')
+
+
+class ApiProfileTests(APITestCase):
+    def test_settings(self):
+        self.assertNotIn('django.contrib.admin', settings_api.INSTALLED_APPS)
+        self.assertNotIn('django.contrib.sessions.middleware.SessionMiddleware', settings_api.MIDDLEWARE)
+        self.assertEqual(settings_api.REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'],
+                         ('api.authentication.TokenClaimsAuthentication',))
+        self.assertEqual(settings_api.REST_FRAMEWORK['PAGE_SIZE'], settings.REST_FRAMEWORK['PAGE_SIZE'])
+
+    def test_token_requests_without_session_middleware(self):
+        alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        post = Message.objects.create(text='post', owner=alice)
+        with self.settings(MIDDLEWARE=settings_api.MIDDLEWARE):
+            tokens = self.client.post(reverse('token_obtain_pair'), {'username': 'alice', 'password': 'password'})
+            self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens.data["access"]}')
+            response = self.client.post(reverse('message-list'), {
+                'text': 'reply', 'parent': reverse('message-detail', args=[post.id]),
+            })
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(self.client.get(reverse('notification-list')).status_code, 200)
+
+    def test_benchmark_startup(self):
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as file:
+            call_command('benchmark_startup', runs=1, requests=2, output=file.name, stdout=StringIO())
+            results = json.load(file)['results']
+        default, api_only = results['messageboard.settings'], results['messageboard.settings_api']
+        self.assertEqual(default['statuses'], ['200'])
+        self.assertEqual(api_only['statuses'], ['200'])
+        self.assertLess(api_only['modules'], default['modules'])
+        self.assertGreater(api_only['rss_mib'], 0)
+
+
+class AdminTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create_superuser('staff@example.com', 'staff', 'password')
+        self.alice = User.objects.create_user('alice@example.com', 'alice', 'password')
+        self.bob = User.objects.create_user('bob@example.com', 'bob', 'password')
+        self.post = Message.objects.create(text='post', owner=self.alice)
+        self.reply = Message.objects.create(text='reply', owner=self.bob, parent=self.post)
+        self.nested = Message.objects.create(text='nested', owner=self.alice, parent=self.reply)
+        self.other = Message.objects.create(text='other', owner=self.alice)
+        Favorite.objects.create(user=self.bob, message=self.nested)
+        Favorite.objects.create(user=self.bob, message=self.other)
+        Favorite.objects.create(user=self.alice, message=self.reply)
+        self.client.force_login(self.staff)
+
+    def test_changelists_do_not_query_per_row(self):
+        for url in [reverse('admin:api_message_changelist'), reverse('admin:api_favorite_changelist')]:
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            for i in range(5):
+                message = Message.objects.create(text=f'more {i}', owner=self.bob, parent=self.other)
+                Favorite.objects.create(user=self.alice, message=message)
+            self.assertNumQueries(len(context), self.client.get, url)
+
+    def test_estimated_count(self):
+        with mock.patch.object(EstimatedCountPaginator, 'count_limit', 2):
+            paginator = EstimatedCountPaginator(Message.objects.order_by('-pk'), 2)
+            self.assertEqual(paginator.count, Message.objects.aggregate(max=Max('pk'))['max'])
+            filtered = Message.objects.filter(pk=self.post.pk).order_by('pk')
+            self.assertEqual(EstimatedCountPaginator(filtered, 2).count, 1)
+        response = self.client.get(reverse('admin:api_message_changelist'))
+        self.assertContains(response, '4 messages')
+
+    def test_change_form_has_no_message_select(self):
+        response = self.client.get(reverse('admin:api_message_change', args=[self.reply.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'vForeignKeyRawIdAdminField')
+        self.assertNotContains(response, f'<option value="{self.other.pk}"')
+
+    def test_delete_threads(self):
+        url = reverse('admin:api_message_changelist')
+        response = self.client.get(url)
+        self.assertNotIn('delete_selected', dict(response.context['action_form'].fields['action'].choices))
+        response = self.client.post(url, {'action': 'delete_threads', '_selected_action': [self.reply.pk]},
+                                    follow=True)
+        self.assertContains(response, 'Deleted 2 messages.')
+        self.assertEqual(set(Message.objects.values_list('pk', flat=True)), {self.post.pk, self.other.pk})
+        self.assertEqual(Favorite.objects.count(), 1)
+        self.assertEqual(Message.objects.get(pk=self.post.pk).reply_count, 0)
+        self.assertEqual(Notification.objects.filter(message=self.reply).count(), 0)
+        self.assertCountersConsistent()
+
+    def test_purge_content(self):
+        url = reverse('admin:api_user_changelist')
+        response = self.client.post(url, {'action': 'purge_content', '_selected_action': [self.bob.pk]}, follow=True)
+        self.assertContains(response, 'Deleted 2 messages and 2 favorites.')
+        self.assertEqual(set(Message.objects.values_list('pk', flat=True)), {self.post.pk, self.other.pk})
+        self.assertEqual(Favorite.objects.count(), 0)
+        self.assertEqual(Message.objects.get(pk=self.other.pk).favorite_count, 0)
+        self.bob.refresh_from_db()
+        self.assertEqual((self.bob.message_count, self.bob.favorite_count), (0, 0))
+        self.assertCountersConsistent()
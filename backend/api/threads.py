@@ -0,0 +1,23 @@
+def get_thread(root, max_depth: int, limit: int) -> list:
+    """
+    Return the subtree of `root` level by level, stopping `max_depth` levels below it or after `limit` messages,
+    whichever comes first. This is a single range query on the thread's path index.
+    """
+    subtree = root.get_subtree().filter(depth__lte=root.depth + max_depth)
+    return list(subtree.order_by('depth', 'path')[:limit])
+
+
+def nest(messages: list, representations: list) -> dict:
+    """
+    Turn representations of `messages`, listed parents first, into a tree of `replies` and return its root.
+    """
+    nodes = {}
+    root = None
+    for message, representation in zip(messages, representations):
+        node = nodes[message.pk] = dict(representation, replies=[])
+        parent = nodes.get(message.parent_id)
+        if parent is None:
+            root = root or node
+        else:
+            parent['replies'].append(node)
+    return root
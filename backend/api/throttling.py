@@ -0,0 +1,178 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework import permissions, throttling
+
+
+def refill(state, now: float, capacity: int, duration: float, cost: int) -> tuple[tuple, bool, float]:
+    """
+    Take `cost` tokens from a bucket of `capacity` tokens refilled evenly over `duration` seconds.
+    Return the new `(tokens, updated)` state, whether the tokens were taken and the seconds to wait otherwise.
+    """
+    rate = capacity / duration
+    tokens, updated = state if state is not None else (capacity, now)
+    tokens = min(capacity, tokens + max(now - updated, 0) * rate)
+    if tokens >= cost:
+        return (tokens - cost, now), True, 0
+    return (tokens, now), False, (cost - tokens) / rate
+
+
+class BaseStore:
+    """
+    Holds the state of every token bucket.
+    """
+
+    def consume(self, key: str, capacity: int, duration: float, cost: int = 1) -> tuple[bool, float]:
+        raise NotImplementedError('`consume()` must be implemented.')
+
+    def clear(self):
+        raise NotImplementedError('`clear()` must be implemented.')
+
+
+class InMemoryStore(BaseStore):
+    """
+    Buckets of the current process only, the least recently used dropped past `API_THROTTLE['MAX_ENTRIES']`.
+    A dropped bucket comes back full, which only matters for keys idle longer than the most active ones.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+        self.max_entries = settings.API_THROTTLE['MAX_ENTRIES']
+
+    def consume(self, key: str, capacity: int, duration: float, cost: int = 1) -> tuple[bool, float]:
+        with self.lock:
+            state, allowed, wait = refill(self.buckets.get(key), time.time(), capacity, duration, cost)
+            self.buckets[key] = state
+            self.buckets.move_to_end(key)
+            if len(self.buckets) > self.max_entries:
+                self.buckets.popitem(last=False)
+        return allowed, wait
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class CacheStore(BaseStore):
+    """
+    Buckets in the `API_THROTTLE['CACHE_ALIAS']` cache, shared by every process using it.
+    Reads and writes are not atomic, so concurrent requests of one client may each take the same token.
+    """
+
+    @property
+    def cache(self):
+        return caches[settings.API_THROTTLE['CACHE_ALIAS']]
+
+    def consume(self, key: str, capacity: int, duration: float, cost: int = 1) -> tuple[bool, float]:
+        state, allowed, wait = refill(self.cache.get(key), time.time(), capacity, duration, cost)
+        # An untouched bucket is full again after `duration` seconds, so it can expire then.
+        self.cache.set(key, state, duration)
+        return allowed, wait
+
+    def clear(self):
+        self.cache.clear()
+
+
+class ThrottleMetrics:
+    """
+    Rejected requests per throttle scope, since the process started.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rejections = Counter()
+
+    def record(self, scope: str):
+        with self.lock:
+            self.rejections[scope] += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.rejections)
+
+    def clear(self):
+        with self.lock:
+            self.rejections.clear()
+
+
+class TokenBucketThrottle(throttling.SimpleRateThrottle):
+    """
+    Token bucket throttle: a rate of `N/period` allows bursts of N requests, refilled evenly over the period.
+
+    The state of a bucket is two numbers in `store`, read and written once per request, instead of the
+    request history kept by `SimpleRateThrottle`. Throttles run before the view but after authentication,
+    which checks the claims of bearer tokens and, for writes, reads the user's row, so rejected requests
+    never reach password hashing or database writes.
+    """
+    cost = 1
+
+    def allow_request(self, request, view) -> bool:
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        allowed, self.retry_after = store.consume(self.key, self.num_requests, self.duration, self.cost)
+        if not allowed:
+            metrics.record(self.scope)
+        return allowed
+
+    def wait(self) -> float:
+        return self.retry_after
+
+    def get_user_ident(self, request) -> str:
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return f'ip:{self.get_ident(request)}'
+
+
+class UserThrottle(TokenBucketThrottle):
+    """
+    All requests of a user, or of an address for anonymous requests.
+    """
+    scope = 'user'
+
+    def get_cache_key(self, request, view) -> str:
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_user_ident(request)}
+
+
+class IPThrottle(TokenBucketThrottle):
+    """
+    All requests from an address, whichever accounts they use.
+    """
+    scope = 'ip'
+
+    def get_cache_key(self, request, view) -> str:
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class WriteThrottle(TokenBucketThrottle):
+    """
+    Unsafe requests of a user, or of an address for anonymous requests, in the `throttle_scope` of the view
+    or the `write` scope.
+    """
+    scope = 'write'
+
+    def __init__(self):
+        # The rate depends on the view, so it is looked up in `allow_request()`.
+        pass
+
+    def allow_request(self, request, view) -> bool:
+        if request.method in permissions.SAFE_METHODS:
+            return True
+        self.scope = getattr(view, 'throttle_scope', self.scope)
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)
+
+    def get_cache_key(self, request, view) -> str:
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_user_ident(request)}
+
+
+store = import_string(settings.API_THROTTLE['STORE'])()
+metrics = ThrottleMetrics()
@@ -0,0 +1,38 @@
+from django.db import connections, models, transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+# Indexes on the tables of `rest_framework_simplejwt.token_blacklist`, whose models cannot declare them
+TOKEN_INDEXES = [
+    (OutstandingToken, models.Index(fields=['expires_at'], name='outstanding_token_expires_idx')),
+]
+
+
+def install_token_indexes(using: str = 'default'):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        tables = set(connection.introspection.table_names(cursor))
+        missing = [(model, index) for model, index in TOKEN_INDEXES if model._meta.db_table in tables and
+                   index.name not in connection.introspection.get_constraints(cursor, model._meta.db_table)]
+    if missing:
+        with connection.schema_editor() as schema_editor:
+            for model, index in missing:
+                schema_editor.add_index(model, index)
+
+
+def purge_expired_tokens(batch_size: int = 1000, now=None) -> int:
+    """
+    Delete outstanding refresh tokens that expired, with their blacklist entries, `batch_size` rows per transaction.
+    Expired tokens are rejected on their own, so their rows are no longer needed to blacklist them.
+    """
+    now = now or timezone.now()
+    total = 0
+    while True:
+        with transaction.atomic():
+            ids = list(OutstandingToken.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            BlacklistedToken.objects.filter(token_id__in=ids).delete()
+            OutstandingToken.objects.filter(pk__in=ids).only('pk').delete()
+        total += len(ids)
+    return total
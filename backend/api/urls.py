@@ -1,21 +1,32 @@
 from django.urls import path
 from rest_framework.urlpatterns import format_suffix_patterns
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
-from api import views
+from api import instrumentation, views, streaming
 
 urlpatterns = [
-    path('', views.APIRoot.as_view()),
+    path('', views.APIRoot.as_view(), name='api-root'),
     path('messages/', views.MessageList.as_view(), name='message-list'),
+    path('messages/favorite/', views.FavoriteBatch.as_view(), name='message-favorite-batch'),
     path('messages/<int:pk>/', views.MessageDetail.as_view({'get': 'retrieve', 'put': 'update', 'delete': 'destroy'}),
          name='message-detail'),
+    path('messages/<int:pk>/children/', views.MessageDetail.as_view({'get': 'children'}),
+         name='message-children'),
+    path('messages/<int:pk>/thread/', views.MessageDetail.as_view({'get': 'thread'}), name='message-thread'),
     path('messages/<int:pk>/favorite/', views.MessageDetail.as_view({'post': 'favorite', 'delete': 'unfavorite'}),
          name='message-favorite-create-destroy'),
     path('users/', views.UserList.as_view(), name='user-list'),
     path('users/<int:pk>/', views.UserDetail.as_view(), name='user-detail'),
+    path('users/<int:pk>/messages/', views.UserMessageList.as_view(), name='user-message-list'),
+    path('users/<int:pk>/favorites/', views.UserFavoriteList.as_view(), name='user-favorite-list'),
+    path('users/me/notifications/', views.NotificationList.as_view(), name='notification-list'),
+    path('users/me/notifications/read/', views.NotificationRead.as_view(), name='notification-read'),
+    path('export/', views.BoardExport.as_view(), name='export'),
+    path('metrics/', instrumentation.metrics_view, name='metrics'),
+    path('metrics/profiles/', views.ProfileList.as_view(), name='metrics-profiles'),
+    path('stream/', streaming.message_stream, name='stream'),
     path('register/', views.RegistrationAPIView.as_view(), name='register'),
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('token/', views.TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('token/refresh/', views.TokenRefreshView.as_view(), name='token_refresh'),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
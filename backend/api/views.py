@@ -1,13 +1,93 @@
-from django.db.models import Count, Exists, OuterRef
+import hashlib
+from collections import Counter, OrderedDict
+
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.db.models import Count, Max
 from rest_framework import views, viewsets, status, generics
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt import views as jwt_views
 
-from .models import Message, User, Favorite
+from .cache import representation_cache
+from .conditional import ConditionalGetMixin
+from .database import ReplicaReadMixin
+from .export import TABLES, export_board, get_tables
+from .instrumentation import profiles
+from .jobs import refresh_user_counts_later
+from .models import Message, User, Favorite, Notification, increment_many
+from .notifications import mark_read, notify_later
+from .pagination import HotPagination, KeysetPagination, NotificationPagination, SearchPagination
 from .permissions import IsOwnerOrReadOnly, MessagePermission
-from .serializers import MessageSerializer, UserSerializer, RegistrationSerializer
+from .renderers import CompactJSONRenderer
+from .serializers import (
+    MessageSerializer, UserSerializer, RegistrationSerializer, FavoriteSerializer, FavoriteBatchSerializer,
+    NotificationSerializer, NotificationReadSerializer, COMPACT_MESSAGE_EXPRESSIONS, COMPACT_MESSAGE_FIELDS,
+    compact_messages, get_favorited_ids,
+)
+from .search import search_messages
+from .streaming import publish_favorite
+from .threads import get_thread, nest
+
+
+def without_viewer(representation) -> dict:
+    return {key: value for key, value in representation.items() if key != 'favorited'}
+
+
+class CachedMessagesMixin:
+    """
+    Serves message representations from `representation_cache`, filling in the per-viewer `favorited` flag.
+    """
+
+    def get_cached_messages(self, base: str, ids: list) -> list:
+        keys = {pk: representation_cache.message_key(base, pk) for pk in ids}
+        found = representation_cache.get_many(list(keys.values()))
+        favorited = get_favorited_ids(self.request.user, ids)
+        missing = [pk for pk in ids if keys[pk] not in found]
+        if missing:
+            messages = list(Message.objects.filter(pk__in=missing))
+            for message in messages:
+                message.favorited = message.pk in favorited
+            serializer = self.get_serializer(messages, many=True)
+            fresh = {keys[item['id']]: without_viewer(item) for item in serializer.data}
+            representation_cache.set_many(fresh)
+            found.update(fresh)
+        return [dict(found[keys[pk]], favorited=pk in favorited) for pk in ids if keys[pk] in found]
+
+
+class CompactMessagesMixin:
+    """
+    Offers the compact message representation of `CompactJSONRenderer`, built from `values()` rows.
+    Compact responses skip `representation_cache`, whose entries hold the full representation.
+    """
+    renderer_classes = [CompactJSONRenderer, *api_settings.DEFAULT_RENDERER_CLASSES]
+    conditional_vary_headers = ('Authorization', 'Accept')
+
+    def perform_content_negotiation(self, request, force=False):
+        # DRF only matches a media type parameter like `profile` against an Accept header carrying it,
+        # so an explicit `?format=compact` would be rejected for the usual `Accept: */*`.
+        format = self.format_kwarg or request.query_params.get(api_settings.URL_FORMAT_OVERRIDE)
+        if format == CompactJSONRenderer.format:
+            renderer = CompactJSONRenderer()
+            return renderer, renderer.media_type
+        return super().perform_content_negotiation(request, force)
+
+    def is_compact(self) -> bool:
+        renderer = getattr(self.request, 'accepted_renderer', None)
+        return getattr(renderer, 'format', None) == CompactJSONRenderer.format
+
+    def get_compact_rows(self, queryset):
+        ordering = [field.lstrip('-') for field in getattr(self.paginator, 'ordering', ())]
+        fields = dict.fromkeys([*COMPACT_MESSAGE_FIELDS, *ordering])
+        return queryset.values(*fields, **COMPACT_MESSAGE_EXPRESSIONS)
+
+    def compact_list(self, queryset) -> Response:
+        page = self.paginate_queryset(self.get_compact_rows(queryset))
+        return self.get_paginated_response(compact_messages(page, self.request.user))
 
 
 class APIRoot(views.APIView):
@@ -16,6 +96,8 @@ class APIRoot(views.APIView):
         return Response({
             'users': reverse('user-list', request=request),
             'messages': reverse('message-list', request=request),
+            'notifications': reverse('notification-list', request=request),
+            'stream': reverse('stream', request=request),
             'register': reverse('register', request=request),
             'obtain_token': reverse('token_obtain_pair', request=request),
             'refresh_token': reverse('token_refresh', request=request),
@@ -24,6 +106,7 @@ class APIRoot(views.APIView):
 
 class RegistrationAPIView(views.APIView):
     serializer_class = RegistrationSerializer
+    throttle_scope = 'register'
 
     @staticmethod
     def post(request) -> Response:
@@ -34,25 +117,136 @@ class RegistrationAPIView(views.APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class UserList(generics.ListAPIView):
+class TokenObtainPairView(jwt_views.TokenObtainPairView):
+    throttle_scope = 'token'
+
+
+class TokenRefreshView(jwt_views.TokenRefreshView):
+    throttle_scope = 'token'
+
+
+class UserList(ReplicaReadMixin, ConditionalGetMixin, generics.ListAPIView):
     serializer_class = UserSerializer
     queryset = User.objects.all()
 
+    def get_validators(self):
+        users = User.objects.aggregate(count=Count('id'), modified=Max('modified'))
+        return f'users:{users["count"]}:{users["modified"]}', users['modified']
 
-class UserDetail(generics.RetrieveAPIView):
+    def list(self, request, *args, **kwargs) -> Response:
+        not_modified = self.check_not_modified(request)
+        if not_modified is not None:
+            return not_modified
+        return super().list(request, *args, **kwargs)
+
+
+class UserDetail(ReplicaReadMixin, ConditionalGetMixin, generics.RetrieveAPIView):
     serializer_class = UserSerializer
     queryset = User.objects.all()
 
+    def get_validators(self):
+        modified = User.objects.filter(pk=self.kwargs['pk']).values_list('modified', flat=True).first()
+        if modified is None:
+            return None
+        return f'user:{self.kwargs["pk"]}:{modified}', modified
+
+    def retrieve(self, request, *args, **kwargs) -> Response:
+        not_modified = self.check_not_modified(request)
+        if not_modified is not None:
+            return not_modified
+        base = representation_cache.get_base(request, kwargs.get('format'))
+        expand = set(request.query_params.get('expand', '').split(',')) & {'messages', 'favorites'}
+        key = representation_cache.user_key(base, kwargs['pk'], ','.join(sorted(expand)))
+        data = representation_cache.get(key)
+        if data is None:
+            response = super().retrieve(request, *args, **kwargs)
+            representation_cache.set(key, dict(response.data))
+            return response
+        return Response(data)
+
+
+class UserMessageList(ReplicaReadMixin, CompactMessagesMixin, generics.ListAPIView):
+    serializer_class = MessageSerializer
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        user = generics.get_object_or_404(User.objects.only('pk'), pk=self.kwargs['pk'])
+        return Message.objects.filter(owner=user)
+
+    def list(self, request, *args, **kwargs) -> Response:
+        if self.is_compact():
+            return self.compact_list(self.filter_queryset(self.get_queryset()))
+        return super().list(request, *args, **kwargs)
+
+
+class UserFavoriteList(ReplicaReadMixin, generics.ListAPIView):
+    serializer_class = FavoriteSerializer
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        user = generics.get_object_or_404(User.objects.only('pk'), pk=self.kwargs['pk'])
+        return Favorite.objects.filter(user=user)
+
+
+class NotificationList(ReplicaReadMixin, generics.ListAPIView):
+    """
+    Inbox of the current user, most recently active first, with `?unread=true` for unread notifications only.
+    """
+    serializer_class = NotificationSerializer
+    pagination_class = NotificationPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = Notification.objects.filter(recipient=self.request.user.pk).select_related('actor').only(
+            'kind', 'message_id', 'actor_count', 'unread', 'created', 'modified', 'actor__username',
+        )
+        if self.request.query_params.get('unread', '').lower() == 'true':
+            queryset = queryset.filter(unread=True)
+        return queryset
+
+    def list(self, request, *args, **kwargs) -> Response:
+        response = super().list(request, *args, **kwargs)
+        unread_count = User.objects.filter(pk=request.user.pk).values_list('unread_notification_count', flat=True)
+        response.data['unread_count'] = unread_count.first() or 0
+        return response
+
 
-class MessageList(generics.ListCreateAPIView):
+class NotificationRead(views.APIView):
+    """
+    Mark notifications of the current user as read, given as `{"notifications": [<id>, ...]}` or `{"all": true}`.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = NotificationReadSerializer
+
+    def post(self, request) -> Response:
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data.get('notifications')
+        read = mark_read(request.user.pk, ids)
+        unread_count = User.objects.filter(pk=request.user.pk).values_list('unread_notification_count', flat=True)
+        return Response({'read': read, 'unread_count': unread_count.first() or 0})
+
+
+class MessageList(ReplicaReadMixin, CompactMessagesMixin, ConditionalGetMixin, CachedMessagesMixin,
+                  generics.ListCreateAPIView):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
+    pagination_class = KeysetPagination
+    sort_pagination_classes = {'hot': HotPagination}
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('q') is not None:
+                self._paginator = SearchPagination()
+            else:
+                sort = self.request.query_params.get('sort')
+                self._paginator = self.sort_pagination_classes.get(sort, self.pagination_class)()
+        return self._paginator
 
     def get_queryset(self):
-        queryset = Message.objects.all().order_by('-created')
-        queryset = queryset.annotate(favorite_count=Count('favorited_by')).annotate(favorited=Exists(
-            Favorite.objects.filter(user=self.request.user.id, message=OuterRef('pk'))
-        ))
+        queryset = Message.objects.all().order_by('-created', '-id')
+        query = self.request.query_params.get('q')
         username = self.request.query_params.get('user')
         parent = self.request.query_params.get('parent')
         posts = self.request.query_params.get('posts')
@@ -66,29 +260,241 @@ class MessageList(generics.ListCreateAPIView):
                 queryset = queryset.filter(parent=None)
             elif posts == 'false':
                 queryset = queryset.exclude(parent=None)
+        if query is not None:
+            queryset = search_messages(queryset, query)
         return queryset
 
+    def get_validators(self):
+        queryset, _, _ = self.paginator.get_page_queryset(self.filter_queryset(self.get_queryset()), self.request)
+        return self.get_page_validators(list(queryset.values_list('id', 'modified')))
+
+    def get_page_validators(self, rows: list):
+        """
+        Validators of a page from its `(id, modified)` rows in page order, which are hashed into the version.
+        """
+        if not rows:
+            return None
+        digest = hashlib.md5(repr(rows).encode()).hexdigest()
+        return f'messages:{self.request.user.id}:{digest}', max(modified for _, modified in rows)
+
+    def list(self, request, *args, **kwargs) -> Response:
+        # The validators run the page query, so unconditional requests derive them from the rendered page instead.
+        conditional = self.is_conditional(request)
+        if conditional:
+            not_modified = self.check_not_modified(request)
+            if not_modified is not None:
+                return not_modified
+        response = self.list_page(request, *args, **kwargs)
+        if not conditional:
+            ids = [message['id'] for message in response.data['results']]
+            modified = dict(Message.objects.filter(pk__in=ids).values_list('id', 'modified'))
+            self.set_validators(request, self.get_page_validators([(pk, modified[pk]) for pk in ids if pk in modified]))
+        return response
+
+    def list_page(self, request, *args, **kwargs) -> Response:
+        if self.is_compact():
+            return self.compact_list(self.filter_queryset(self.get_queryset()))
+        base = representation_cache.get_base(request, kwargs.get('format'))
+        page_key = representation_cache.page_key(base, request, ranked=isinstance(self.paginator, HotPagination))
+        page = representation_cache.get(page_key)
+        if page is None:
+            response = super().list(request, *args, **kwargs)
+            results = response.data['results']
+            representation_cache.set(page_key, {
+                'next': response.data['next'],
+                'previous': response.data['previous'],
+                'ids': [message['id'] for message in results],
+            })
+            representation_cache.set_many({
+                representation_cache.message_key(base, message['id']): without_viewer(message) for message in results
+            })
+            return response
+        return Response(OrderedDict([
+            ('next', page['next']),
+            ('previous', page['previous']),
+            ('results', self.get_cached_messages(base, page['ids'])),
+        ]))
+
+    @transaction.atomic
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
 
-class MessageDetail(viewsets.ModelViewSet):
+class MessageDetail(ReplicaReadMixin, CompactMessagesMixin, ConditionalGetMixin, CachedMessagesMixin,
+                    viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [MessagePermission]
+    pagination_class = KeysetPagination
+    thread_max_depth = 20
+    thread_limit = 200
 
     def get_queryset(self):
-        queryset = Message.objects.all().order_by('-created')
-        queryset = queryset.annotate(favorite_count=Count('favorited_by')).annotate(favorited=Exists(
-            Favorite.objects.filter(user=self.request.user.id, message=OuterRef('pk'))
-        ))
+        queryset = Message.objects.all().order_by('-created', '-id')
         return queryset
 
+    def get_validators(self):
+        modified = Message.objects.filter(pk=self.kwargs['pk']).values_list('modified', flat=True).first()
+        if modified is None:
+            return None
+        return f'message:{self.kwargs["pk"]}:{self.request.user.id}:{modified}', modified
+
+    def retrieve(self, request, *args, **kwargs) -> Response:
+        not_modified = self.check_not_modified(request)
+        if not_modified is not None:
+            return not_modified
+        if self.is_compact():
+            rows = self.get_compact_rows(self.get_queryset().filter(pk=kwargs['pk']))
+            data = compact_messages(list(rows), request.user)
+            if not data:
+                raise NotFound()
+            return Response(data[0])
+        base = representation_cache.get_base(request, kwargs.get('format'))
+        key = representation_cache.message_key(base, kwargs['pk'])
+        data = representation_cache.get(key)
+        if data is None:
+            response = super().retrieve(request, *args, **kwargs)
+            representation_cache.set(key, without_viewer(response.data))
+            return response
+        return Response(dict(data, favorited=kwargs['pk'] in get_favorited_ids(request.user, [kwargs['pk']])))
+
+    @action(detail=True, methods=['get'], name='children')
+    def children(self, request, *args, **kwargs) -> Response:
+        parent = self.get_object()
+        queryset = self.get_queryset().filter(parent=parent)
+        if self.is_compact():
+            return self.compact_list(queryset)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'], name='thread')
+    def thread(self, request, *args, **kwargs) -> Response:
+        root = self.get_object()
+        max_depth = self.get_bounded_param('max_depth', self.thread_max_depth)
+        limit = self.get_bounded_param('limit', self.thread_limit, minimum=1)
+        messages = get_thread(root, max_depth, limit)
+        depths = {message.pk: message.depth - root.depth for message in messages}
+        messages.sort(key=lambda message: (depths[message.pk], -message.created.timestamp(), -message.pk))
+        data = self.get_serializer(messages, many=True).data
+        included_replies = Counter(message.parent_id for message in messages)
+        for message, representation in zip(messages, data):
+            representation['depth'] = depths[message.pk]
+            representation['more_replies'] = None
+            if message.reply_count > included_replies[message.pk]:
+                representation['more_replies'] = reverse('message-children', kwargs={'pk': message.pk},
+                                                         request=request)
+        subtree_count = root.get_subtree().count()
+        if request.query_params.get('flat', '').lower() == 'true':
+            return Response({'subtree_count': subtree_count, 'results': data})
+        return Response(dict(nest(messages, data), subtree_count=subtree_count))
+
+    def get_bounded_param(self, name: str, maximum: int, minimum: int = 0) -> int:
+        try:
+            value = int(self.request.query_params[name])
+        except (KeyError, ValueError):
+            return maximum
+        return min(max(value, minimum), maximum)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete_subtree()
+
     @action(detail=True, methods=['post'], name='favorite')
+    @transaction.atomic
     def favorite(self, request, *args, **kwargs) -> Response:
         Favorite.objects.get_or_create(user=request.user, message=self.get_object())
         return Response(status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['delete'], name='unfavorite')
+    @transaction.atomic
     def unfavorite(self, request, *args, **kwargs) -> Response:
         Favorite.objects.filter(user=request.user, message=self.get_object()).delete()
         return Response(status=status.HTTP_200_OK)
+
+
+class FavoriteBatch(views.APIView):
+    """
+    Favorite (POST) or unfavorite (DELETE) many messages at once, given as `{"messages": [<id>, ...]}`.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = FavoriteBatchSerializer
+
+    def get_message_ids(self, request) -> list:
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['messages']
+
+    @transaction.atomic
+    def post(self, request) -> Response:
+        ids = self.get_message_ids(request)
+        user = request.user
+        existing = set(Favorite.objects.filter(user=user, message__in=ids).values_list('message_id', flat=True))
+        created = [pk for pk in ids if pk not in existing]
+        if created:
+            # bulk_create skips the post_save receivers of `api.signals`, so their work is done here for the batch.
+            # A single favorite of the same message racing this request makes counters drift by one,
+            # which `reconcile_counters` repairs.
+            favorites = [Favorite(user=user, message_id=pk) for pk in created]
+            Favorite.objects.bulk_create(favorites, ignore_conflicts=True)
+            increment_many(Message, created, 'favorite_count')
+            refresh_user_counts_later(user.pk)
+            notify_later(Notification.FAVORITE, user.pk, created)
+            representation_cache.invalidate_messages(created, reranked=True)
+            representation_cache.invalidate_users([user.pk])
+            transaction.on_commit(lambda: [publish_favorite(favorite, 1) for favorite in favorites])
+        return Response({'messages': ids, 'created': len(created)}, status=status.HTTP_201_CREATED)
+
+    @transaction.atomic
+    def delete(self, request) -> Response:
+        ids = self.get_message_ids(request)
+        user = request.user
+        rows = list(Favorite.objects.filter(user=user, message__in=ids).values_list('pk', 'message_id'))
+        if rows:
+            # Like in `post()`, the per-row post_delete receivers of `api.signals` are skipped for the batch.
+            # A single unfavorite of the same message racing this request makes counters drift by one.
+            favorites = Favorite.objects.filter(pk__in=[pk for pk, _ in rows])
+            favorites._raw_delete(favorites.db)
+            deleted = [message_id for _, message_id in rows]
+            increment_many(Message, deleted, 'favorite_count', -1)
+            refresh_user_counts_later(user.pk)
+            representation_cache.invalidate_messages(deleted, reranked=True)
+            representation_cache.invalidate_users([user.pk])
+            transaction.on_commit(lambda: [publish_favorite(Favorite(user=user, message_id=pk), -1) for pk in deleted])
+        return Response({'messages': ids, 'deleted': len(rows)}, status=status.HTTP_200_OK)
+
+
+class BoardExport(views.APIView):
+    """
+    Staff-only streaming export of the board, see the `export_board` command.
+
+    `?tables=users,messages,favorites`, `?output=ndjson|csv`, `?gzip=true` and `?after=<id>` mirror its options.
+    """
+    permission_classes = [IsAdminUser]
+    content_types = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+    def get(self, request) -> StreamingHttpResponse:
+        params = request.query_params
+        output = params.get('output', 'ndjson')
+        compress = params.get('gzip', '').lower() == 'true'
+        try:
+            tables = get_tables(params.get('tables', ','.join(TABLES)))
+            after = int(params['after']) if 'after' in params else None
+            chunks = export_board(tables, output, after, compress)
+        except ValueError as error:
+            raise ValidationError(str(error))
+        filename = f'{"-".join(tables)}.{output}' + ('.gz' if compress else '')
+        content_type = 'application/gzip' if compress else self.content_types[output]
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class ProfileList(views.APIView):
+    """
+    Recent cProfile captures of sampled staff requests, newest first. See `API_INSTRUMENTATION`.
+    """
+    permission_classes = [IsAdminUser]
+
+    @staticmethod
+    def get(request) -> Response:
+        return Response(list(reversed(profiles)))
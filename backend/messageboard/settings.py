@@ -44,12 +44,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.instrumentation.InstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.database.ReadYourWritesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,22 +83,174 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # A second, read-only connection to the same file. In WAL mode its reads never wait for writers.
+    # This can be pointed at a PostgreSQL replica when the primary is PostgreSQL.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+}
+
+DATABASE_ROUTERS = ['api.database.PrimaryReplicaRouter']
+
+# Connection tuning and read routing, see api.database
+
+API_DATABASE = {
+    # Pragmas run on every new SQLite connection
+    'PRAGMAS': {
+        # Readers never block the writer or each other and commits append to a log
+        'journal_mode': 'wal',
+        # Sync on checkpoints only, which is safe in WAL mode
+        'synchronous': 'normal',
+        # Milliseconds a connection waits for the write lock before failing with "database is locked"
+        'busy_timeout': 5000,
+        # Page cache per connection, in KiB when negative
+        'cache_size': -65536,
+        # Bytes of the file read through memory mapping
+        'mmap_size': 268435456,
+        'temp_store': 'memory',
+    },
+    # Aliases safe requests of replica-routed views read from, opened read-only
+    'READ_ALIASES': ['replica'],
+    # Seconds a client reads from the primary after it wrote, so it sees its own writes despite replica lag
+    'STICKY_SECONDS': 5,
+    # Cache remembering which clients recently wrote, which should be shared by all workers in production
+    'CACHE_ALIAS': 'default',
+}
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# Upper bound on the number of cached API representations
+API_CACHE_MAX_ENTRIES = 10000
+
+API_CACHE_ALIAS = 'api'
+
+# Cache of the base URLs and generations the representation cache is keyed by, which must never be culled
+API_CACHE_META_ALIAS = 'api-meta'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    API_CACHE_ALIAS: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': API_CACHE_MAX_ENTRIES,
+        },
+    },
+    API_CACHE_META_ALIAS: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api-meta',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            # It only holds a few keys, so this is never reached
+            'MAX_ENTRIES': 1_000_000,
+        },
+    },
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'throttle',
+    },
+}
+
+# Server-Sent Events stream (served over ASGI)
+
+API_STREAM = {
+    # Pub/sub transport between publishers and the subscribers of every worker process
+    'BACKEND': 'api.pubsub.InMemoryBackend',
+    # Events buffered per connection before further events are dropped
+    'QUEUE_SIZE': 100,
+    # Seconds between keepalive comments on an idle connection
+    'KEEPALIVE': 15,
+    # Seconds after which a connection is closed and the client reconnects
+    'MAX_AGE': 300,
+    # Seconds EventSource clients wait before reconnecting
+    'RETRY': 3,
+}
+
+# Request instrumentation, see api.instrumentation
+
+API_INSTRUMENTATION = {
+    # Leaves the middleware out entirely when false
+    'ENABLED': True,
+    # Upper bounds in seconds of the request latency histogram buckets
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    # Report query, serializer and total time in a Server-Timing header
+    'SERVER_TIMING': True,
+    # Addresses allowed to scrape the Prometheus metrics endpoint
+    'METRICS_IPS': ['127.0.0.1', '::1'],
+    # Fraction of requests run under cProfile, of which those of staff users are kept
+    'PROFILE_SAMPLE_RATE': 0.0,
+    # Profiles kept in memory and lines of each one
+    'PROFILE_HISTORY': 20,
+    'PROFILE_LINES': 40,
+}
+
+# Request throttling, see api.throttling
+
+API_THROTTLE = {
+    # Where token buckets live: api.throttling.CacheStore (shared through a cache) or api.throttling.InMemoryStore
+    'STORE': 'api.throttling.CacheStore',
+    # Cache used by CacheStore, which should be shared by all workers in production
+    'CACHE_ALIAS': 'throttle',
+    # Buckets kept by InMemoryStore before the least recently used are dropped
+    'MAX_ENTRIES': 10000,
+}
+
+# Background jobs, see api.jobs
+
+API_JOBS = {
+    # Run jobs inline as soon as they are enqueued instead of in `run_workers`, for development and tests
+    'EAGER': False,
+    # Attempts before a job is kept as failed
+    'MAX_ATTEMPTS': 5,
+    # Seconds before the first retry, doubled for every further one up to MAX_BACKOFF
+    'BACKOFF': 2,
+    'MAX_BACKOFF': 600,
+    # Seconds after which a running job is considered abandoned by its worker and run again
+    'TIMEOUT': 300,
+    # Jobs claimed by a worker at once
+    'BATCH_SIZE': 20,
+    # Seconds an idle worker waits before polling the queue again
+    'POLL_INTERVAL': 1.0,
 }
 
 # Rest framework settings
 
 REST_FRAMEWORK = {
+    # Authentication runs before throttles, so only bearer tokens are accepted, whose claims are checked without
+    # password hashing or session lookups
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.TokenClaimsAuthentication',
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
-    )
+        'api.renderers.FastJSONRenderer',
+    ),
+    # Reverse proxies in front of the application, whose X-Forwarded-For entries are trusted by the ip throttle.
+    # With 0 clients are told apart by REMOTE_ADDR alone, since the header can be spoofed.
+    'NUM_PROXIES': 0,
+    'DEFAULT_THROTTLE_CLASSES': (
+        'api.throttling.IPThrottle',
+        'api.throttling.UserThrottle',
+        'api.throttling.WriteThrottle',
+    ),
+    # Token bucket sizes, refilled evenly over the period
+    'DEFAULT_THROTTLE_RATES': {
+        'ip': '1200/min',
+        'user': '600/min',
+        'write': '30/min',
+        'register': '5/hour',
+        'token': '10/min',
+    },
 }
 
 SIMPLE_JWT = {
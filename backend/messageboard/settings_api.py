@@ -0,0 +1,30 @@
+"""
+Lean settings profile for workers that only serve the JSON API to clients with JWT bearer tokens.
+
+Select it with `DJANGO_SETTINGS_MODULE=messageboard.settings_api`. It leaves out the admin, sessions, messages,
+static files and template stacks with their middleware, so workers boot faster and use less memory. Like the
+default profile, it authenticates with bearer tokens only. The admin keeps being served with the default
+`messageboard.settings`, e.g. by a separate process.
+"""
+
+from .settings import *  # noqa: F401, F403
+from .settings import INSTALLED_APPS, MIDDLEWARE
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in {
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+}]
+
+# Views authenticate tokens themselves and set `request.user`, so neither sessions nor the auth middleware are needed.
+# CSRF only protects cookie-authenticated requests, and framing protection only matters for HTML.
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in {
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+}]
+
+TEMPLATES = []
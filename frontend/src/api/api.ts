@@ -44,7 +44,10 @@ API.interceptors.response.use(
     if (error.config === undefined) {
       throw error;
     }
-    if (isAxiosError(error) && error.response?.status === 403) {
+    if (
+      isAxiosError(error) &&
+      (error.response?.status === 401 || error.response?.status === 403)
+    ) {
       const refreshToken = localStorage.getItem(
         LOCAL_STORAGE_REFRESH_TOKEN_IDENTIFIER
       );
@@ -86,31 +89,34 @@ export const getMessage = async (id: number): Promise<Message> => {
   return message;
 };
 
-export const getMessages = async (page = 1): Promise<Message[]> => {
-  const response = await API.get(`messages/?page=${page}`);
-  const messages = (response.data as PagedResponse<Message>).results;
-  for (const message of messages) {
+const getMessagePage = async (
+  url: string
+): Promise<PagedResponse<Message>> => {
+  const response = await API.get(url);
+  const page = response.data as PagedResponse<Message>;
+  for (const message of page.results) {
     message.created = new Date(message.created);
   }
-  return messages;
+  return page;
 };
 
-export const getPosts = async (page = 1): Promise<Message[]> => {
-  const response = await API.get(`messages/?page=${page}&posts=true`);
-  const posts = (response.data as PagedResponse<Message>).results;
-  for (const post of posts) {
-    post.created = new Date(post.created);
-  }
-  return posts;
+// Pages are keyset paginated: pass the `next` link of the previous page, or nothing for the first page.
+export const getMessages = async (
+  next?: string
+): Promise<PagedResponse<Message>> => {
+  return await getMessagePage(next ?? "messages/");
 };
 
-export const getComments = async (page = 1): Promise<Message[]> => {
-  const response = await API.get(`messages/?page=${page}&posts=false`);
-  const comments = (response.data as PagedResponse<Message>).results;
-  for (const comment of comments) {
-    comment.created = new Date(comment.created);
-  }
-  return comments;
+export const getPosts = async (
+  next?: string
+): Promise<PagedResponse<Message>> => {
+  return await getMessagePage(next ?? "messages/?posts=true");
+};
+
+export const getComments = async (
+  next?: string
+): Promise<PagedResponse<Message>> => {
+  return await getMessagePage(next ?? "messages/?posts=false");
 };
 
 export const getUser = async (id: number): Promise<User> => {
@@ -7,6 +7,7 @@ type Message = {
   parent: string | null;
   children: string[];
   favorite_count: number;
+  reply_count: number;
   favorited: boolean;
 };
 
@@ -1,5 +1,5 @@
 type PagedResponse<T> = {
-  count: number;
+  count?: number;
   next: string | null;
   previous: string | null;
   results: T[];
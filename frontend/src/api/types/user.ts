@@ -2,8 +2,12 @@ type User = {
   url: string;
   id: number;
   username: string;
-  messages: string[];
-  favorites: string[];
+  message_count: number;
+  messages: string;
+  favorite_count: number;
+  favorites: string;
+  recent_messages?: string[];
+  recent_favorites?: string[];
 };
 
 export default User;
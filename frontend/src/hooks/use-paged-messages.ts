@@ -3,7 +3,6 @@ import axios, { type AxiosError } from "axios";
 import type Message from "../api/types/message";
 
 type APIResponse = {
-  count: number;
   next: string;
   previous: string;
   results: Message[];
@@ -20,24 +20,24 @@ export const loaderFactory =
     const user = authContext.getUser();
     return await queryClient.fetchInfiniteQuery({
       queryKey: ["messages", user?.username],
-      queryFn: async ({ pageParam = 1 }) => {
+      queryFn: async ({ pageParam }: { pageParam?: string }) => {
         try {
           return await getPosts(pageParam);
         } catch (error) {
-          if (isAxiosError(error) && error.response?.status === 403) {
+          if (
+            isAxiosError(error) &&
+            (error.response?.status === 401 || error.response?.status === 403)
+          ) {
             return redirect("/home");
           }
           throw error;
         }
       },
-      getNextPageParam: (lastPage, allPages) => {
+      getNextPageParam: (lastPage) => {
         if (lastPage instanceof Response) {
           return undefined;
         }
-        if (lastPage.length === 0) {
-          return undefined;
-        }
-        return allPages.length + 1;
+        return lastPage.next ?? undefined;
       },
       staleTime: 30 * 1000,
     });
@@ -76,27 +76,27 @@ const Home: React.FC = () => {
     data,
   } = useInfiniteQuery(
     ["messages", user?.username],
-    async ({ pageParam = 1 }) => {
+    async ({ pageParam }: { pageParam?: string }) => {
       try {
         const posts = await getPosts(pageParam);
         return posts;
       } catch (error) {
-        if (isAxiosError(error) && error.response?.status === 403) {
+        if (
+          isAxiosError(error) &&
+          (error.response?.status === 401 || error.response?.status === 403)
+        ) {
           navigate("/home");
-          return [];
+          return { next: null, previous: null, results: [] };
         }
         throw error;
       }
     },
     {
-      getNextPageParam: (lastPage, allPages) => {
+      getNextPageParam: (lastPage) => {
         if (lastPage instanceof Response) {
           return undefined;
         }
-        if (lastPage.length === 0) {
-          return undefined;
-        }
-        return allPages.length + 1;
+        return lastPage.next ?? undefined;
       },
       initialData,
     }
@@ -130,9 +130,9 @@ const Home: React.FC = () => {
     throw error;
   }
 
-  const messages = data?.pages
-    .flat(1)
-    .filter((value): value is Message => !(value instanceof Response));
+  const messages = data?.pages.flatMap((page): Message[] =>
+    page instanceof Response ? [] : page.results
+  );
 
   const posts = messages?.map((message, i) => {
     if (i + 1 === messages.length) {
@@ -32,7 +32,10 @@ export const loaderFactory =
         try {
           return await getMessage(id);
         } catch (error) {
-          if (isAxiosError(error) && error.response?.status === 403) {
+          if (
+            isAxiosError(error) &&
+            (error.response?.status === 401 || error.response?.status === 403)
+          ) {
             return redirect(`/message/${id}`);
           }
           throw error;
@@ -80,7 +83,10 @@ const MessageExpanded: React.FC = () => {
         const posts = await getMessage(id);
         return posts;
       } catch (error) {
-        if (isAxiosError(error) && error.response?.status === 403) {
+        if (
+          isAxiosError(error) &&
+          (error.response?.status === 401 || error.response?.status === 403)
+        ) {
           return redirect(`/message/${id}`);
         }
         throw error;